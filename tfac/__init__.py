@@ -0,0 +1,23 @@
+"""
+Tensor factorization of MRSA patient data. Submodules are imported on first
+access, so that, e.g., importing tfac for data loading or scoring does not
+load the fitting or plotting dependencies.
+"""
+from importlib import import_module
+from pkgutil import iter_modules
+
+_SUBMODULES = tuple(
+    module.name for module in iter_modules(__path__)
+    if module.name != 'tests'
+)
+
+
+def __getattr__(name):
+    """ Imports submodules when first accessed as attributes. """
+    if name in _SUBMODULES:
+        return import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SUBMODULES))
@@ -0,0 +1,248 @@
+"""
+Saving and loading fitted models, and scoring new patients with them.
+"""
+from importlib.metadata import version, PackageNotFoundError
+import json
+from os.path import join
+import pickle
+
+import numpy as np
+import pandas as pd
+import tensorly as tl
+
+from .cmtf import OPTIMAL_RANK, fold_in
+from .dataImport import PATH_HERE, OPTIMAL_SCALING, get_factors, get_scaling, \
+    hash_file
+
+ARTIFACT_VERSION = 1
+DATA_FILES = [
+    'patient_metadata.txt',
+    'plasma_cytokines.txt',
+    'serum_cytokines.txt',
+    'rna_combat_tpm.txt.zip'
+]
+SOURCES = ['Serum', 'Plasma']
+
+
+def build_artifact(variance_scaling=OPTIMAL_SCALING, r=OPTIMAL_RANK,
+                   target='status', svc=False):
+    """
+    Fits CMTF and a classifier on its patient components, and bundles
+    everything needed to score new patients.
+
+    Parameters:
+        variance_scaling (float, default:OPTIMAL_SCALING): RNA/cytokine
+            variance scaling
+        r (int, default:OPTIMAL_RANK): number of CMTF components
+        target (str, default:'status'): patient metadata column to predict
+        svc (bool, default:False): use an SVC rather than logistic regression
+
+    Returns:
+        artifact (dict): CMTF factorization, scaling constants, column order,
+            fitted classifier and provenance metadata
+    """
+    from .predict import run_model, run_svc
+
+    t_fac, _, patient_data = get_factors(variance_scaling, r)
+    components = pd.DataFrame(
+        t_fac.factors[0],
+        index=patient_data.index,
+        columns=list(range(1, r + 1))
+    )
+    labels = patient_data.loc[:, target]
+    if svc:
+        _, model = run_svc(components, labels)
+    else:
+        _, model = run_model(components, labels)
+
+    try:
+        package_version = version('tfac')
+    except PackageNotFoundError:
+        package_version = None
+
+    return {
+        'factors': t_fac,
+        'scaling': get_scaling(variance_scaling),
+        'model': model,
+        'metadata': {
+            'artifact_version': ARTIFACT_VERSION,
+            'package_version': package_version,
+            'variance_scaling': variance_scaling,
+            'rank': r,
+            'target': target,
+            'svc': svc,
+            'patients': [int(i) for i in patient_data.index],
+            'data_hashes': {
+                name: hash_file(join(PATH_HERE, 'tfac', 'data', 'mrsa', name))
+                for name in DATA_FILES
+            }
+        }
+    }
+
+
+def save_artifact(artifact, path):
+    """
+    Saves a model artifact as a single .npz file.
+
+    Parameters:
+        artifact (dict): output of build_artifact
+        path (str): file to write
+
+    Returns:
+        None
+    """
+    t_fac = artifact['factors']
+    scaling = artifact['scaling']
+    metadata = dict(artifact['metadata'])
+    metadata['cytokines'] = scaling['cytokines']
+    metadata['rna_modules'] = scaling['rna_modules']
+
+    np.savez_compressed(
+        path,
+        metadata=np.array(json.dumps(metadata)),
+        weights=t_fac.weights,
+        subjects=t_fac.factors[0],
+        cytokines=t_fac.factors[1],
+        sources=t_fac.factors[2],
+        mFactor=t_fac.mFactor,
+        mWeights=getattr(t_fac, 'mWeights', np.ones(t_fac.rank)),
+        R2X=np.array(t_fac.R2X),
+        cyto_means=scaling['cyto_means'],
+        tensor_scale=np.array(scaling['tensor_scale']),
+        rna_means=scaling['rna_means'],
+        rna_stds=scaling['rna_stds'],
+        matrix_scale=np.array(scaling['matrix_scale']),
+        model=np.frombuffer(pickle.dumps(artifact['model']), dtype=np.uint8)
+    )
+
+
+def load_artifact(path):
+    """
+    Loads a model artifact written by save_artifact. The classifier is
+    unpickled, so only load artifacts from trusted sources.
+
+    Parameters:
+        path (str): file to read
+
+    Returns:
+        artifact (dict): CMTF factorization, scaling constants, fitted
+            classifier and provenance metadata
+    """
+    with np.load(path) as f:
+        metadata = json.loads(f['metadata'].item())
+        if metadata['artifact_version'] != ARTIFACT_VERSION:
+            raise ValueError(
+                f"Unsupported artifact version {metadata['artifact_version']}"
+            )
+
+        t_fac = tl.cp_tensor.CPTensor(
+            (f['weights'], [f['subjects'], f['cytokines'], f['sources']])
+        )
+        t_fac.mFactor = f['mFactor']
+        t_fac.mWeights = f['mWeights']
+        t_fac.R2X = float(f['R2X'])
+
+        scaling = {
+            'cytokines': metadata.pop('cytokines'),
+            'cyto_means': f['cyto_means'],
+            'tensor_scale': float(f['tensor_scale']),
+            'rna_modules': metadata.pop('rna_modules'),
+            'rna_means': f['rna_means'],
+            'rna_stds': f['rna_stds'],
+            'matrix_scale': float(f['matrix_scale'])
+        }
+        model = pickle.loads(f['model'].tobytes())
+
+    return {
+        'factors': t_fac,
+        'scaling': scaling,
+        'model': model,
+        'metadata': metadata
+    }
+
+
+def input_columns(artifact):
+    """
+    Returns the columns expected in data for scoring: '<source> <cytokine>'
+    for each cytokine in serum and plasma, then each RNA module.
+
+    Parameters:
+        artifact (dict): model artifact
+
+    Returns:
+        columns (list[str]): expected input columns
+    """
+    scaling = artifact['scaling']
+    cytokines = [
+        f'{source} {cytokine}'
+        for cytokine in scaling['cytokines']
+        for source in SOURCES
+    ]
+    return cytokines + scaling['rna_modules']
+
+
+def transform_samples(data, artifact):
+    """
+    Scales raw measurements for new samples as form_tensor scales the
+    training cohort. Missing columns are treated as unmeasured.
+
+    Parameters:
+        data (pandas.DataFrame): raw measurements; rows are samples, columns
+            are named as in input_columns
+        artifact (dict): model artifact
+
+    Returns:
+        tensor (numpy.array): samples x cytokines x sources
+        matrix (numpy.array): samples x RNA modules
+    """
+    scaling = artifact['scaling']
+    columns = input_columns(artifact)
+    data = data.reindex(columns=columns).to_numpy(dtype=float)
+
+    n_cyto = len(scaling['cytokines'])
+    tensor = data[:, :n_cyto * len(SOURCES)].reshape(-1, n_cyto, len(SOURCES))
+    il12 = scaling['cytokines'].index('IL-12(p70)')
+    tensor[:, il12, :] = np.clip(tensor[:, il12, :], 1.0, np.inf)
+    tensor = (np.log(tensor) - scaling['cyto_means'].T) * \
+        scaling['tensor_scale']
+
+    matrix = data[:, n_cyto * len(SOURCES):]
+    matrix = (matrix - scaling['rna_means']) / scaling['rna_stds'] * \
+        scaling['matrix_scale']
+
+    return tensor, matrix
+
+
+def score_samples(data, artifact):
+    """
+    Projects new samples onto the CMTF components and classifies them.
+
+    Parameters:
+        data (pandas.DataFrame): raw measurements; rows are samples, columns
+            are named as in input_columns
+        artifact (dict): model artifact
+
+    Returns:
+        scores (pandas.DataFrame): components, predicted class and probability
+            of the positive class for each sample; samples without any
+            measurements are left empty
+    """
+    tensor, matrix = transform_samples(data, artifact)
+    components = fold_in(artifact['factors'], tensor, matrix)
+    measured = np.all(np.isfinite(components), axis=1)
+
+    scores = pd.DataFrame(
+        components,
+        index=data.index,
+        columns=[f'Cmp. {i}' for i in range(1, components.shape[1] + 1)]
+    )
+    scores.loc[:, 'Prediction'] = np.nan
+    scores.loc[:, 'Probability'] = np.nan
+    if np.any(measured):
+        model = artifact['model']
+        scores.loc[measured, 'Prediction'] = \
+            model.predict(components[measured]).astype(float)
+        scores.loc[measured, 'Probability'] = \
+            model.predict_proba(components[measured])[:, -1]
+
+    return scores
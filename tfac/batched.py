@@ -0,0 +1,299 @@
+"""
+Batched CMTF. Replicates of the same shape, e.g. with different missing
+values, resampled subjects or initializations, are stacked along a leading
+axis and fit together, so that each ALS step is a few batched products and
+solves rather than a Python loop over replicates. Replicates that converge
+drop out of the batch.
+"""
+import time
+
+import numpy as np
+import tensorly as tl
+
+from .cmtf import CMTFTrace, INITIALIZERS, OPTIMAL_RANK, _lap
+from .instrument import profiled, span
+
+
+def _outer(factor):
+    """ Flattened outer product of each row of a stack of factors. """
+    outer = factor[..., :, np.newaxis] * factor[..., np.newaxis, :]
+    return outer.reshape(factor.shape[:-1] + (-1, ))
+
+
+def _kr(first, second):
+    """ Khatri-Rao product of stacks of factors, first index slowest. """
+    kr = first[:, :, np.newaxis, :] * second[:, np.newaxis, :, :]
+    return kr.reshape(first.shape[0], -1, first.shape[2])
+
+
+def _unfold(tensors, mode):
+    """ Unfolds each of a stack of tensors along mode, as tl.unfold. """
+    moved = np.moveaxis(tensors, mode + 1, 1)
+    return moved.reshape(moved.shape[:2] + (-1, ))
+
+
+def _solve(gram, rhs):
+    """
+    Solves stacked normal equations, flattened as returned by _outer. Rows
+    without any measurements are zero.
+    """
+    rank = rhs.shape[-1]
+    gram = gram.reshape(gram.shape[:-1] + (rank, rank))
+    empty = ~np.any(gram != 0.0, axis=(-2, -1))
+    gram[empty] = np.eye(rank)
+    return np.linalg.solve(gram, rhs[..., np.newaxis])[..., 0]
+
+
+class _Batch:
+    """ Stacked replicates, with missing values as zero, and their masks. """
+
+    def __init__(self, tensors, matrices):
+        self.tMask = np.isfinite(tensors)
+        self.mMask = np.isfinite(matrices)
+        self.tensors = np.where(self.tMask, tensors, 0.0)
+        self.matrices = np.where(self.mMask, matrices, 0.0)
+        self.total = np.sum(self.tensors ** 2.0, axis=(1, 2, 3)) + \
+            np.sum(self.matrices ** 2.0, axis=(1, 2))
+
+        # Unfoldings of each replicate along each mode, as tl.unfold
+        self.unfolded = [_unfold(self.tensors, m) for m in range(3)]
+        self.masks = [_unfold(self.tMask, m).astype(float) for m in range(3)]
+        self.mMaskT = self.mMask.transpose(0, 2, 1).astype(float)
+
+    def subset(self, index):
+        """ Returns the batch of the replicates in index. """
+        batch = _Batch.__new__(_Batch)
+        for name in ("tMask", "mMask", "tensors", "matrices", "total",
+                     "mMaskT"):
+            setattr(batch, name, getattr(self, name)[index])
+        batch.unfolded = [u[index] for u in self.unfolded]
+        batch.masks = [m[index] for m in self.masks]
+        return batch
+
+    def init(self, rank, name=None):
+        """
+        Subject factors from the leading singular vectors of each
+        replicate's subject unfolding and RNA, missing values as zero, or
+        from the initializer name of perform_CMTF applied to each replicate.
+        """
+        if name is not None:
+            return np.stack([
+                INITIALIZERS[name](unfolded, rank)[0]
+                for unfolded in self.unfoldings()
+            ])
+
+        unfolded = np.concatenate((self.unfolded[0], self.matrices), axis=2)
+        u, s, _ = np.linalg.svd(unfolded, full_matrices=False)
+        factors = np.zeros(u.shape[:2] + (rank, ))
+        width = min(rank, s.shape[1])
+        factors[:, :, :width] = u[:, :, :width] * s[:, np.newaxis, :width]
+        return factors
+
+    def unfoldings(self):
+        """ Subject unfolding and RNA of each replicate, missing as NaN. """
+        unfolded = np.concatenate((self.unfolded[0], self.matrices), axis=2)
+        mask = np.concatenate((self.masks[0], self.mMask), axis=2)
+        return np.where(mask, unfolded, np.nan)
+
+    def solve_mode(self, factors, mode):
+        """ Solves for the factors of mode 1 or 2 of every replicate. """
+        others = [factors[m] for m in range(3) if m != mode]
+        kr = _kr(*others)
+        gram = self.masks[mode] @ _outer(kr)
+        return _solve(gram, self.unfolded[mode] @ kr)
+
+    def solve_mFactor(self, subjects):
+        """ Solves for the RNA factors of every replicate. """
+        gram = self.mMaskT @ _outer(subjects)
+        rhs = self.matrices.transpose(0, 2, 1) @ subjects
+        return _solve(gram, rhs)
+
+    def solve_subjects(self, factors, mFactor):
+        """ Solves for the subject factors of every replicate. """
+        kr = _kr(factors[1], factors[2])
+        gram = self.masks[0] @ _outer(kr) + \
+            self.mMask.astype(float) @ _outer(mFactor)
+        rhs = self.unfolded[0] @ kr + self.matrices @ mFactor
+        return _solve(gram, rhs)
+
+    def R2X(self, factors, mFactor):
+        """ R2X of every replicate over its measured values. """
+        recon = np.einsum("bir,bjr,bkr->bijk", *factors, optimize=True)
+        error = np.sum(((recon - self.tensors) * self.tMask) ** 2.0,
+                       axis=(1, 2, 3))
+        recon = factors[0] @ mFactor.transpose(0, 2, 1)
+        error += np.sum(((recon - self.matrices) * self.mMask) ** 2.0,
+                        axis=(1, 2))
+        return 1.0 - error / self.total
+
+
+@profiled
+def perform_CMTF_batched(tensors, matrices, r=OPTIMAL_RANK, tol=1e-6,
+                         maxiter=300, linesearch=True, init=None,
+                         max_seconds=None):
+    """
+    Performs CMTF, as perform_CMTF does, on a batch of replicates at once.
+    Each replicate has its own line search acceleration and stops once it
+    converges, while the others continue. By default the subject factors
+    are initialized from the SVD of the subject unfolding and RNA of each
+    replicate, with missing values as zero, which is batched; a name in
+    INITIALIZERS, e.g. 'pca' as perform_CMTF uses, initializes each
+    replicate in turn instead. Each
+    replicate's trace records the time of the steps of its batch. If
+    another iteration would exceed max_seconds, the remaining replicates
+    stop. Each replicate's best iterate is returned.
+
+    Parameters:
+        tensors (numpy.array): replicates x subjects x cytokines x sources
+        matrices (numpy.array): replicates x subjects x RNA modules; a
+            matrix is broadcast to every replicate
+        r (int, default: OPTIMAL_RANK): number of components
+        tol (float, default: 1e-6): R2X improvement at convergence
+        maxiter (int, default: 300): most iterations
+        linesearch (bool, default: True): use line search acceleration
+        init (str or numpy.array, default: None): a name in INITIALIZERS,
+            or replicates x subjects x r initial subject factors
+        max_seconds (float, default: None): seconds for the whole batch
+
+    Returns:
+        tFacs (list[CPTensor]): factorization of each replicate, with R2X
+            and trace attributes
+    """
+    from tensorpack.cmtf import cp_normalize, reorient_factors, sort_factors
+
+    tensors = np.asarray(tensors, dtype=float)
+    matrices = np.asarray(matrices, dtype=float)
+    assert tensors.ndim == 4
+    n_batch = tensors.shape[0]
+    if matrices.ndim == 2:
+        matrices = np.broadcast_to(matrices, (n_batch, ) + matrices.shape)
+    assert matrices.shape[:2] == tensors.shape[:2]
+
+    start = time.perf_counter()
+    data = _Batch(tensors, matrices)
+    lap = time.perf_counter()
+    with span("perform_CMTF_batched.init"):
+        if init is None or isinstance(init, str):
+            subjects = data.init(r, init)
+        else:
+            subjects = np.array(init, dtype=float)
+    init_time, _ = _lap(lap)
+    factors = [subjects] + [np.ones((n_batch, n, r)) for n in tensors.shape[2:]]
+    mFactor = np.zeros((n_batch, matrices.shape[2], r))
+    R2X = np.full(n_batch, -np.inf)
+    best_R2X = np.full(n_batch, -np.inf)
+    best = [f.copy() for f in factors] + [mFactor.copy()]
+
+    acc_pow = np.full(n_batch, 2.0)  # Extrapolate to iteration^(1/acc_pow)
+    acc_fail = np.zeros(n_batch, dtype=int)  # Failed accelerations
+    max_fail = 4  # Increase acc_pow with one after max_fail failure
+
+    traces = [CMTFTrace(maxiter) for _ in range(n_batch)]
+    for trace in traces:
+        trace.stop_reason = "maxiter"
+        trace.init = "svd" if init is None else \
+            init if isinstance(init, str) else "given"
+        trace.init_time = init_time
+    active = np.arange(n_batch)
+    batch = data
+    with span("perform_CMTF_batched.als"):
+        for iter in range(maxiter):
+            # Work on the replicates still running
+            fs = [f[active] for f in factors]
+            fs_old = [f.copy() for f in fs]
+            times = np.zeros(len(CMTFTrace.PHASES))
+            lap = time.perf_counter()
+
+            for m in [1, 2]:
+                fs[m] = batch.solve_mode(fs, m)
+            times[0], lap = _lap(lap)
+
+            mF = batch.solve_mFactor(fs[0])
+            times[1], lap = _lap(lap)
+
+            fs[0] = batch.solve_subjects(fs, mF)
+            times[2], lap = _lap(lap)
+
+            R2X_last = R2X[active]
+            R2X_new = batch.R2X(fs, mF)
+            times[3], lap = _lap(lap)
+
+            # Initiate line search
+            jump = np.full(active.size, np.nan)
+            accepted = np.zeros(active.size, dtype=bool)
+            if linesearch and iter % 2 == 0 and iter > 3:
+                jump = iter ** (1.0 / acc_pow[active])
+                fs_ls = [
+                    old + (f - old) * jump[:, np.newaxis, np.newaxis]
+                    for f, old in zip(fs, fs_old)
+                ]
+                R2X_ls = batch.R2X(fs_ls, mF)
+
+                accepted = R2X_ls > R2X_new
+                for ii in range(3):
+                    fs[ii][accepted] = fs_ls[ii][accepted]
+                R2X_new[accepted] = R2X_ls[accepted]
+
+                failed = active[~accepted]
+                acc_fail[active[accepted]] = 0
+                acc_fail[failed] += 1
+                raised = failed[acc_fail[failed] == max_fail]
+                acc_pow[raised] += 1.0
+                acc_fail[raised] = 0
+            times[4], lap = _lap(lap)
+
+            for ii in range(3):
+                factors[ii][active] = fs[ii]
+            mFactor[active] = mF
+            R2X[active] = R2X_new
+            assert np.all(R2X_new > 0.0)
+
+            improved = active[R2X_new > best_R2X[active]]
+            best_R2X[improved] = R2X[improved]
+            for ii, f in enumerate(factors + [mFactor]):
+                best[ii][improved] = f[improved]
+
+            for jj, b in enumerate(active):
+                trace = traces[b]
+                trace.R2X[iter] = R2X_new[jj]
+                trace.delta[iter] = R2X_new[jj] - R2X_last[jj]
+                trace.jump[iter] = jump[jj]
+                trace.accepted[iter] = accepted[jj]
+                if np.isfinite(jump[jj]):
+                    trace.acc_pow[iter] = acc_pow[b]
+                trace.timings[iter] = times
+                trace.n_iter = iter + 1
+                if b in improved:
+                    trace.best_iter = iter
+
+            done = R2X_new - R2X_last < tol
+            for b in active[done]:
+                traces[b].stop_reason = "converged"
+            if np.any(done):
+                active = active[~done]
+                if active.size == 0:
+                    break
+                batch = data.subset(active)
+
+            # Stop if another iteration, at the mean pace so far, would not fit
+            elapsed = time.perf_counter() - start
+            if max_seconds is not None and \
+                    elapsed * (iter + 2) / (iter + 1) > max_seconds:
+                for b in active:
+                    traces[b].stop_reason = "max_seconds"
+                break
+
+    tFacs = []
+    for b in range(n_batch):
+        traces[b]._trim()
+        assert not np.all(best[3][b] == 0.0)
+        tFac = tl.cp_tensor.CPTensor((None, [f[b] for f in best[:3]]))
+        tFac.mFactor = best[3][b]
+        tFac = cp_normalize(tFac)
+        tFac = reorient_factors(tFac)
+        tFac = sort_factors(tFac)
+        tFac.R2X = best_R2X[b]
+        tFac.trace = traces[b]
+        tFacs.append(tFac)
+
+    return tFacs
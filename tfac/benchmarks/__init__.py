@@ -0,0 +1,8 @@
+"""
+Benchmarks for the CMTF, imputation, prediction and data import hot paths.
+
+Run with python -m tfac.benchmarks; see --help for options.
+"""
+from .cases import CASES, block_types, synthetic_labels
+from .harness import case_key, compare, load_results, run_benchmarks, \
+    run_case, save_results
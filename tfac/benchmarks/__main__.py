@@ -0,0 +1,56 @@
+"""
+Command line entry point for the benchmarks.
+"""
+import argparse
+import sys
+
+from .cases import CASES
+from .harness import compare, load_results, run_benchmarks, save_results
+
+
+def main(argv=None):
+    """ Runs the benchmarks and optionally compares them to a baseline. """
+    parser = argparse.ArgumentParser(prog='python -m tfac.benchmarks')
+    parser.add_argument(
+        'cases',
+        nargs='*',
+        help=f"cases to run, of {', '.join(CASES)}; defaults to all"
+    )
+    parser.add_argument('-o', '--output', default='benchmarks.json')
+    parser.add_argument('-k', '--match', help='only run matching parameters')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', help='earlier results to compare to')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(
+        args.cases or None,
+        repeat=args.repeat,
+        match=args.match
+    )
+    save_results(results, args.output)
+    for result in results['results']:
+        if 'error' in result:
+            print(f"{result['key']}: {result['error']}")
+        else:
+            print(f"{result['key']}: {result['wall']:.3f} s, "
+                  f"{result['peak_mb']:.1f} MB")
+
+    if args.baseline is None:
+        return 0
+
+    comparison = compare(results, load_results(args.baseline), args.threshold)
+    regressed = [c for c in comparison if c['regressed']]
+    for entry in comparison:
+        flag = 'REGRESSED' if entry['regressed'] else 'ok'
+        print(f"{entry['key']}: time x{entry['wall_ratio']:.2f}, "
+              f"memory x{entry['memory_ratio']:.2f} {flag}")
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Benchmark cases. Each case builds its inputs from synthetic data, so that
+cases run offline and without the study data, except form_tensor, which
+reads the data files in the repository. Cohorts come from
+synthetic.generate_cohort, with each data block missing for a fraction of
+subjects, except cohort_CMTF, whose block missingness follows the study's
+data types, and which also reports recovery of the true factors; init_CMTF
+compares the time to tolerance of each initialization.
+"""
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from .. import dataImport
+from ..cmtf import perform_CMTF
+from ..batched import perform_CMTF_batched
+from ..chunked import perform_CMTF_chunked
+from ..coupled import perform_coupled
+from ..impute import gen_missing, impute_accuracy
+from ..predict import run_model, run_svc
+from ..sketched import perform_CMTF_sketched
+from ..synthetic import generate_cohort, recovery_scores
+
+
+def block_types(missing):
+    """
+    Relative frequency of each data type when the serum, plasma and RNA
+    blocks are each missing for a fraction of subjects, independently, for
+    synthetic.generate_cohort. Subjects keep at least one block.
+
+    Parameters:
+        missing (float): fraction of subjects missing each block
+
+    Returns:
+        type_counts (dict): data type: relative frequency
+    """
+    names = ('0Serum', '1Plasma', '2RNAseq')
+    type_counts = {}
+    for measured in product((True, False), repeat=len(names)):
+        if any(measured):
+            name = ''.join(n for n, m in zip(names, measured) if m)
+            type_counts[name] = np.prod(
+                [1.0 - missing if m else missing for m in measured]
+            )
+    return type_counts
+
+
+def synthetic_labels(n_subjects, n_components=8, seed=0):
+    """
+    Generates components and binary labels that depend on them.
+
+    Parameters:
+        n_subjects (int): subjects
+        n_components (int, default: 8): components per subject
+        seed (int, default: 0): random seed
+
+    Returns:
+        data (pandas.DataFrame): subjects x components
+        labels (pandas.Series): binary labels
+    """
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.standard_normal((n_subjects, n_components)))
+    logits = data.iloc[:, :2].sum(axis=1) + rng.standard_normal(n_subjects)
+    labels = (logits > 0).astype(int)
+    return data, labels
+
+
+def _cmtf(rank, n_subjects, missing, dtype):
+    tensor, matrix, _, _ = generate_cohort(
+        n_subjects,
+        rank=rank,
+        type_counts=block_types(missing),
+        dtype=dtype,
+        seed=0
+    )
+
+    def run():
+        np.random.seed(0)
+        tFac, _ = perform_CMTF(tensor, matrix, r=rank, progress=False)
+        return {'iterations': tFac.trace.n_iter, 'R2X': float(tFac.R2X)}
+
+    return run
+
+
+def _cohort_cmtf(rank, n_subjects):
+    tensor, matrix, _, truth = generate_cohort(n_subjects, rank=rank, seed=0)
+
+    def run():
+        np.random.seed(0)
+        tFac, _ = perform_CMTF(tensor, matrix, r=rank, progress=False)
+        return {
+            'iterations': tFac.trace.n_iter,
+            'R2X': float(tFac.R2X),
+            'FMS': recovery_scores(tFac, truth)['FMS']
+        }
+
+    return run
+
+
+def _init_cmtf(rank, n_subjects, init):
+    tensor, matrix, _, truth = generate_cohort(n_subjects, rank=rank, seed=0)
+
+    def run():
+        np.random.seed(0)
+        tFac, _ = perform_CMTF(
+            tensor, matrix, r=rank, progress=False, init=init
+        )
+        return {
+            'iterations': tFac.trace.n_iter,
+            'init_seconds': tFac.trace.init_time,
+            'R2X': float(tFac.R2X),
+            'FMS': recovery_scores(tFac, truth)['FMS']
+        }
+
+    return run
+
+
+def _coupled(rank, n_subjects, n_matrices):
+    tensor, matrix, _, _ = generate_cohort(
+        n_subjects, rank=rank, type_counts=block_types(0.2), seed=0
+    )
+    rng = np.random.default_rng(1)
+    matrices = [(0, matrix)] + [
+        (0, matrix @ rng.standard_normal((matrix.shape[1],) * 2))
+        for _ in range(n_matrices - 1)
+    ]
+
+    def run():
+        tFac = perform_coupled(tensor, matrices, r=rank, seed=0)
+        return {'iterations': tFac.trace.n_iter, 'R2X': float(tFac.R2X)}
+
+    return run
+
+
+def _sketched_cmtf(rank, n_subjects, n_modules, method):
+    tensor, matrix, _, truth = generate_cohort(
+        n_subjects, n_modules=n_modules, rank=rank, seed=0
+    )
+    solver = {
+        'exact': perform_CMTF_chunked,
+        'sketched': perform_CMTF_sketched
+    }[method]
+
+    def run():
+        tFac = solver(tensor, matrix, r=rank, seed=0)
+        return {
+            'iterations': tFac.trace.n_iter,
+            'sketched_iterations': int(np.sum(tFac.trace.sketch > 0)),
+            'R2X': float(tFac.R2X),
+            'FMS': recovery_scores(tFac, truth)['FMS']
+        }
+
+    return run
+
+
+def _batched_cmtf(rank, replicates, method):
+    tensor, matrix, _, _ = generate_cohort(rank=rank, seed=0)
+    np.random.seed(0)
+    n_missing = int(np.sum(np.isfinite(tensor)) * 0.1)
+    tensors = np.stack([
+        gen_missing(tensor, n_missing) for _ in range(replicates)
+    ])
+
+    def run():
+        np.random.seed(0)
+        if method == 'batched':
+            tFacs = perform_CMTF_batched(tensors, matrix, r=rank)
+        else:
+            tFacs = [
+                perform_CMTF(missing, matrix, r=rank, progress=False)[0]
+                for missing in tensors
+            ]
+        return {
+            'iterations': int(sum(tFac.trace.n_iter for tFac in tFacs)),
+            'R2X': float(np.mean([tFac.R2X for tFac in tFacs]))
+        }
+
+    return run
+
+
+def _gen_missing(n_subjects, missing_fraction):
+    tensor, _, _, _ = generate_cohort(
+        n_subjects, rank=3, type_counts=block_types(0.2), seed=0
+    )
+    n_missing = int(np.sum(np.isfinite(tensor)) * missing_fraction)
+
+    def run():
+        np.random.seed(0)
+        gen_missing(tensor, n_missing)
+
+    return run
+
+
+def _impute_accuracy(rank, n_subjects, missing_fraction):
+    tensor, matrix, _, _ = generate_cohort(
+        n_subjects, rank=rank, type_counts=block_types(0.2), seed=0
+    )
+    np.random.seed(0)
+    missing = gen_missing(
+        tensor,
+        int(np.sum(np.isfinite(tensor)) * missing_fraction)
+    )
+
+    def run():
+        np.random.seed(0)
+        cmtf, _ = impute_accuracy(
+            missing,
+            matrix,
+            np.array([rank]),
+            PCAcompare=False,
+            cube=tensor,
+            glyCube=matrix
+        )
+        return {'R2X': float(cmtf[0])}
+
+    return run
+
+
+def _run_model(n_subjects):
+    data, labels = synthetic_labels(n_subjects)
+
+    def run():
+        np.random.seed(0)
+        score, _ = run_model(data, labels)
+        return {'accuracy': float(score)}
+
+    return run
+
+
+def _run_svc(n_subjects):
+    data, labels = synthetic_labels(n_subjects)
+
+    def run():
+        score, _ = run_svc(data, labels)
+        return {'accuracy': float(score)}
+
+    return run
+
+
+def _form_tensor(variance_scaling):
+    def run():
+        for name in ('import_patient_metadata', 'import_cytokines',
+                     '_scaled_rna', 'form_tensor'):
+            getattr(dataImport, name).cache_clear()
+        dataImport.form_tensor(variance_scaling)
+
+    return run
+
+
+def _grid(**params):
+    """ Returns every combination of the given parameter values. """
+    return [dict(zip(params, values)) for values in product(*params.values())]
+
+
+# name: (setup returning the callable to time, parameter sets)
+CASES = {
+    'perform_CMTF': (
+        _cmtf,
+        _grid(
+            rank=[3, 8],
+            n_subjects=[150, 1000],
+            missing=[0.1, 0.5],
+            dtype=['float64', 'float32']
+        )
+    ),
+    'cohort_CMTF': (_cohort_cmtf, _grid(rank=[8], n_subjects=[177, 1000])),
+    'init_CMTF': (
+        _init_cmtf,
+        _grid(
+            rank=[8],
+            n_subjects=[177, 1000],
+            init=['pca', 'svd', 'em', 'random']
+        )
+    ),
+    'perform_coupled': (
+        _coupled,
+        _grid(rank=[8], n_subjects=[150, 1000], n_matrices=[1, 3])
+    ),
+    'sketched_CMTF': (
+        _sketched_cmtf,
+        _grid(
+            rank=[8],
+            n_subjects=[2000, 20000],
+            n_modules=[40],
+            method=['exact', 'sketched']
+        )
+    ),
+    'batched_CMTF': (
+        _batched_cmtf,
+        _grid(rank=[3, 8], replicates=[10], method=['loop', 'batched'])
+    ),
+    'gen_missing': (
+        _gen_missing,
+        _grid(n_subjects=[150, 1000], missing_fraction=[0.1, 0.5])
+    ),
+    'impute_accuracy': (
+        _impute_accuracy,
+        _grid(rank=[3, 8], n_subjects=[150], missing_fraction=[0.1, 0.5])
+    ),
+    'run_model': (_run_model, _grid(n_subjects=[100, 300])),
+    'run_svc': (_run_svc, _grid(n_subjects=[100, 300])),
+    'form_tensor': (_form_tensor, _grid(variance_scaling=[2 ** 7.0]))
+}
@@ -0,0 +1,146 @@
+"""
+Runs benchmark cases and compares their results against a baseline.
+"""
+from datetime import datetime, timezone
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from .cases import CASES
+
+
+def case_key(name, params):
+    """
+    Returns the identifier of a case and parameter set, e.g.
+    'perform_CMTF[rank=3,n_subjects=150]'.
+    """
+    values = ','.join(f'{key}={value}' for key, value in params.items())
+    return f'{name}[{values}]'
+
+
+def run_case(name, params, repeat=3):
+    """
+    Times one benchmark case. Inputs are built once; the timed callable is
+    then run repeat times, and once more under tracemalloc to measure memory,
+    as tracing slows it down.
+
+    Parameters:
+        name (str): case name in CASES
+        params (dict): case parameters
+        repeat (int, default: 3): timed runs
+
+    Returns:
+        result (dict): wall time of the fastest and each run, peak traced
+            memory in megabytes and any values reported by the case, such as
+            iterations; or the error raised, if the case could not run
+    """
+    result = {'key': case_key(name, params), 'case': name, 'params': params}
+    try:
+        run = CASES[name][0](**params)
+        walls = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = run()
+            walls.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except (OSError, ValueError, AssertionError) as err:
+        result['error'] = repr(err)
+        return result
+
+    result['wall'] = min(walls)
+    result['walls'] = walls
+    result['peak_mb'] = peak / (1 << 20)
+    result.update(output or {})
+    return result
+
+
+def run_benchmarks(names=None, repeat=3, match=None):
+    """
+    Runs benchmark cases.
+
+    Parameters:
+        names (list[str], default: None): cases to run; defaults to all
+        repeat (int, default: 3): timed runs per case
+        match (str, default: None): only run parameter sets whose key
+            contains this string
+
+    Returns:
+        results (dict): environment information and the result of each case
+    """
+    if names is None:
+        names = list(CASES)
+
+    results = []
+    for name in names:
+        for params in CASES[name][1]:
+            if match is not None and match not in case_key(name, params):
+                continue
+            results.append(run_case(name, params, repeat=repeat))
+
+    return {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor()
+        },
+        'results': results
+    }
+
+
+def save_results(results, path):
+    """ Writes benchmark results to a JSON file. """
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    """ Reads benchmark results from a JSON file. """
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compares benchmark results against a baseline.
+
+    Parameters:
+        results (dict): output of run_benchmarks
+        baseline (dict): earlier output of run_benchmarks
+        threshold (float, default: 0.2): relative slowdown in wall time, or
+            growth in peak memory, counted as a regression
+
+    Returns:
+        comparison (list[dict]): for each case in both, its key, wall time
+            and peak memory ratios to the baseline, and whether it regressed
+    """
+    previous = {
+        result['key']: result for result in baseline['results']
+        if 'error' not in result
+    }
+    comparison = []
+    for result in results['results']:
+        before = previous.get(result['key'])
+        if before is None or 'error' in result:
+            continue
+
+        wall = result['wall'] / before['wall']
+        memory = result['peak_mb'] / max(before['peak_mb'], 1E-9)
+        comparison.append({
+            'key': result['key'],
+            'wall_ratio': wall,
+            'memory_ratio': memory,
+            'regressed': bool(wall > 1 + threshold or memory > 1 + threshold)
+        })
+
+    return comparison
@@ -0,0 +1,205 @@
+"""
+Checkpoints of long fits and sweeps. State is written atomically to a
+compressed .npz file, so that a run killed at any point restarts from its
+last checkpoint and continues exactly as it would have, down to numpy's
+global random state.
+"""
+import os
+import time
+
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+
+def rng_state(prefix="rng"):
+    """
+    Returns numpy's global random state as arrays.
+
+    Parameters:
+        prefix (str, default: 'rng'): prefix of the array names
+
+    Returns:
+        state (dict): arrays of the random state
+    """
+    _, keys, pos, has_gauss, gauss = np.random.get_state()
+    return {
+        f"{prefix}_keys": keys,
+        f"{prefix}_other": np.array([pos, has_gauss, gauss])
+    }
+
+
+def set_rng_state(state, prefix="rng"):
+    """
+    Restores numpy's global random state from arrays of rng_state.
+
+    Parameters:
+        state (dict): arrays, e.g. a loaded checkpoint
+        prefix (str, default: 'rng'): prefix of the array names
+    """
+    pos, has_gauss, gauss = state[f"{prefix}_other"]
+    np.random.set_state(
+        ("MT19937", state[f"{prefix}_keys"], int(pos), int(has_gauss),
+         float(gauss))
+    )
+
+
+class Checkpoint:
+    """
+    Periodic checkpoints to a .npz file, every so many iterations or
+    seconds, whichever comes first.
+    """
+
+    def __init__(self, path, every=None, seconds=None):
+        """
+        Parameters:
+            path (str): file to write; its directory is created if needed
+            every (int, default: None): iterations between checkpoints;
+                defaults to 10 unless seconds is given
+            seconds (float, default: None): seconds between checkpoints
+        """
+        if every is None and seconds is None:
+            every = 10
+        self.path = os.fspath(path)
+        self.every = every
+        self.seconds = seconds
+        self._last = time.perf_counter()
+
+    def due(self, iteration):
+        """
+        Whether a checkpoint is due after an iteration.
+
+        Parameters:
+            iteration (int): iteration just completed, from 0
+
+        Returns:
+            due (bool): whether to save
+        """
+        if self.every is not None and (iteration + 1) % self.every == 0:
+            return True
+        return self.seconds is not None and \
+            time.perf_counter() - self._last >= self.seconds
+
+    def save(self, **arrays):
+        """
+        Writes arrays, replacing the previous checkpoint only once the new
+        one is complete.
+
+        Parameters:
+            arrays: arrays to store, by name
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f,
+                checkpoint_version=np.array(CHECKPOINT_VERSION),
+                **arrays
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._last = time.perf_counter()
+
+    def load(self):
+        """
+        Reads the last checkpoint.
+
+        Returns:
+            arrays (dict): stored arrays, or None if there is no checkpoint
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        with np.load(self.path) as f:
+            arrays = dict(f)
+        version = int(arrays.pop("checkpoint_version"))
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {version}")
+        return arrays
+
+    def remove(self):
+        """ Deletes the checkpoint, once the run it belongs to is done. """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Sweep:
+    """
+    A resumable loop. The results so far, the position in the loop and the
+    random state are checkpointed, so that a restarted sweep skips the items
+    already done and gives the same results as an uninterrupted one.
+    """
+
+    def __init__(self, path, every=1, seconds=None, keep=False):
+        """
+        Parameters:
+            path (str): checkpoint file
+            every (int, default: 1): items between checkpoints
+            seconds (float, default: None): seconds between checkpoints
+            keep (bool, default: False): keep the checkpoint once the sweep
+                is done, so that running it again only reads the results
+        """
+        self.checkpoint = Checkpoint(path, every=every, seconds=seconds)
+        self.keep = keep
+
+    def run(self, func, items, max_seconds=None, costs=None):
+        """
+        Calls func on each item, in order. With max_seconds, func is called
+        as func(item, seconds), and the budget of this run is split over the
+        items left by cmtf.split_budget.
+
+        Parameters:
+            func (callable): takes an item and returns a sequence of numbers
+            items (sequence): numbers to sweep over
+            max_seconds (float, default: None): seconds for the sweep
+            costs (sequence, default: None): relative cost of each item;
+                defaults to equal costs
+
+        Returns:
+            results (numpy.array): items x outputs of func
+        """
+        items = np.asarray(items)
+        results = None
+        position = 0
+
+        state = self.checkpoint.load()
+        if state is not None:
+            if not np.array_equal(state["items"], items):
+                raise ValueError(
+                    f"Checkpoint {self.checkpoint.path} is of another sweep"
+                )
+            results = state["results"]
+            position = int(state["position"])
+            set_rng_state(state)
+
+        if max_seconds is not None:
+            from .cmtf import split_budget
+
+            costs = np.ones(items.size) if costs is None \
+                else np.asarray(costs)
+            budgets = split_budget(max_seconds, costs[position:])
+
+        for ii in range(position, items.size):
+            if max_seconds is None:
+                result = func(items[ii])
+            else:
+                result = func(items[ii], next(budgets))
+            result = np.asarray(result, dtype=float).ravel()
+            if results is None:
+                results = np.full((items.size, result.size), np.nan)
+            results[ii] = result
+
+            if ii + 1 < items.size and self.checkpoint.due(ii) or \
+                    ii + 1 == items.size and self.keep:
+                self.checkpoint.save(
+                    items=items,
+                    results=results,
+                    position=np.array(ii + 1),
+                    **rng_state()
+                )
+
+        if not self.keep:
+            self.checkpoint.remove()
+        return results
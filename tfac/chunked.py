@@ -0,0 +1,450 @@
+"""
+Out-of-core CMTF. The tensor and RNA matrix, e.g. numpy.memmap arrays, are
+read in blocks of subjects and RNA columns, and each least squares solve is
+assembled from Gram matrices and right-hand sides accumulated block by
+block. Apart from the factors themselves, memory use is proportional to the
+block size times the rank.
+"""
+import time
+
+import numpy as np
+import tensorly as tl
+from tensorly.tenalg.core_tenalg import khatri_rao
+
+from .cmtf import CMTFTrace, OPTIMAL_RANK, _Budget, _lap
+from .instrument import profiled, span
+
+
+def _blocks(n, size):
+    """ Yields slices covering range(n) in blocks of size. """
+    for start in range(0, n, size):
+        yield slice(start, min(start + size, n))
+
+
+def _read(data, rows, cols=None):
+    """ Reads a block as float64, with a mask of measured values. """
+    block = np.asarray(data[rows] if cols is None else data[rows, cols])
+    block = block.astype(float)
+    mask = np.isfinite(block)
+    block[~mask] = 0.0
+    return block, mask
+
+
+def mask_patterns(mask):
+    """
+    Groups the rows of mask by pattern, for masked_gram.
+
+    Parameters:
+        mask (numpy.array): rows x columns; whether each value is measured
+
+    Returns:
+        patterns (numpy.array): unique rows of mask, as float
+        inverse (numpy.array): pattern of each row
+    """
+    # Compare packed rows as single opaque values, which is much faster than
+    # np.unique(axis=0) for wide masks
+    packed = np.ascontiguousarray(np.packbits(mask, axis=1))
+    packed = packed.view(np.dtype((np.void, packed.shape[1]))).reshape(-1)
+    _, first, inverse = np.unique(
+        packed,
+        return_index=True,
+        return_inverse=True
+    )
+    return mask[first].astype(float), inverse.reshape(-1)
+
+
+def masked_gram(mask, factor, patterns=None):
+    """
+    For each row of mask, the Gram matrix of the rows of factor that are
+    measured. Rows of mask sharing a pattern are computed together.
+
+    Parameters:
+        mask (numpy.array): rows x columns; whether each value is measured
+        factor (numpy.array): columns x rank
+        patterns (tuple, default: None): mask_patterns(mask), if computed
+
+    Returns:
+        gram (numpy.array): rows x rank x rank
+    """
+    if patterns is None:
+        patterns = mask_patterns(mask)
+    unique, inverse = patterns
+    rank = factor.shape[1]
+    if unique.shape[0] < rank:
+        # Few patterns: one weighted product per pattern
+        weighted = unique[:, :, np.newaxis] * factor
+        gram = np.matmul(weighted.transpose(0, 2, 1), factor)
+    else:
+        # Many patterns: one product with the flattened outer products
+        outer = factor[:, :, np.newaxis] * factor[:, np.newaxis, :]
+        gram = (unique @ outer.reshape(factor.shape[0], -1))
+        gram = gram.reshape(-1, rank, rank)
+    return gram[inverse]
+
+
+def _solve(gram, rhs):
+    """ Solves a stack of normal equations; unmeasured rows are left zero. """
+    x = np.zeros(rhs.shape)
+    solvable = np.any(gram != 0.0, axis=(1, 2))
+    x[solvable] = np.linalg.solve(
+        gram[solvable],
+        rhs[solvable, :, np.newaxis]
+    )[:, :, 0]
+    return x
+
+
+class _Problem:
+    """
+    Blockwise access to the tensor and RNA matrix. The tensor is read
+    through the _tensor methods, which sparse.SparseProblem overrides.
+    """
+
+    def __init__(self, tOrig, mOrig, chunk_size, column_chunk_size):
+        self.tOrig = tOrig
+        self.mOrig = mOrig
+        self.shape = tOrig.shape
+        self.rows = list(_blocks(self.shape[0], chunk_size))
+        self.cols = list(_blocks(mOrig.shape[1], column_chunk_size))
+
+        # Rows with complete RNA, used to solve for the RNA factors, and the
+        # total sum of squares, for R2X
+        self.complete = np.ones(self.shape[0], dtype=bool)
+        self.total = 0.0
+        for rows in self.rows:
+            self.total += self._tensor_sumsq(rows)
+            for cols in self.cols:
+                matrix, mask = _read(mOrig, rows, cols)
+                self.complete[rows] &= np.all(mask, axis=1)
+                self.total += np.sum(matrix ** 2.0)
+
+        assert np.sum(self.complete) >= 1, \
+            "mOrig must contain at least one complete row"
+
+    def _tensor_sumsq(self, rows):
+        """ Sum of squares of the measured tensor values for rows. """
+        tensor, _ = _read(self.tOrig, rows)
+        return np.sum(tensor ** 2.0)
+
+    def _tensor_mode(self, rows, factors, mode):
+        """ Gram matrices and right-hand sides for a non-subject mode. """
+        tensor, mask = _read(self.tOrig, rows)
+        tensor = tl.unfold(tensor, mode)
+        mask = tl.unfold(mask, mode)
+
+        # Khatri-Rao rows of the subjects and the other modes, in the column
+        # order of the unfolding
+        others = [f for ii, f in enumerate(factors) if ii != mode]
+        others[0] = others[0][rows]
+        kr = khatri_rao(others)
+        return masked_gram(mask, kr), tensor @ kr
+
+    def _tensor_subjects(self, rows, factors):
+        """ Gram matrices and right-hand sides for the subjects in rows. """
+        kr = khatri_rao(factors, skip_matrix=0)
+        tensor, mask = _read(self.tOrig, rows)
+        tensor = tensor.reshape(tensor.shape[0], -1)
+        mask = mask.reshape(mask.shape[0], -1)
+        return masked_gram(mask, kr), tensor @ kr
+
+    def _tensor_error(self, rows, factors):
+        """ Squared error of the factors over the measured values in rows. """
+        tensor, mask = _read(self.tOrig, rows)
+        recon = tl.cp_to_tensor((None, [factors[0][rows]] + factors[1:]))
+        return np.sum(((recon - tensor) * mask) ** 2.0)
+
+    def _tensor_project(self, rows, omega):
+        """ Subject unfolding of rows, missing values as zero, times omega. """
+        tensor, _ = _read(self.tOrig, rows)
+        return tensor.reshape(tensor.shape[0], -1) @ omega
+
+    def _tensor_adjoint(self, rows, basis):
+        """ Transposed subject unfolding of rows times basis. """
+        tensor, _ = _read(self.tOrig, rows)
+        return tensor.reshape(tensor.shape[0], -1).T @ basis
+
+    def solve_mode(self, factors, mode):
+        """ Solves for the factors of a non-subject mode. """
+        rank = factors[0].shape[1]
+        gram = np.zeros((self.shape[mode], rank, rank))
+        rhs = np.zeros((self.shape[mode], rank))
+        for rows in self.rows:
+            block_gram, block_rhs = self._tensor_mode(rows, factors, mode)
+            gram += block_gram
+            rhs += block_rhs
+
+        return _solve(gram, rhs)
+
+    def solve_mFactor(self, subjects):
+        """ Solves for the RNA factors from subjects with complete RNA. """
+        complete = subjects[self.complete]
+        gram = complete.T @ complete
+        rhs = np.zeros((subjects.shape[1], self.mOrig.shape[1]))
+        for rows in self.rows:
+            keep = self.complete[rows]
+            if not np.any(keep):
+                continue
+            for cols in self.cols:
+                matrix, _ = _read(self.mOrig, rows, cols)
+                rhs[:, cols] += subjects[rows][keep].T @ matrix[keep]
+
+        return np.linalg.solve(gram, rhs).T
+
+    def solve_subjects(self, factors, mFactor):
+        """ Solves for the subject factors, a block of subjects at a time. """
+        subjects = np.empty((self.shape[0], factors[0].shape[1]))
+        for rows in self.rows:
+            gram, rhs = self._tensor_subjects(rows, factors)
+            for cols in self.cols:
+                matrix, mask = _read(self.mOrig, rows, cols)
+                gram += masked_gram(mask, mFactor[cols])
+                rhs += matrix @ mFactor[cols]
+
+            subjects[rows] = _solve(gram, rhs)
+
+        return subjects
+
+    def R2X(self, factors, mFactor):
+        """ R2X of the factors over the measured values. """
+        error = 0.0
+        for rows in self.rows:
+            error += self._tensor_error(rows, factors)
+            for cols in self.cols:
+                matrix, mask = _read(self.mOrig, rows, cols)
+                recon = factors[0][rows] @ mFactor[cols].T
+                error += np.sum(((recon - matrix) * mask) ** 2.0)
+
+        return 1.0 - error / self.total
+
+    def range_finder(self, rank, oversample=10, n_iter=1, seed=None):
+        """
+        Randomized estimate of the leading left singular vectors of the
+        subject unfolding, with missing values as zero, for initialization.
+        """
+        rng = np.random.default_rng(seed)
+        width = rank + oversample
+        t_width = int(np.prod(self.shape[1:]))
+        omega_t = rng.standard_normal((t_width, width))
+        omega_m = rng.standard_normal((self.mOrig.shape[1], width))
+
+        for _ in range(n_iter + 1):
+            # Y = X Omega, then orthonormalize
+            sample = np.zeros((self.shape[0], width))
+            for rows in self.rows:
+                sample[rows] = self._tensor_project(rows, omega_t)
+                for cols in self.cols:
+                    matrix, _ = _read(self.mOrig, rows, cols)
+                    sample[rows] += matrix @ omega_m[cols]
+            basis, _ = np.linalg.qr(sample)
+
+            # Omega = X^T Q, the projection of the data onto the basis
+            omega_t = np.zeros((t_width, width))
+            omega_m = np.zeros((self.mOrig.shape[1], width))
+            for rows in self.rows:
+                omega_t += self._tensor_adjoint(rows, basis[rows])
+                for cols in self.cols:
+                    matrix, _ = _read(self.mOrig, rows, cols)
+                    omega_m[cols] += matrix.T @ basis[rows]
+
+        # SVD of the small projected matrix Q^T X
+        u, s, _ = np.linalg.svd(np.vstack((omega_t, omega_m)).T,
+                                full_matrices=False)
+        return basis @ u[:, :rank] * s[:rank]
+
+
+def fit(problem, r, tol=1e-6, maxiter=300, linesearch=True, callback=None,
+        seed=None, sketch=None, max_seconds=None, factor_tol=None,
+        stall=None, init=None):
+    """
+    Runs ALS with line search, as in perform_CMTF, on a blockwise problem.
+
+    Parameters:
+        problem (_Problem): blockwise data access
+        r (int): number of components
+        tol (float, default: 1e-6): R2X improvement at convergence
+        maxiter (int, default: 300): most iterations
+        linesearch (bool, default: True): use line search acceleration
+        callback (callable, default: None): as in perform_CMTF
+        seed (int, default: None): seed for the range finder; by default,
+            drawn from numpy's global random state
+        sketch (sketched.Sketch, default: None): sketched solves used until
+            it is done, without line search; iterations that improve R2X by
+            less than sketch.tol grow it, and are undone if R2X fell
+        max_seconds (float, default: None): as in perform_CMTF
+        factor_tol (float, default: None): as in perform_CMTF
+        stall (int, default: None): as in perform_CMTF
+        init (numpy.array, default: None): subjects x r initial subject
+            factors in place of the range finder
+
+    Returns:
+        tFac (CPTensor): factorization, with R2X and trace attributes
+    """
+    from tensorpack.cmtf import cp_normalize, reorient_factors, sort_factors
+
+    budget = _Budget(max_seconds, factor_tol, stall, tol)
+    if seed is None:
+        # Follow np.random.seed, as the PCA initialization of perform_CMTF does
+        seed = np.random.randint(2 ** 31)
+
+    acc_pow = 2.0  # Extrapolate to the iteration^(1/acc_pow) ahead
+    acc_fail = 0  # How many times acceleration have failed
+    max_fail = 4  # Increase acc_pow with one after max_fail failure
+
+    lap = time.perf_counter()
+    with span("fit.init"):
+        subjects = problem.range_finder(r, seed=seed) if init is None \
+            else np.array(init, dtype=float)
+        factors = [subjects] + [np.ones((n, r)) for n in problem.shape[1:]]
+    init_time, _ = _lap(lap)
+    mFactor = None
+    R2X = -np.inf
+    exact_from = 0  # First exact iteration
+
+    trace = CMTFTrace(maxiter)
+    trace.stop_reason = "maxiter"
+    trace.init = "range" if init is None else "given"
+    trace.init_time = init_time
+    with span("fit.als"):
+        for iter in range(maxiter):
+            factors_old = [f.copy() for f in factors]
+            mFactor_old = mFactor
+            sketched = sketch is not None and not sketch.done
+            solver = sketch if sketched else problem
+            times = trace.timings[iter]
+            lap = time.perf_counter()
+
+            for m in range(1, len(problem.shape)):
+                factors[m] = solver.solve_mode(factors, m)
+            times[0], lap = _lap(lap)
+
+            mFactor = solver.solve_mFactor(factors[0])
+            times[1], lap = _lap(lap)
+
+            factors[0] = solver.solve_subjects(factors, mFactor)
+            times[2], lap = _lap(lap)
+
+            R2X_last = R2X
+            R2X = problem.R2X(factors, mFactor)
+            times[3], lap = _lap(lap)
+
+            if sketched:
+                trace.sketch[iter] = sketch.size
+                if R2X - R2X_last < sketch.tol:
+                    if R2X < R2X_last:
+                        factors, mFactor = factors_old, mFactor_old
+                        R2X = R2X_last
+                    sketch.grow()
+                    if sketch.done:
+                        exact_from = iter + 1
+
+            # Initiate line search
+            ls_iter = iter - exact_from
+            if linesearch and not sketched and ls_iter % 2 == 0 and \
+                    ls_iter > 3:
+                jump = ls_iter ** (1.0 / acc_pow)
+                trace.jump[iter] = jump
+                trace.acc_pow[iter] = acc_pow
+
+                factors_ls = [
+                    factors_old[ii] + (f - factors_old[ii]) * jump
+                    for ii, f in enumerate(factors)
+                ]
+                R2X_ls = problem.R2X(factors_ls, mFactor)
+
+                if R2X_ls > R2X:
+                    acc_fail = 0
+                    R2X = R2X_ls
+                    factors = factors_ls
+                    trace.accepted[iter] = True
+                else:
+                    acc_fail += 1
+
+                    if acc_fail == max_fail:
+                        acc_pow += 1.0
+                        acc_fail = 0
+            times[4], lap = _lap(lap)
+
+            trace.R2X[iter] = R2X
+            trace.delta[iter] = R2X - R2X_last
+            trace.n_iter = iter + 1
+            assert R2X > 0.0
+            stop_reason = budget.step(
+                iter, R2X, factors, mFactor, factors_old
+            )
+
+            tFac = tl.cp_tensor.CPTensor((None, factors))
+            tFac.mFactor = mFactor
+            if callback is not None and callback(iter, tFac, trace):
+                trace.stop_reason = "callback"
+                break
+
+            # The first exact sweep is compared against a sketched one
+            if not sketched and iter > exact_from and R2X - R2X_last < tol:
+                trace.stop_reason = "converged"
+                break
+
+            if stop_reason is not None:
+                trace.stop_reason = stop_reason
+                break
+
+    trace._trim()
+    trace.best_iter = budget.best_iter
+    factors, mFactor = budget.best
+    R2X = budget.best_R2X
+    assert not np.all(mFactor == 0.0)
+    tFac = tl.cp_tensor.CPTensor((None, factors))
+    tFac.mFactor = mFactor
+    tFac = cp_normalize(tFac)
+    tFac = reorient_factors(tFac)
+    tFac = sort_factors(tFac)
+    tFac.R2X = R2X
+    tFac.trace = trace
+
+    return tFac
+
+
+@profiled
+def perform_CMTF_chunked(tOrig, mOrig, r=OPTIMAL_RANK, tol=1e-6, maxiter=300,
+                         linesearch=True, callback=None, chunk_size=10000,
+                         column_chunk_size=4096, seed=None, max_seconds=None,
+                         factor_tol=None, stall=None, init=None):
+    """
+    Performs CMTF as perform_CMTF does, reading tOrig and mOrig in blocks.
+    The subject factors are initialized by a randomized range finder rather
+    than PCA. Inputs are not modified.
+
+    Parameters:
+        tOrig (numpy.array or numpy.memmap): subjects x cytokines x sources
+        mOrig (numpy.array or numpy.memmap): subjects x RNA modules
+        r (int, default: OPTIMAL_RANK): number of components
+        tol (float, default: 1e-6): R2X improvement at convergence
+        maxiter (int, default: 300): most iterations
+        linesearch (bool, default: True): use line search acceleration
+        callback (callable, default: None): as in perform_CMTF
+        chunk_size (int, default: 10000): subjects read at once
+        column_chunk_size (int, default: 4096): RNA columns read at once
+        seed (int, default: None): seed for the range finder; by default,
+            drawn from numpy's global random state
+        max_seconds (float, default: None): as in perform_CMTF
+        factor_tol (float, default: None): as in perform_CMTF
+        stall (int, default: None): as in perform_CMTF
+        init (numpy.array, default: None): as in perform_CMTF
+
+    Returns:
+        tFac (CPTensor): factorization, with R2X and trace attributes
+    """
+    assert tOrig.ndim == 3 and mOrig.ndim == 2
+    assert tOrig.shape[0] == mOrig.shape[0]
+    problem = _Problem(tOrig, mOrig, chunk_size, column_chunk_size)
+    return fit(
+        problem,
+        r,
+        tol=tol,
+        maxiter=maxiter,
+        linesearch=linesearch,
+        callback=callback,
+        seed=seed,
+        max_seconds=max_seconds,
+        factor_tol=factor_tol,
+        stall=stall,
+        init=init
+    )
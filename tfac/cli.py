@@ -0,0 +1,126 @@
+"""
+Command line entry points for exporting models and scoring new patients.
+"""
+import argparse
+import json
+import sys
+
+import pandas as pd
+
+from .artifact import build_artifact, load_artifact, save_artifact, \
+    score_samples
+from .cmtf import OPTIMAL_RANK
+from .dataImport import OPTIMAL_SCALING
+from .serve import load_test, serve
+
+
+def export(args):
+    """ Fits and saves a model artifact. """
+    artifact = build_artifact(
+        variance_scaling=args.scaling,
+        r=args.rank,
+        target=args.target,
+        svc=args.svc
+    )
+    save_artifact(artifact, args.output)
+
+
+def score(args):
+    """ Streams patients from a CSV through a saved model in batches. """
+    artifact = load_artifact(args.artifact)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    try:
+        reader = pd.read_csv(args.input, index_col=0, chunksize=args.batch_size)
+        for ii, batch in enumerate(reader):
+            scores = score_samples(batch, artifact)
+            scores.to_csv(output, header=(ii == 0))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def run_server(args):
+    """ Serves scoring requests from a saved model until interrupted. """
+    serve(
+        args.artifact,
+        path=args.socket,
+        port=args.port,
+        max_batch=args.max_batch,
+        max_delay=args.max_delay
+    )
+
+
+def run_load_test(args):
+    """ Sends requests to a running server and reports latency. """
+    samples = pd.read_csv(args.input, index_col=0)
+    results = load_test(
+        samples,
+        n_requests=args.requests,
+        concurrency=args.concurrency,
+        path=args.socket,
+        port=args.port,
+        op=args.op
+    )
+    print(json.dumps(results, indent=2))
+
+
+def main(argv=None):
+    """ Main entry point for the tfac command. """
+    parser = argparse.ArgumentParser(prog='tfac')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser(
+        'export',
+        help='fit CMTF and a classifier and save them as a model artifact'
+    )
+    export_parser.add_argument('output', help='artifact file to write (.npz)')
+    export_parser.add_argument('--rank', type=int, default=OPTIMAL_RANK)
+    export_parser.add_argument('--scaling', type=float, default=OPTIMAL_SCALING)
+    export_parser.add_argument('--target', default='status')
+    export_parser.add_argument('--svc', action='store_true')
+    export_parser.set_defaults(func=export)
+
+    score_parser = commands.add_parser(
+        'score',
+        help='score new patients in a CSV with a saved model artifact'
+    )
+    score_parser.add_argument('artifact', help='artifact file from export')
+    score_parser.add_argument(
+        'input',
+        help="CSV of raw measurements, one patient per row; columns are "
+             "'Serum <cytokine>', 'Plasma <cytokine>' and RNA modules"
+    )
+    score_parser.add_argument('-o', '--output', default='-')
+    score_parser.add_argument('--batch-size', type=int, default=1000)
+    score_parser.set_defaults(func=score)
+
+    serve_parser = commands.add_parser(
+        'serve',
+        help='serve scoring requests from a saved model artifact'
+    )
+    serve_parser.add_argument('artifact', help='artifact file from export')
+    serve_parser.add_argument('--socket', help='Unix socket path')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--max-batch', type=int, default=64)
+    serve_parser.add_argument('--max-delay', type=float, default=0.002)
+    serve_parser.set_defaults(func=run_server)
+
+    load_parser = commands.add_parser(
+        'loadtest',
+        help='measure latency and throughput of a running server'
+    )
+    load_parser.add_argument('input', help='CSV of samples to send')
+    load_parser.add_argument('--socket', help='Unix socket path')
+    load_parser.add_argument('--port', type=int, default=8765)
+    load_parser.add_argument('--requests', type=int, default=1000)
+    load_parser.add_argument('--concurrency', type=int, default=16)
+    load_parser.add_argument(
+        '--op',
+        choices=['project', 'score'],
+        default='score'
+    )
+    load_parser.set_defaults(func=run_load_test)
+
+    args = parser.parse_args(argv)
+    args.func(args)
@@ -4,39 +4,466 @@ Coupled Matrix Tensor Factorization
 
 import os
 from copy import deepcopy
+from functools import lru_cache
+import time
 import numpy as np
 import tensorly as tl
 from tensorly.tenalg.svd import randomized_svd
 from tensorly.tenalg.core_tenalg import khatri_rao
-from statsmodels.multivariate.pca import PCA
-from tqdm import tqdm
-from tensorpack.cmtf import (
-    cp_normalize,
-    reorient_factors,
-    sort_factors,
-    mlstsq,
-    calcR2X,
-)
+
+from .checkpoint import Checkpoint, rng_state, set_rng_state
+from .instrument import profiled, span
 
 OPTIMAL_RANK = 8
 tl.set_backend("numpy")
 
+# statsmodels and tensorpack are slow to import and are only needed for
+# fitting, so these names are resolved on first use by __getattr__
+_TENSORPACK_NAMES = (
+    "cp_normalize",
+    "reorient_factors",
+    "sort_factors",
+    "mlstsq",
+)
+
+
+@lru_cache
+def _pca_rand():
+    """ Defines PCArand on first use. """
+    from statsmodels.multivariate.pca import PCA
+
+    class PCArand(PCA):
+        def _compute_eig(self):
+            """
+            Override slower SVD methods
+            """
+            _, s, v = randomized_svd(self.transformed_data, self._ncomp)
+
+            self.eigenvals = s ** 2.0
+            self.eigenvecs = v.T
+
+    PCArand.__module__ = __name__
+    PCArand.__qualname__ = "PCArand"
+    return PCArand
+
+
+def __getattr__(name):
+    """ Lazily provides PCArand and the tensorpack CMTF helpers. """
+    if name == "PCArand":
+        return _pca_rand()
+    if name in _TENSORPACK_NAMES:
+        from tensorpack import cmtf
+
+        return getattr(cmtf, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def calcR2X(tFac, tIn=None, mIn=None):
+    """
+    Calculate R2X. Optionally it can be calculated for only the tensor or
+    matrix. The tensor may be a sparse.ObservedTensor, in which case R2X is
+    computed over its observed entries.
+    """
+    from .sparse import ObservedTensor, calcR2X_sparse
+
+    if isinstance(tIn, ObservedTensor):
+        return calcR2X_sparse(tFac, tIn, mIn)
+
+    from tensorpack.cmtf import calcR2X as _calcR2X
+
+    return _calcR2X(tFac, tIn, mIn)
+
+
+def compress_matrix(mOrig, rank=None):
+    """
+    Projects the RNA matrix onto an orthonormal basis of RNA features, so
+    that least squares against it can be solved in rank columns. By default
+    the basis spans the rows of mOrig, from a thin QR, and the projection is
+    lossless; otherwise it is the leading rank right singular vectors.
+
+    Parameters:
+        mOrig (numpy.array): subjects x RNA modules; each row complete or
+            entirely missing
+        rank (int, default: None): basis vectors kept
+
+    Returns:
+        compressed (numpy.array): subjects x basis vectors, mOrig @ basis
+        basis (numpy.array): RNA modules x basis vectors
+        offset (float): sum of squares of mOrig lost by the projection
+    """
+    measured = np.isfinite(mOrig)
+    complete = np.all(measured, axis=1)
+    assert np.all(complete | ~np.any(measured, axis=1)), \
+        "compression requires mOrig rows to be complete or entirely missing"
+
+    if rank is None:
+        basis, _ = np.linalg.qr(mOrig[complete].T)
+    else:
+        _, _, vt = np.linalg.svd(mOrig[complete], full_matrices=False)
+        basis = vt[:rank].T
+
+    compressed = mOrig @ basis
+    offset = np.sum(mOrig[complete] ** 2.0) - np.nansum(compressed ** 2.0)
+    return compressed, basis, max(offset, 0.0)
+
+
+def _uncompress_R2X(R2X, total, offset):
+    """ R2X with the sum of squares lost by compress_matrix added back. """
+    return 1.0 - ((1.0 - R2X) * total + offset) / (total + offset)
+
+
+def _init_pca(unfolded, r):
+    """ Scores of a fill-em PCA, the default initialization. """
+    pca = _pca_rand()(unfolded, ncomp=r, missing='fill-em')
+    return pca.factors, pca
+
+
+def _mean_filled(unfolded):
+    """ Standardized unfolding, with missing values at the column mean. """
+    means = np.nanmean(unfolded, axis=0)
+    stds = np.nanstd(unfolded, axis=0)
+    filled = (unfolded - means) / np.where(stds > 0.0, stds, 1.0)
+    return np.nan_to_num(filled)
+
+
+def _init_svd(unfolded, r):
+    """ Left singular vectors of the mean-imputed, standardized unfolding. """
+    u, _, _ = randomized_svd(_mean_filled(unfolded), r)
+    return u, None
+
+
+def _init_em(unfolded, r, n_steps=3):
+    """
+    As _init_svd, after n_steps of refilling missing values with their
+    rank r reconstruction.
+    """
+    filled = _mean_filled(unfolded)
+    missing = ~np.isfinite(unfolded)
+    for _ in range(n_steps):
+        u, s, v = randomized_svd(filled, r)
+        filled[missing] = ((u * s) @ v)[missing]
+    u, _, _ = randomized_svd(filled, r)
+    return u, None
+
+
+def _init_random(unfolded, r):
+    """ Random orthonormal columns. """
+    q, _ = np.linalg.qr(np.random.standard_normal((unfolded.shape[0], r)))
+    return q, None
+
+
+# Subject factor initializations of perform_CMTF, by name. Each takes the
+# subject unfolding of the tensor beside the matrix, and the rank, and
+# returns the initial subject factors and a PCA, or None.
+INITIALIZERS = {
+    "pca": _init_pca,
+    "svd": _init_svd,
+    "em": _init_em,
+    "random": _init_random,
+}
+
+
+def _init_array(init, r):
+    """ Subject factors from an array or a previous CPTensor fit. """
+    if isinstance(init, tl.cp_tensor.CPTensor):
+        weights = np.ones(r) if init.weights is None else init.weights
+        init = init.factors[0] * weights
+    init = np.array(init, dtype=float)
+    assert init.shape[1] == r
+    return init
+
+
+def _lap(start):
+    """ Returns the seconds since start, and the current time. """
+    now = time.perf_counter()
+    return now - start, now
+
+
+def split_budget(max_seconds, costs):
+    """
+    Splits a time budget over a sequence of fits, e.g. across ranks or
+    replicates, in proportion to their costs. Each share is computed as its
+    fit starts, from the time left, so that time a fit leaves unused goes
+    to those after it.
+
+    Parameters:
+        max_seconds (float): total seconds, from the first call; if None,
+            every fit is unlimited
+        costs (sequence): relative cost of each fit, e.g. its rank
+
+    Yields:
+        seconds (float): budget of the next fit, or None
+    """
+    costs = np.asarray(costs, dtype=float)
+    if max_seconds is None:
+        yield from [None] * costs.size
+        return
+
+    end = time.perf_counter() + max_seconds
+    for ii in range(costs.size):
+        left = max(end - time.perf_counter(), 0.0)
+        yield left * costs[ii] / np.sum(costs[ii:])
+
+
+class _Budget:
+    """
+    Stopping criteria besides R2X convergence, and the best iterate so far,
+    for the ALS loops. Keeps references to the best factors, so they must be
+    replaced rather than modified in place.
+    """
+
+    def __init__(self, max_seconds=None, factor_tol=None, stall=None,
+                 tol=1e-6):
+        self.start = time.perf_counter()
+        self.max_seconds = max_seconds
+        self.factor_tol = factor_tol
+        self.stall = stall
+        self.tol = tol
+        self.best_R2X = -np.inf
+        self.best = None
+        self.best_iter = -1
+        self.since_best = 0  # Iterations without improving on the best
+        self.steps = 0  # Iterations run since start
+
+    def step(self, iter, R2X, factors, mFactor, factors_old):
+        """
+        Records an iteration.
+
+        Returns:
+            stop_reason (str): why to stop, or None to continue
+        """
+        self.steps += 1
+        if R2X > self.best_R2X:
+            self.since_best = 0 if R2X - self.best_R2X >= self.tol \
+                else self.since_best + 1
+            self.best_R2X = R2X
+            self.best = (list(factors), mFactor)
+            self.best_iter = iter
+        else:
+            self.since_best += 1
+
+        if self.stall is not None and self.since_best >= self.stall:
+            return "stalled"
+
+        if self.factor_tol is not None:
+            change = max(
+                np.linalg.norm(f - f_old) / np.linalg.norm(f)
+                for f, f_old in zip(factors, factors_old)
+            )
+            if change < self.factor_tol:
+                return "factor_tol"
+
+        # Stop if another iteration, at the mean pace so far, would not fit
+        if self.max_seconds is not None:
+            elapsed = time.perf_counter() - self.start
+            if elapsed * (self.steps + 1) / self.steps > self.max_seconds:
+                return "max_seconds"
+
+        return None
+
+    def _state(self):
+        """ Arrays of the best iterate, for a checkpoint. """
+        state = {
+            f"best_factor{m}": f for m, f in enumerate(self.best[0])
+        }
+        state["best_mFactor"] = self.best[1]
+        state["budget"] = np.array(
+            [self.best_R2X, self.best_iter, self.since_best]
+        )
+        return state
+
+    def _restore(self, state):
+        """ Restores the best iterate of a checkpoint from _state. """
+        n_modes = sum(name.startswith("best_factor") for name in state)
+        self.best = (
+            [state[f"best_factor{m}"] for m in range(n_modes)],
+            state["best_mFactor"]
+        )
+        best_R2X, best_iter, since_best = state["budget"]
+        self.best_R2X = best_R2X
+        self.best_iter = int(best_iter)
+        self.since_best = int(since_best)
+
+
+class CMTFTrace:
+    """
+    Per-iteration convergence record of perform_CMTF, kept in preallocated
+    arrays with one entry per possible iteration. Only the first n_iter
+    entries are filled; arrays are trimmed to n_iter once fitting ends.
+
+    Attributes:
+        R2X (numpy.array): R2X after each iteration
+        delta (numpy.array): change in R2X over each iteration
+        jump (numpy.array): line search jump attempted, NaN if none
+        accepted (numpy.array): whether the line search jump was accepted
+        acc_pow (numpy.array): acceleration power used for the jump
+        sketch (numpy.array): rows sampled per least squares solve by
+            sketched ALS, 0 if solved exactly
+        timings (numpy.array): iterations x PHASES, seconds spent in each
+            phase of the iteration
+        n_iter (int): iterations completed
+        init (str): initialization, a name in INITIALIZERS, 'range' for
+            the range finder of the chunked and sparse solvers, or 'given'
+        init_time (float): seconds spent initializing
+        best_iter (int): iteration of the returned, best iterate
+        stop_reason (str): 'converged', 'maxiter', 'callback',
+            'max_seconds', 'factor_tol' or 'stalled'
+    """
+    PHASES = ("modes", "mFactor", "subjects", "R2X", "linesearch")
+    _ARRAYS = ("R2X", "delta", "jump", "accepted", "acc_pow", "sketch",
+               "timings")
+
+    def __init__(self, maxiter):
+        self.R2X = np.full(maxiter, np.nan)
+        self.delta = np.full(maxiter, np.nan)
+        self.jump = np.full(maxiter, np.nan)
+        self.accepted = np.zeros(maxiter, dtype=bool)
+        self.acc_pow = np.full(maxiter, np.nan)
+        self.sketch = np.zeros(maxiter, dtype=int)
+        self.timings = np.zeros((maxiter, len(self.PHASES)))
+        self.n_iter = 0
+        self.init = None
+        self.init_time = 0.0
+        self.best_iter = -1
+        self.stop_reason = None
+
+    def _trim(self):
+        """ Drops the entries for iterations that were not run. """
+        for name in self._ARRAYS:
+            setattr(self, name, getattr(self, name)[:self.n_iter])
 
-class PCArand(PCA):
-    def _compute_eig(self):
+    def _state(self):
+        """ Arrays of the completed iterations, for a checkpoint. """
+        state = {
+            f"trace_{name}": getattr(self, name)[:self.n_iter]
+            for name in self._ARRAYS
+        }
+        state["trace_n_iter"] = np.array(self.n_iter)
+        return state
+
+    def _restore(self, state):
+        """ Fills in the iterations of a checkpoint from _state. """
+        self.n_iter = int(state["trace_n_iter"])
+        for name in self._ARRAYS:
+            getattr(self, name)[:self.n_iter] = state[f"trace_{name}"]
+
+    def to_frame(self):
         """
-        Override slower SVD methods
+        Returns the trace as a table.
+
+        Returns:
+            trace (pandas.DataFrame): one row per completed iteration
         """
-        _, s, v = randomized_svd(self.transformed_data, self._ncomp)
+        import pandas as pd
+
+        n = self.n_iter
+        trace = pd.DataFrame({
+            "R2X": self.R2X[:n],
+            "delta": self.delta[:n],
+            "jump": self.jump[:n],
+            "accepted": self.accepted[:n],
+            "acc_pow": self.acc_pow[:n],
+            "sketch": self.sketch[:n],
+        })
+        for ii, phase in enumerate(self.PHASES):
+            trace[f"{phase} time"] = self.timings[:n, ii]
+
+        return trace
+
+
+@profiled
+def perform_CMTF(tOrig, mOrig, r=OPTIMAL_RANK, tol=1e-6, maxiter=300, progress=None, linesearch: bool=True, callback=None, chunk_size=None, compress=None, checkpoint=None, max_seconds=None, factor_tol=None, stall=None, init=None):
+    """
+    Perform CMTF decomposition.
+
+    The returned CPTensor has the fit's R2X and a CMTFTrace of its
+    convergence as its R2X and trace attributes. If given, callback is
+    called as callback(iteration, tFac, trace) after every iteration, and
+    fitting stops early if it returns True.
+
+    If chunk_size is given, or either input is a numpy.memmap, the data are
+    instead read in blocks of chunk_size subjects by
+    chunked.perform_CMTF_chunked, and no PCA is returned. Likewise, if
+    tOrig is a sparse.ObservedTensor, only its observed entries are used, by
+    sparse.perform_CMTF_sparse.
+
+    If compress is True, or a number of components, iterations run on mOrig
+    projected by compress_matrix, losslessly or onto that many components,
+    and the full mFactor is recovered once fitting ends; callbacks see the
+    compressed mFactor. Lossless compression gives the same fit. R2X always
+    counts the full matrix.
+
+    If checkpoint, a checkpoint.Checkpoint or a path, is given, the solver
+    state and numpy's random state are saved periodically, every 10
+    iterations for a path. If the checkpoint file exists, fitting resumes
+    from it and gives the same result as an uninterrupted fit; the file is
+    removed once fitting ends. Only the in-memory solver checkpoints.
+
+    Besides tol, maxiter and callback, fitting stops once another
+    iteration would exceed max_seconds from the call, once no factor
+    changes by more than factor_tol relative to its norm in an iteration,
+    or once R2X has not improved on its best by tol for stall iterations.
+    The iterate with the best R2X is returned, and the trace records its
+    iteration and why fitting stopped.
 
-        self.eigenvals = s ** 2.0
-        self.eigenvecs = v.T
+    init chooses how the subject factors are initialized: by name, one of
+    INITIALIZERS, 'pca' by default, 'svd' from the mean-imputed unfolding,
+    'em' after a few EM steps, or 'random'; or from given factors, a
+    subjects x r array or the CPTensor of a previous fit, e.g. to warm
+    start. Only 'pca' returns a PCA. The chunked and sparse solvers only
+    take given factors, in place of their range finder. The trace records
+    the initialization and its time.
+    """
+    from .sparse import ObservedTensor, perform_CMTF_sparse
 
+    if not isinstance(init, (type(None), str)):
+        init = _init_array(init, r)
 
-def perform_CMTF(tOrig, mOrig, r=OPTIMAL_RANK, tol=1e-6, maxiter=300, progress=None, linesearch: bool=True):
-    """Perform CMTF decomposition."""
-    assert tOrig.dtype == float
-    assert mOrig.dtype == float
+    if checkpoint is not None:
+        if isinstance(tOrig, ObservedTensor) or chunk_size is not None or \
+                isinstance(tOrig, np.memmap) or isinstance(mOrig, np.memmap):
+            raise ValueError("Only the in-memory solver checkpoints")
+        if not isinstance(checkpoint, Checkpoint):
+            checkpoint = Checkpoint(checkpoint)
+
+    if isinstance(init, str) and (
+            isinstance(tOrig, ObservedTensor) or chunk_size is not None or
+            isinstance(tOrig, np.memmap) or isinstance(mOrig, np.memmap)):
+        raise ValueError("Only the in-memory solver takes named inits")
+
+    if isinstance(tOrig, ObservedTensor):
+        tFac = perform_CMTF_sparse(
+            tOrig, mOrig, r=r, tol=tol, maxiter=maxiter,
+            linesearch=linesearch, callback=callback,
+            max_seconds=max_seconds, factor_tol=factor_tol, stall=stall,
+            init=init
+        )
+        return tFac, None
+
+    if chunk_size is not None or isinstance(tOrig, np.memmap) or \
+            isinstance(mOrig, np.memmap):
+        from .chunked import perform_CMTF_chunked
+
+        tFac = perform_CMTF_chunked(
+            tOrig, mOrig, r=r, tol=tol, maxiter=maxiter,
+            linesearch=linesearch, callback=callback,
+            chunk_size=chunk_size or 10000, max_seconds=max_seconds,
+            factor_tol=factor_tol, stall=stall, init=init
+        )
+        return tFac, None
+
+    budget = _Budget(max_seconds, factor_tol, stall, tol)
+    from tqdm import tqdm
+    from tensorpack.cmtf import (
+        cp_normalize,
+        reorient_factors,
+        sort_factors,
+        mlstsq,
+        calcR2X,
+    )
+
+    assert np.issubdtype(tOrig.dtype, np.floating)
+    assert np.issubdtype(mOrig.dtype, np.floating)
     factors = [np.ones((tOrig.shape[i], r)) for i in range(tOrig.ndim)]
 
     # Check if verbose was not set
@@ -48,14 +475,40 @@ def perform_CMTF(tOrig, mOrig, r=OPTIMAL_RANK, tol=1e-6, maxiter=300, progress=N
     acc_fail: int = 0  # How many times acceleration have failed
     max_fail: int = 4  # Increase acc_pow with one after max_fail failure
 
-    # SVD init mode 0
-    unfold = np.hstack((tl.unfold(tOrig, 0), mOrig))
-    pca = PCArand(unfold, ncomp=r, missing='fill-em')
-    factors[0] = pca.factors
+    # On resume, rerun the initialization from the same random state, as
+    # the PCA is returned
+    state = None if checkpoint is None else checkpoint.load()
+    if state is not None:
+        set_rng_state(state, "rng_init")
+    shape = np.array(tOrig.shape + mOrig.shape + (r, compress or 0))
+    init_state = rng_state("rng_init")
+
+    # Initialize the subject factors
+    unfolded = np.hstack((tl.unfold(tOrig, 0), mOrig))
+    init_name = "pca" if init is None else init
+    pca = None
+    lap = time.perf_counter()
+    with span("perform_CMTF.init"):
+        if isinstance(init_name, str):
+            factors[0], pca = INITIALIZERS[init_name](unfolded, r)
+        else:
+            factors[0] = _init_array(init, r)
+            init_name = "given"
+    init_time, _ = _lap(lap)
+    assert factors[0].shape == (tOrig.shape[0], r)
     tFac = tl.cp_tensor.CPTensor((None, factors))
 
+    basis, offset = None, 0.0
+    if compress is not None:
+        with span("perform_CMTF.compress"):
+            mOrig, basis, offset = compress_matrix(
+                mOrig, None if compress is True else compress
+            )
+            total = np.nansum(tOrig ** 2.0) + np.nansum(mOrig ** 2.0)
+
     # Pre-unfold
-    unfolded = np.hstack((tl.unfold(tOrig, 0), mOrig))
+    if compress is not None:
+        unfolded = np.hstack((tl.unfold(tOrig, 0), mOrig))
     missingM = np.all(np.isfinite(mOrig), axis=1)
     assert np.sum(missingM) >= 1, "mOrig must contain at least one complete row"
     R2X = -np.inf
@@ -63,73 +516,185 @@ def perform_CMTF(tOrig, mOrig, r=OPTIMAL_RANK, tol=1e-6, maxiter=300, progress=N
     # Precalculate the missingness patterns
     uniqueInfo = np.unique(np.isfinite(unfolded.T), axis=1, return_inverse=True)
 
-    tq = tqdm(range(maxiter), disable=(not progress))
-    for iter in tq:
-        tFac_old = deepcopy(tFac)
+    trace = CMTFTrace(maxiter)
+    trace.stop_reason = "maxiter"
+    trace.init, trace.init_time = init_name, init_time
+    if state is not None:
+        if not np.array_equal(state["shape"], shape):
+            raise ValueError(
+                f"Checkpoint {checkpoint.path} is of a different fit"
+            )
+        tFac.factors = [state[f"factor{m}"] for m in range(tOrig.ndim)]
+        tFac.mFactor = state["mFactor"]
+        R2X, acc_pow, acc_fail = state["solver"]
+        acc_fail = int(acc_fail)
+        trace._restore(state)
+        budget._restore(state)
+        set_rng_state(state)
 
-        for m in [1, 2]:
-            kr = khatri_rao(tFac.factors, skip_matrix=m)
-            tFac.factors[m] = mlstsq(kr, tl.unfold(tOrig, m).T).T
+    with span("perform_CMTF.als"):
+        tq = tqdm(range(trace.n_iter, maxiter), disable=(not progress))
+        for iter in tq:
+            tFac_old = deepcopy(tFac)
+            times = trace.timings[iter]
+            lap = time.perf_counter()
 
-        # Solve for the mRNA factors
-        tFac.mFactor = np.linalg.lstsq(
-            tFac.factors[0][missingM, :], mOrig[missingM, :], rcond=None
-        )[0].T
+            for m in [1, 2]:
+                kr = khatri_rao(tFac.factors, skip_matrix=m)
+                tFac.factors[m] = mlstsq(kr, tl.unfold(tOrig, m).T).T
+            times[0], lap = _lap(lap)
 
-        # Solve for subjects factors
-        kr = khatri_rao(tFac.factors, skip_matrix=0)
-        kr = np.vstack((kr, tFac.mFactor))
-        tFac.factors[0] = mlstsq(kr, unfolded.T, uniqueInfo).T
+            # Solve for the mRNA factors
+            tFac.mFactor = np.linalg.lstsq(
+                tFac.factors[0][missingM, :], mOrig[missingM, :], rcond=None
+            )[0].T
+            times[1], lap = _lap(lap)
 
-        R2X_last = R2X
-        R2X = calcR2X(tFac, tOrig, mOrig)
+            # Solve for subjects factors
+            kr = khatri_rao(tFac.factors, skip_matrix=0)
+            kr = np.vstack((kr, tFac.mFactor))
+            tFac.factors[0] = mlstsq(kr, unfolded.T, uniqueInfo).T
+            times[2], lap = _lap(lap)
 
-        # Initiate line search
-        if linesearch and iter % 2 == 0 and iter > 3:
-            jump = iter ** (1.0 / acc_pow)
+            R2X_last = R2X
+            R2X = calcR2X(tFac, tOrig, mOrig)
+            if offset:
+                R2X = _uncompress_R2X(R2X, total, offset)
+            times[3], lap = _lap(lap)
 
-            # Estimate error with line search
-            tFac_ls = deepcopy(tFac)
+            # Initiate line search
+            if linesearch and iter % 2 == 0 and iter > 3:
+                jump = iter ** (1.0 / acc_pow)
+                trace.jump[iter] = jump
+                trace.acc_pow[iter] = acc_pow
 
-            tFac_ls.factors = [
-                tFac_old.factors[ii] + (f - tFac_old.factors[ii]) * jump
-                for ii, f in enumerate(tFac.factors)
-            ]
-            tFac_ls.mFactor = tFac_old.mFactor + (tFac.mFactor - tFac_old.mFactor)
+                # Estimate error with line search
+                tFac_ls = deepcopy(tFac)
 
-            R2X_ls = calcR2X(tFac_ls, tOrig, mOrig)
+                tFac_ls.factors = [
+                    tFac_old.factors[ii] + (f - tFac_old.factors[ii]) * jump
+                    for ii, f in enumerate(tFac.factors)
+                ]
+                tFac_ls.mFactor = tFac_old.mFactor + (tFac.mFactor - tFac_old.mFactor)
 
-            if R2X_ls > R2X:
-                acc_fail = 0
-                R2X = R2X_ls
-                tFac = tFac_ls
+                R2X_ls = calcR2X(tFac_ls, tOrig, mOrig)
+                if offset:
+                    R2X_ls = _uncompress_R2X(R2X_ls, total, offset)
 
-                if progress:
-                    print(f"Accepted line search jump of {jump}.")
-            else:
-                acc_fail += 1
+                if R2X_ls > R2X:
+                    acc_fail = 0
+                    R2X = R2X_ls
+                    tFac = tFac_ls
+                    trace.accepted[iter] = True
+                else:
+                    acc_fail += 1
 
-                if progress:
-                    print(f"Line search failed for jump of {jump}.")
+                    if acc_fail == max_fail:
+                        acc_pow += 1.0
+                        acc_fail = 0
+            times[4], lap = _lap(lap)
 
-                if acc_fail == max_fail:
-                    acc_pow += 1.0
-                    acc_fail = 0
+            trace.R2X[iter] = R2X
+            trace.delta[iter] = R2X - R2X_last
+            trace.n_iter = iter + 1
+
+            tq.set_postfix(R2X=R2X, delta=R2X - R2X_last, refresh=False)
+            assert R2X > 0.0
+            stop_reason = budget.step(
+                iter, R2X, tFac.factors, tFac.mFactor, tFac_old.factors
+            )
 
-                    if progress:
-                        print("Reducing acceleration.")
+            if callback is not None and callback(iter, tFac, trace):
+                trace.stop_reason = "callback"
+                break
 
+            if R2X - R2X_last < tol:
+                trace.stop_reason = "converged"
+                break
 
-        tq.set_postfix(R2X=R2X, delta=R2X - R2X_last, refresh=False)
-        assert R2X > 0.0
+            if stop_reason is not None:
+                trace.stop_reason = stop_reason
+                break
 
-        if R2X - R2X_last < tol:
-            break
+            if checkpoint is not None and checkpoint.due(iter):
+                checkpoint.save(
+                    shape=shape,
+                    mFactor=tFac.mFactor,
+                    solver=np.array([R2X, acc_pow, acc_fail]),
+                    **{f"factor{m}": f for m, f in enumerate(tFac.factors)},
+                    **trace._state(),
+                    **budget._state(),
+                    **init_state,
+                    **rng_state()
+                )
 
+    if checkpoint is not None:
+        checkpoint.remove()
+    trace._trim()
+    trace.best_iter = budget.best_iter
+    tFac.factors, tFac.mFactor = budget.best
+    R2X = budget.best_R2X
+    if basis is not None:
+        tFac.mFactor = basis @ tFac.mFactor
     assert not np.all(tFac.mFactor == 0.0)
     tFac = cp_normalize(tFac)
     tFac = reorient_factors(tFac)
     tFac = sort_factors(tFac)
     tFac.R2X = R2X
+    tFac.trace = trace
 
     return tFac, pca
+
+
+@profiled
+def fold_in(tFac, tOrig, mOrig):
+    """
+    Solves for the subject factors of new subjects, holding the fitted
+    cytokine, source and RNA factors fixed. Subjects sharing a missingness
+    pattern are solved together.
+
+    Parameters:
+        tFac (CPTensor): fitted factorization from perform_CMTF
+        tOrig (numpy.array): new subjects x cytokines x sources
+        mOrig (numpy.array): new subjects x RNA modules
+
+    Returns:
+        factors (numpy.array): new subjects x components; subjects without
+            any measurements are NaN
+    """
+    kr = khatri_rao(tFac.factors, skip_matrix=0) * tFac.weights
+    mFactor = tFac.mFactor * getattr(tFac, "mWeights", 1.0)
+    unfolded = np.hstack((tl.unfold(tOrig, 0), mOrig))
+
+    measured = np.any(np.isfinite(unfolded), axis=1)
+    factors = np.full((unfolded.shape[0], tFac.rank), np.nan)
+    if np.any(measured):
+        factors[measured] = _grouped_lstsq(
+            np.vstack((kr, mFactor)),
+            unfolded[measured].T
+        ).T
+
+    return factors
+
+
+def _grouped_lstsq(A, B):
+    """
+    Least squares solution of A X = B ignoring missing values in B. Columns
+    of B sharing a missingness pattern are solved together. Equivalent to
+    tensorpack's mlstsq, without importing tensorpack when scoring.
+    """
+    observed = np.isfinite(B)
+    patterns, inverse = np.unique(observed, axis=1, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    X = np.empty((A.shape[1], B.shape[1]))
+    for ii, pattern in enumerate(patterns.T):
+        cols = inverse == ii
+        X[:, cols] = np.linalg.lstsq(
+            A[pattern],
+            B[np.ix_(pattern, cols)],
+            rcond=None
+        )[0]
+
+    return X
+
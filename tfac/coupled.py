@@ -0,0 +1,286 @@
+"""
+Coupled factorization of a tensor of any order with any number of side
+matrices, each sharing the factors of one tensor mode. perform_CMTF is the
+case of a subjects x cytokines x sources tensor with one RNA matrix coupled
+on subjects; time points or further biofluids are added as tensor modes,
+and, e.g., cell type fractions as further matrices coupled on subjects.
+
+Every factor is solved from its normal equations. Gram matrices are formed
+once per missingness pattern, and right-hand sides by one MTTKRP per tensor
+mode, so a side matrix adds only its own size to the cost of an iteration.
+"""
+import time
+
+import numpy as np
+import tensorly as tl
+from tensorly.tenalg.core_tenalg import khatri_rao
+
+from .chunked import _solve, mask_patterns, masked_gram
+from .cmtf import CMTFTrace, OPTIMAL_RANK, _lap
+from .instrument import profiled, span
+
+
+class _Coupled:
+    """
+    A tensor and its coupled matrices with missing values as zero, and the
+    missingness patterns of each unfolding, computed once per fit.
+    """
+
+    def __init__(self, tensor, matrices):
+        tensor = np.asarray(tensor, dtype=float)
+        self.shape = tensor.shape
+        self.modes = [mode for mode, _ in matrices]
+        assert tensor.ndim >= 2
+        for mode, matrix in matrices:
+            assert 0 <= mode < tensor.ndim
+            assert matrix.ndim == 2 and matrix.shape[0] == self.shape[mode]
+
+        self.mask = np.isfinite(tensor)
+        self.tensor = np.where(self.mask, tensor, 0.0)
+        self.unfolded = [tl.unfold(self.tensor, m) for m in range(tensor.ndim)]
+        self.patterns = [
+            mask_patterns(tl.unfold(self.mask, m)) for m in range(tensor.ndim)
+        ]
+
+        self.masks = [np.isfinite(matrix) for _, matrix in matrices]
+        self.matrices = [
+            np.where(mask, matrix, 0.0)
+            for mask, (_, matrix) in zip(self.masks, matrices)
+        ]
+        self.row_patterns = [mask_patterns(mask) for mask in self.masks]
+        self.col_patterns = [mask_patterns(mask.T) for mask in self.masks]
+
+        self.total = np.sum(self.tensor ** 2.0) + \
+            sum(np.sum(matrix ** 2.0) for matrix in self.matrices)
+
+    def coupled(self, mode):
+        """ Indices of the matrices coupled on mode. """
+        return [ii for ii, m in enumerate(self.modes) if m == mode]
+
+    def init(self, rank, seed=None):
+        """
+        Leading left singular vectors of each tensor unfolding alongside the
+        matrices coupled on that mode, missing values as zero, scaled by the
+        singular values. Modes with fewer than rank singular vectors are
+        padded with random columns.
+        """
+        rng = np.random.default_rng(seed)
+        factors = []
+        for mode, n in enumerate(self.shape):
+            unfolded = np.hstack(
+                [self.unfolded[mode]] +
+                [self.matrices[ii] for ii in self.coupled(mode)]
+            )
+            u, s, _ = np.linalg.svd(unfolded, full_matrices=False)
+            factor = rng.standard_normal((n, rank)) * s[0] / np.sqrt(n)
+            width = min(rank, s.size)
+            factor[:, :width] = u[:, :width] * s[:width]
+            factors.append(factor)
+
+        return factors
+
+    def solve_mode(self, factors, mFactors, mode):
+        """ Solves for the factors of a tensor mode. """
+        kr = khatri_rao(factors, skip_matrix=mode)
+        gram = masked_gram(None, kr, self.patterns[mode])
+        rhs = self.unfolded[mode] @ kr
+        for ii in self.coupled(mode):
+            gram += masked_gram(None, mFactors[ii], self.row_patterns[ii])
+            rhs += self.matrices[ii] @ mFactors[ii]
+
+        return _solve(gram, rhs)
+
+    def solve_matrix(self, factors, index):
+        """ Solves for the factors of the columns of a coupled matrix. """
+        shared = factors[self.modes[index]]
+        gram = masked_gram(None, shared, self.col_patterns[index])
+        return _solve(gram, self.matrices[index].T @ shared)
+
+    def R2X(self, factors, mFactors):
+        """ R2X of the factors over the measured values. """
+        recon = tl.cp_to_tensor((None, factors))
+        error = np.sum(((recon - self.tensor) * self.mask) ** 2.0)
+        for ii, mode in enumerate(self.modes):
+            recon = factors[mode] @ mFactors[ii].T
+            recon = (recon - self.matrices[ii]) * self.masks[ii]
+            error += np.sum(recon ** 2.0)
+
+        return 1.0 - error / self.total
+
+
+def _normalize(factors, mFactors, modes):
+    """
+    Scales each factor to unit maximum absolute value per component, then
+    orders components by weight, as cp_normalize and sort_factors do.
+
+    Returns:
+        tFac (CPTensor): factorization, with the matrix factors and weights
+            as mFactors and mWeights
+    """
+    weights = np.ones(factors[0].shape[1])
+    scales = []
+    for ii, factor in enumerate(factors):
+        scales.append(np.linalg.norm(factor, ord=np.inf, axis=0))
+        weights = weights * scales[ii]
+        factors[ii] = factor / scales[ii]
+
+    mWeights = []
+    for ii, mode in enumerate(modes):
+        scale = np.linalg.norm(mFactors[ii], ord=np.inf, axis=0)
+        mWeights.append(scales[mode] * scale)
+        mFactors[ii] = mFactors[ii] / scale
+
+    order = np.argsort(weights)[::-1]
+    tFac = tl.cp_tensor.CPTensor(
+        (weights[order], [factor[:, order] for factor in factors])
+    )
+    tFac.mFactors = [mFactor[:, order] for mFactor in mFactors]
+    tFac.mWeights = [weight[order] for weight in mWeights]
+    tFac.modes = list(modes)
+    return tFac
+
+
+@profiled
+def perform_coupled(tensor, matrices=(), r=OPTIMAL_RANK, tol=1e-6,
+                    maxiter=300, linesearch=True, callback=None, seed=None):
+    """
+    Performs coupled factorization of a tensor and matrices, by ALS with
+    the line search of perform_CMTF. Each iteration solves, for every
+    tensor mode after the first and then the first, the factors of the
+    matrices coupled on that mode and then the mode's own factors. With
+    matrices=[(0, mOrig)], this fits the model of perform_CMTF.
+
+    The trace times the solves of tensor modes after the first as 'modes',
+    of all matrices as 'mFactor' and of the first mode as 'subjects'.
+
+    Parameters:
+        tensor (numpy.array): tensor of any order, NaN for missing
+        matrices (list[tuple]): (mode, matrix) pairs; each matrix's rows
+            share the factors of the tensor mode. NaN for missing
+        r (int, default: OPTIMAL_RANK): number of components
+        tol (float, default: 1e-6): R2X improvement at convergence
+        maxiter (int, default: 300): most iterations
+        linesearch (bool, default: True): use line search acceleration
+        callback (callable, default: None): called as callback(iteration,
+            tFac, trace) after every iteration; fitting stops if it returns
+            True. tFac holds the matrix factors as mFactors
+        seed (int, default: None): seed for padding the initial factors
+
+    Returns:
+        tFac (CPTensor): normalized factorization, with the matrix factors,
+            their weights and coupled modes as mFactors, mWeights and modes,
+            and the R2X and trace of the fit
+    """
+    problem = _Coupled(tensor, list(matrices))
+    order = list(range(1, len(problem.shape))) + [0]
+
+    acc_pow = 2.0  # Extrapolate to the iteration^(1/acc_pow) ahead
+    acc_fail = 0  # How many times acceleration have failed
+    max_fail = 4  # Increase acc_pow with one after max_fail failure
+
+    lap = time.perf_counter()
+    with span("perform_coupled.init"):
+        factors = problem.init(r, seed=seed)
+    init_time, _ = _lap(lap)
+    mFactors = [None] * len(problem.modes)
+    R2X = -np.inf
+
+    trace = CMTFTrace(maxiter)
+    trace.stop_reason = "maxiter"
+    trace.init, trace.init_time = "svd", init_time
+    with span("perform_coupled.als"):
+        for iter in range(maxiter):
+            factors_old = [f.copy() for f in factors]
+            times = trace.timings[iter]
+
+            for mode in order:
+                lap = time.perf_counter()
+                for ii in problem.coupled(mode):
+                    mFactors[ii] = problem.solve_matrix(factors, ii)
+                times[1] += _lap(lap)[0]
+
+                lap = time.perf_counter()
+                factors[mode] = problem.solve_mode(factors, mFactors, mode)
+                times[0 if mode else 2] += _lap(lap)[0]
+
+            lap = time.perf_counter()
+            R2X_last = R2X
+            R2X = problem.R2X(factors, mFactors)
+            times[3], lap = _lap(lap)
+
+            # Initiate line search
+            if linesearch and iter % 2 == 0 and iter > 3:
+                jump = iter ** (1.0 / acc_pow)
+                trace.jump[iter] = jump
+                trace.acc_pow[iter] = acc_pow
+
+                factors_ls = [
+                    factors_old[ii] + (f - factors_old[ii]) * jump
+                    for ii, f in enumerate(factors)
+                ]
+                R2X_ls = problem.R2X(factors_ls, mFactors)
+
+                if R2X_ls > R2X:
+                    acc_fail = 0
+                    R2X = R2X_ls
+                    factors = factors_ls
+                    trace.accepted[iter] = True
+                else:
+                    acc_fail += 1
+
+                    if acc_fail == max_fail:
+                        acc_pow += 1.0
+                        acc_fail = 0
+            times[4], lap = _lap(lap)
+
+            trace.R2X[iter] = R2X
+            trace.delta[iter] = R2X - R2X_last
+            trace.n_iter = iter + 1
+            assert R2X > 0.0
+
+            tFac = tl.cp_tensor.CPTensor((None, factors))
+            tFac.mFactors = mFactors
+            if callback is not None and callback(iter, tFac, trace):
+                trace.stop_reason = "callback"
+                break
+
+            if R2X - R2X_last < tol:
+                trace.stop_reason = "converged"
+                break
+
+    trace._trim()
+    tFac = _normalize(factors, mFactors, problem.modes)
+    tFac.R2X = R2X
+    tFac.trace = trace
+
+    return tFac
+
+
+def calcR2X_coupled(tFac, tensor=None, matrices=()):
+    """
+    R2X of a coupled factorization over the measured values of the tensor
+    and the given matrices.
+
+    Parameters:
+        tFac (CPTensor): output of perform_coupled
+        tensor (numpy.array, default: None): tensor; omitted if None
+        matrices (list[tuple]): (index, matrix) pairs, where index is the
+            position of the matrix in the matrices fit
+
+    Returns:
+        R2X (float): fraction of variance explained
+    """
+    top, bottom = 0.0, 0.0
+    if tensor is not None:
+        mask = np.isfinite(tensor)
+        recon = tl.cp_to_tensor(tFac)
+        top += np.sum((recon[mask] - tensor[mask]) ** 2.0)
+        bottom += np.sum(tensor[mask] ** 2.0)
+    for ii, matrix in matrices:
+        mask = np.isfinite(matrix)
+        shared = tFac.factors[tFac.modes[ii]]
+        recon = (shared * tFac.mWeights[ii]) @ tFac.mFactors[ii].T
+        top += np.sum((recon[mask] - matrix[mask]) ** 2.0)
+        bottom += np.sum(matrix[mask] ** 2.0)
+
+    return 1.0 - top / bottom
@@ -1,19 +1,42 @@
 """Data import and processing for the MRSA data"""
-from os.path import join, dirname, abspath
+from copy import deepcopy
+from hashlib import sha256
+from os.path import join, dirname, abspath, exists
 from functools import lru_cache
 
 import numpy as np
 import pandas as pd
-import scipy.cluster.hierarchy as sch
-from sklearn.preprocessing import scale
 
-from .cmtf import perform_CMTF
+from .instrument import profiled
 
 PATH_HERE = dirname(dirname(abspath(__file__)))
 OPTIMAL_SCALING = 2 ** 7.0
 
 
+def hash_file(path):
+    """
+    Returns the SHA-256 digest of a file, or None if it does not exist. Used
+    for both model artifacts and figure build cache keys.
+
+    Parameters:
+        path (str): file to hash
+
+    Returns:
+        digest (str): hexadecimal digest
+    """
+    if not exists(path):
+        return None
+
+    digest = sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
 @lru_cache
+@profiled
 def import_patient_metadata():
     """
     Returns patient meta data, including cohort and outcome.
@@ -34,6 +57,7 @@ def import_patient_metadata():
 
 
 @lru_cache
+@profiled
 def import_validation_patient_metadata():
     """
     Returns validation patient meta data, including cohort and outcome.
@@ -50,13 +74,11 @@ def import_validation_patient_metadata():
     return patient_data
 
 
-@lru_cache
-def import_cytokines(scale_cyto=True, transpose=True):
+@profiled
+def _read_cytokines():
     """
-    Return plasma and serum cytokine data.
-
-    Parameters:
-        scale_cyto (bool, default:True): scale cytokine values
+    Reads plasma and serum cytokine data, before scaling or filtering to
+    patients in the metadata.
 
     Returns:
         plasma_cyto (pandas.DataFrame): plasma cytokine data
@@ -80,6 +102,24 @@ def import_cytokines(scale_cyto=True, transpose=True):
     plasma_cyto.drop("IL-3", axis=1, inplace=True)
     serum_cyto.drop("IL-3", axis=1, inplace=True)
 
+    return plasma_cyto, serum_cyto
+
+
+@lru_cache
+@profiled
+def import_cytokines(scale_cyto=True, transpose=True):
+    """
+    Return plasma and serum cytokine data.
+
+    Parameters:
+        scale_cyto (bool, default:True): scale cytokine values
+
+    Returns:
+        plasma_cyto (pandas.DataFrame): plasma cytokine data
+        serum_cyto (pandas.DataFrame): serum cytokine data
+    """
+    plasma_cyto, serum_cyto = _read_cytokines()
+
     if scale_cyto:
         plasma_cyto = plasma_cyto.transform(np.log)
         plasma_cyto -= plasma_cyto.mean(axis=0)
@@ -98,9 +138,10 @@ def import_cytokines(scale_cyto=True, transpose=True):
     return plasma_cyto, serum_cyto
 
 
-def import_rna():
+@profiled
+def _read_rna():
     """
-    Return RNA expression modules.
+    Reads RNA expression modules, before scaling.
 
     Returns:
         rna (pandas.DataFrame): RNA expression modules
@@ -114,13 +155,37 @@ def import_rna():
     )
     rna.index = rna.index.astype("int32")
 
+    return rna
+
+
+@lru_cache
+@profiled
+def _scaled_rna():
+    """ Reads and scales the RNA expression modules, once. """
+    from sklearn.preprocessing import scale
+
+    rna = _read_rna()
+
     # Always scale
     rna.loc[:, :] = scale(rna.to_numpy())
 
     return rna
 
 
+@profiled
+def import_rna():
+    """
+    Return RNA expression modules. They are read once; each call returns a
+    copy, so that callers may edit it.
+
+    Returns:
+        rna (pandas.DataFrame): RNA expression modules
+    """
+    return _scaled_rna().copy()
+
+
 @lru_cache
+@profiled
 def form_tensor(variance_scaling: float = OPTIMAL_SCALING):
     """
     Forms a tensor of cytokine data and a matrix of RNA expression data for
@@ -136,7 +201,7 @@ def form_tensor(variance_scaling: float = OPTIMAL_SCALING):
             types, and cohort
     """
     plasma_cyto, serum_cyto = import_cytokines(transpose=False)
-    rna = import_rna()
+    rna = _scaled_rna()
     patient_data = import_patient_metadata()
 
     serum_cyto = serum_cyto.reindex(patient_data.index).to_numpy(dtype=float).T
@@ -157,9 +222,70 @@ def form_tensor(variance_scaling: float = OPTIMAL_SCALING):
     return np.copy(tensor), np.copy(rna), patient_data
 
 
+@lru_cache
+@profiled
+def get_scaling(variance_scaling: float = OPTIMAL_SCALING):
+    """
+    Returns the constants form_tensor uses to scale raw measurements, so that
+    new samples can be placed on the same scale.
+
+    Parameters:
+        variance_scaling (float, default:1.0): RNA/cytokine variance scaling
+
+    Returns:
+        scaling (dict): cytokine names, log-cytokine means for serum and
+            plasma, tensor scale, RNA module names, means, standard
+            deviations, and matrix scale
+    """
+    plasma_cyto, serum_cyto = _read_cytokines()
+    rna = _read_rna()
+    patient_data = import_patient_metadata()
+
+    cyto_means = np.stack((
+        np.log(serum_cyto).mean(axis=0).to_numpy(),
+        np.log(plasma_cyto).mean(axis=0).to_numpy()
+    ))
+    rna_means = rna.mean(axis=0).to_numpy()
+    rna_stds = rna.std(axis=0, ddof=0).to_numpy()
+    rna_stds[rna_stds == 0.0] = 1.0
+
+    serum = np.log(serum_cyto).reindex(patient_data.index).to_numpy()
+    plasma = np.log(plasma_cyto).reindex(patient_data.index).to_numpy()
+    tensor = np.stack((serum, plasma), axis=2) - cyto_means.T
+    matrix = (rna.reindex(patient_data.index).to_numpy() - rna_means) / rna_stds
+
+    return {
+        'cytokines': list(serum_cyto.columns),
+        'cyto_means': cyto_means,
+        'tensor_scale': variance_scaling / np.nanvar(tensor),
+        'rna_modules': list(rna.columns),
+        'rna_means': rna_means,
+        'rna_stds': rna_stds,
+        'matrix_scale': 1 / np.nanvar(matrix)
+    }
+
+
+@lru_cache
+@profiled
+def _fit_factors(variance_scaling: float = OPTIMAL_SCALING, r=8):
+    """
+    Fits the factorization of get_factors, once, and also returns numpy's
+    global random state after fitting.
+    """
+    from .cmtf import perform_CMTF
+
+    tensor, rna, patient_data = form_tensor(variance_scaling)
+    np.random.seed(42)
+    t_fac, pcaFac = perform_CMTF(tensor, rna, r=r)
+    return t_fac, pcaFac, patient_data, np.random.get_state()
+
+
+@profiled
 def get_factors(variance_scaling: float = OPTIMAL_SCALING, r=8):
     """
-    Return the factorization results.
+    Return the factorization results. The fit is computed once; each call
+    returns copies, and leaves numpy's global random state as fitting from
+    np.random.seed(42) does.
 
     Parameters:
         variance_scaling (float, default:1.0): RNA/cytokine variance scaling
@@ -169,12 +295,12 @@ def get_factors(variance_scaling: float = OPTIMAL_SCALING, r=8):
         patient_data (pandas.DataFrame): patient data, including status, data
             types, and cohort
     """
-    tensor, rna, patient_data = form_tensor(variance_scaling)
-    np.random.seed(42)
-    t_fac, pcaFac = perform_CMTF(tensor, rna, r=r)
-    return t_fac, pcaFac, patient_data
+    *results, state = _fit_factors(variance_scaling, r)
+    np.random.set_state(state)
+    return deepcopy(tuple(results))
 
 
+@profiled
 def reorder_table(df):
     """
     Reorder a table's rows using heirarchical clustering. Taken from
@@ -188,6 +314,8 @@ def reorder_table(df):
         df (pandas.DataFrame): data with rows reordered via heirarchical
             clustering
     """
+    import scipy.cluster.hierarchy as sch
+
     y = sch.linkage(df.to_numpy(), method='centroid')
     index = sch.dendrogram(y, orientation='right', no_plot=True)['leaves']
     return df.iloc[index, :]
@@ -0,0 +1,429 @@
+"""
+Builds several figures in one run, computing their shared inputs once.
+
+Each figure declares the named computations it needs. These are computed
+once in the parent process and each figure is then rendered in a forked
+worker process that inherits the results.
+
+Builds are incremental. Every computation is keyed by a hash of the code
+and data files it depends on, and its result is saved under
+fdir/.fbuild/, so unchanged computations are loaded rather than recomputed.
+For each figure, the hashes of the modules it imported, the data files it
+read and the computations it used are recorded; figures whose inputs are
+all unchanged are skipped.
+
+With the TFAC_PROFILE environment variable set, genFigure also writes
+nested timing spans for the computations and each figure's import,
+makeFigure and savefig to output/profile.json and output/profile.folded.
+"""
+from functools import wraps
+from glob import glob
+from graphlib import TopologicalSorter
+from hashlib import sha256
+from importlib import import_module
+import inspect
+import json
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+from os.path import abspath, exists, join
+import pickle
+import sys
+import time
+
+from .. import dataImport, instrument
+from ..dataImport import PATH_HERE, hash_file
+from ..instrument import profiled, span
+from .common import setup_matplotlib
+
+DATA_DIR = join(PATH_HERE, 'tfac', 'data')
+
+# name: (dataImport function, keyword arguments, names of the computations
+# it uses, data files it reads); import_rna and get_factors copy the results
+# of the cached functions used here for each caller
+NODES = {
+    'metadata': (
+        'import_patient_metadata', {}, [], ['mrsa/patient_metadata.txt']
+    ),
+    'validation_metadata': (
+        'import_validation_patient_metadata',
+        {},
+        [],
+        ['mrsa/validation_patient_metadata.txt']
+    ),
+    'cytokines': (
+        'import_cytokines',
+        {},
+        ['metadata'],
+        ['mrsa/plasma_cytokines.txt', 'mrsa/serum_cytokines.txt']
+    ),
+    'raw_cytokines': (
+        'import_cytokines',
+        {'scale_cyto': False},
+        ['metadata'],
+        ['mrsa/plasma_cytokines.txt', 'mrsa/serum_cytokines.txt']
+    ),
+    'rna': ('_scaled_rna', {}, [], ['mrsa/rna_combat_tpm.txt.zip']),
+    'tensor': ('form_tensor', {}, ['cytokines', 'rna', 'metadata'], []),
+    'factors': ('_fit_factors', {}, ['tensor'], [])
+}
+
+FIGURE_INPUTS = {
+    '2': ['tensor', 'factors'],
+    '3': ['validation_metadata', 'factors'],
+    '4': ['tensor', 'cytokines', 'factors'],
+    '5': ['validation_metadata', 'factors'],
+    '6': ['factors'],
+    'A1': ['tensor'],
+    'A2': ['rna', 'factors'],
+    'S1': ['tensor', 'cytokines'],
+    'S2': ['cytokines'],
+    'S3': ['validation_metadata', 'factors'],
+    'S4': ['raw_cytokines'],
+    'S5': ['validation_metadata', 'cytokines', 'rna', 'factors']
+}
+
+# Data files opened by the figure being rendered, or None between renders.
+# Audit hooks cannot be removed, so _record_open is added once per process.
+_files_read = None
+_hooked = False
+
+
+def _record_open(event, args):
+    """ Audit hook recording data files opened while rendering. """
+    if _files_read is not None and event == 'open' and \
+            isinstance(args[0], str):
+        path = abspath(args[0])
+        if path.startswith(DATA_DIR):
+            _files_read.add(path)
+
+
+def module_hashes():
+    """
+    Hashes the source of every tfac module currently imported.
+
+    Returns:
+        hashes (dict): module file path: digest
+    """
+    hashes = {}
+    for name, module in list(sys.modules.items()):
+        if not name.startswith('tfac') or \
+                getattr(module, '__file__', None) is None:
+            continue
+
+        hashes[module.__file__] = hash_file(module.__file__)
+
+    return hashes
+
+
+def source_hashes():
+    """
+    Hashes the source of every tfac module outside of the figures and tests,
+    whether or not it has been imported yet, as tfac imports its submodules
+    lazily.
+
+    Returns:
+        hashes (dict): module file path: digest
+    """
+    package = join(PATH_HERE, 'tfac')
+    hashes = {}
+    for path in sorted(glob(join(package, '**', '*.py'), recursive=True)):
+        relative = os.path.relpath(path, package).split(os.sep)
+        if relative[0] not in ('figures', 'tests'):
+            hashes[path] = hash_file(path)
+
+    return hashes
+
+
+def node_order(names):
+    """
+    Returns the computations needed by names, dependencies first.
+
+    Parameters:
+        names (list[str]): computations requested
+
+    Returns:
+        order (list[str]): every computation needed, in dependency order
+    """
+    graph = {}
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in graph:
+            graph[name] = NODES[name][2]
+            pending.extend(NODES[name][2])
+
+    return list(TopologicalSorter(graph).static_order())
+
+
+def node_hashes():
+    """
+    Hashes every computation from its arguments, the source of the tfac
+    code outside of the figures, the data files it reads and the
+    computations it uses.
+
+    Returns:
+        hashes (dict): computation name: digest
+    """
+    code = json.dumps(sorted(source_hashes().items()))
+    hashes = {}
+    for name in node_order(list(NODES)):
+        func, kwargs, deps, files = NODES[name]
+        key = json.dumps([
+            func,
+            kwargs,
+            code,
+            [hash_file(join(DATA_DIR, f)) for f in files],
+            [hashes[dep] for dep in deps]
+        ], sort_keys=True)
+        hashes[name] = sha256(key.encode()).hexdigest()
+
+    return hashes
+
+
+def _seed(name, value):
+    """
+    Makes the dataImport function for a computation return value when called
+    with the computation's arguments, given by position or keyword or left
+    at their defaults, so figures reuse it.
+    """
+    func_name, kwargs = NODES[name][:2]
+    func = getattr(dataImport, func_name)
+    signature = inspect.signature(func)
+    target = signature.bind(**kwargs)
+    target.apply_defaults()
+
+    @wraps(func)
+    def seeded(*args, **kw):
+        bound = signature.bind(*args, **kw)
+        bound.apply_defaults()
+        if bound.arguments == target.arguments:
+            return value
+        return func(*args, **kw)
+
+    setattr(dataImport, func_name, seeded)
+
+
+def compute_nodes(names, hashes, cache_dir):
+    """
+    Loads or computes the named computations and their dependencies.
+    Results are saved to cache_dir, keyed by their hash.
+
+    Parameters:
+        names (list[str]): computations requested
+        hashes (dict): output of node_hashes
+        cache_dir (str): directory of saved results
+
+    Returns:
+        timings (dict): seconds spent computing or loading each node, or the
+            error it raised; figures using a failed node will fail when
+            rendered
+    """
+    timings = {}
+    for name in node_order(names):
+        start = time.time()
+        path = join(cache_dir, f'{name}-{hashes[name]}.pkl')
+        try:
+            with span(f'node {name}'):
+                if exists(path):
+                    with open(path, 'rb') as f:
+                        value = pickle.load(f)
+                    timings[name] = {'loaded': True}
+                else:
+                    func_name, kwargs = NODES[name][:2]
+                    value = getattr(dataImport, func_name)(**kwargs)
+                    with open(path + '.tmp', 'wb') as f:
+                        pickle.dump(value, f)
+                    os.replace(path + '.tmp', path)
+                    for old in glob(join(cache_dir, f'{name}-*.pkl')):
+                        if old != path:
+                            os.remove(old)
+                    timings[name] = {'loaded': False}
+        except Exception as err:
+            timings[name] = {'error': repr(err)}
+            logging.warning(f'Computing {name} failed: {err!r}')
+            continue
+
+        _seed(name, value)
+        timings[name]['seconds'] = time.time() - start
+        logging.info(f'Computed {name} after {time.time() - start} seconds.')
+
+    return timings
+
+
+def render_figure(name, fdir):
+    """
+    Renders one figure to fdir.
+
+    Parameters:
+        name (str): figure name, e.g. '3' or 'S1'
+        fdir (str): output directory
+
+    Returns:
+        seconds (float): time spent rendering
+        inputs (dict): hashes of the modules imported and data files read
+    """
+    global _files_read, _hooked
+    if not _hooked:
+        sys.addaudithook(_record_open)
+        _hooked = True
+
+    files_read = _files_read = set()
+    start = time.time()
+    try:
+        with span(f'figure{name}'):
+            setup_matplotlib()
+            with span('import'):
+                module = import_module(f'tfac.figures.figure{name}')
+            with span('makeFigure'):
+                ff = module.makeFigure()
+            with span('savefig'):
+                ff.savefig(
+                    join(fdir, f'figure{name}.svg'),
+                    dpi=300,
+                    bbox_inches='tight',
+                    pad_inches=0
+                )
+    finally:
+        _files_read = None
+    seconds = time.time() - start
+    logging.info(f'Figure {name} is done after {seconds} seconds.')
+
+    inputs = {
+        'modules': module_hashes(),
+        'data': {path: hash_file(path) for path in files_read}
+    }
+    return seconds, inputs
+
+
+def _render_worker(name, fdir, conn):
+    """ Renders a figure in a worker process and reports back. """
+    instrument.reset()
+    try:
+        conn.send(('ok', render_figure(name, fdir), instrument.spans()))
+    except BaseException as err:
+        conn.send(('failed', repr(err), instrument.spans()))
+        raise
+    finally:
+        conn.close()
+
+
+def is_current(name, record, hashes, fdir):
+    """
+    Checks whether a figure's recorded inputs are unchanged.
+
+    Parameters:
+        name (str): figure name
+        record (dict): inputs recorded when the figure was last built
+        hashes (dict): output of node_hashes
+        fdir (str): output directory
+
+    Returns:
+        current (bool): whether the figure can be skipped
+    """
+    if record is None or not exists(join(fdir, f'figure{name}.svg')):
+        return False
+
+    nodes = {node: hashes[node] for node in FIGURE_INPUTS.get(name, [])}
+    files = {**record['modules'], **record['data']}
+    return record['nodes'] == nodes and \
+        all(hash_file(path) == digest for path, digest in files.items())
+
+
+@profiled(name='fbuild')
+def build(names, fdir='./output/', n_workers=None, force=False):
+    """
+    Builds figures whose inputs changed, computing shared inputs once and
+    rendering independent figures in parallel worker processes. A report of
+    per-node and per-figure timings is written to fdir/build_report.json.
+
+    Parameters:
+        names (list[str]): figures to build, e.g. ['3', 'S1']
+        fdir (str, default: './output/'): output directory
+        n_workers (int, default: None): figures rendered at once; defaults to
+            a third of the CPUs, as model fitting uses three jobs
+        force (bool, default: False): rebuild figures even if unchanged
+
+    Returns:
+        report (dict): node timings, and status and timing of each figure
+    """
+    if n_workers is None:
+        n_workers = max(1, os.cpu_count() // 3)
+
+    cache_dir = join(fdir, '.fbuild')
+    os.makedirs(cache_dir, exist_ok=True)
+    state_path = join(cache_dir, 'state.json')
+    state = {}
+    if exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    start = time.time()
+    hashes = node_hashes()
+    report = {'nodes': {}, 'figures': {}}
+    stale = []
+    for name in names:
+        if not force and is_current(name, state.get(name), hashes, fdir):
+            report['figures'][name] = {'status': 'unchanged'}
+            logging.info(f'Figure {name} is unchanged.')
+        else:
+            stale.append(name)
+
+    inputs = [node for name in stale for node in FIGURE_INPUTS.get(name, [])]
+    report['nodes'] = compute_nodes(inputs, hashes, cache_dir)
+
+    def finish(name, status, result, records=()):
+        instrument.add_spans(records)
+        if status == 'ok':
+            seconds, record = result
+            record['nodes'] = {
+                node: hashes[node] for node in FIGURE_INPUTS.get(name, [])
+            }
+            state[name] = record
+            report['figures'][name] = {'status': status, 'seconds': seconds}
+        else:
+            state.pop(name, None)
+            report['figures'][name] = {'status': status, 'error': result}
+
+    if len(stale) == 1:
+        try:
+            finish(stale[0], 'ok', render_figure(stale[0], fdir))
+        except Exception as err:
+            logging.exception(f'Figure {stale[0]} failed.')
+            finish(stale[0], 'failed', repr(err))
+    else:
+        context = multiprocessing.get_context('fork')
+        running = {}
+        while stale or running:
+            while stale and len(running) < n_workers:
+                name = stale.pop(0)
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_render_worker,
+                    args=(name, fdir, sender)
+                )
+                process.start()
+                sender.close()
+                running[process.sentinel] = (name, process, receiver)
+
+            for sentinel in wait(list(running)):
+                name, process, receiver = running.pop(sentinel)
+                process.join()
+                try:
+                    finish(name, *receiver.recv())
+                except EOFError:
+                    finish(name, 'failed', process.exitcode)
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+    report['seconds'] = time.time() - start
+    with open(join(fdir, 'build_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    failed = [k for k, v in report['figures'].items() if v['status'] == 'failed']
+    if failed:
+        raise RuntimeError(f'Figures failed to build: {", ".join(failed)}')
+
+    return report
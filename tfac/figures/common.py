@@ -1,45 +1,51 @@
 """
 This file contains functions that are used in multiple figures.
 """
+from functools import lru_cache
 from string import ascii_lowercase
 import sys
 import logging
-import time
-
-import seaborn as sns
-import matplotlib
-from matplotlib import gridspec, pyplot as plt
-import svgutils.transform as st
-
-
-matplotlib.use('AGG')
-
-
-matplotlib.rcParams["axes.labelsize"] = 10
-matplotlib.rcParams["axes.linewidth"] = 0.6
-matplotlib.rcParams["axes.titlesize"] = 12
-matplotlib.rcParams["font.family"] = ["sans-serif"]
-matplotlib.rcParams["font.sans-serif"] = ["Arial"]
-matplotlib.rcParams["font.size"] = 8
-matplotlib.rcParams["grid.linestyle"] = "dotted"
-matplotlib.rcParams["legend.borderpad"] = 0.35
-matplotlib.rcParams["legend.fontsize"] = 7
-matplotlib.rcParams["legend.framealpha"] = 0.5
-matplotlib.rcParams["legend.handlelength"] = 0.5
-matplotlib.rcParams["legend.handletextpad"] = 0.5
-matplotlib.rcParams["legend.labelspacing"] = 0.2
-matplotlib.rcParams["legend.markerscale"] = 0.7
-matplotlib.rcParams["svg.fonttype"] = "none"
-matplotlib.rcParams["xtick.labelsize"] = 8
-matplotlib.rcParams["xtick.major.pad"] = 1.0
-matplotlib.rcParams["xtick.minor.pad"] = 0.9
-matplotlib.rcParams["ytick.labelsize"] = 8
-matplotlib.rcParams["ytick.major.pad"] = 1.0
-matplotlib.rcParams["ytick.minor.pad"] = 0.9
+
+
+@lru_cache
+def setup_matplotlib():
+    """
+    Selects the AGG backend and sets the shared style. Done on first use so
+    that importing this module, e.g. for genFigure, stays fast.
+    """
+    import matplotlib
+
+    matplotlib.use('AGG')
+
+    matplotlib.rcParams["axes.labelsize"] = 10
+    matplotlib.rcParams["axes.linewidth"] = 0.6
+    matplotlib.rcParams["axes.titlesize"] = 12
+    matplotlib.rcParams["font.family"] = ["sans-serif"]
+    matplotlib.rcParams["font.sans-serif"] = ["Arial"]
+    matplotlib.rcParams["font.size"] = 8
+    matplotlib.rcParams["grid.linestyle"] = "dotted"
+    matplotlib.rcParams["legend.borderpad"] = 0.35
+    matplotlib.rcParams["legend.fontsize"] = 7
+    matplotlib.rcParams["legend.framealpha"] = 0.5
+    matplotlib.rcParams["legend.handlelength"] = 0.5
+    matplotlib.rcParams["legend.handletextpad"] = 0.5
+    matplotlib.rcParams["legend.labelspacing"] = 0.2
+    matplotlib.rcParams["legend.markerscale"] = 0.7
+    matplotlib.rcParams["svg.fonttype"] = "none"
+    matplotlib.rcParams["xtick.labelsize"] = 8
+    matplotlib.rcParams["xtick.major.pad"] = 1.0
+    matplotlib.rcParams["xtick.minor.pad"] = 0.9
+    matplotlib.rcParams["ytick.labelsize"] = 8
+    matplotlib.rcParams["ytick.major.pad"] = 1.0
+    matplotlib.rcParams["ytick.minor.pad"] = 0.9
 
 
 def getSetup(figsize, gridd, multz=None, empts=None, style="whitegrid"):
     """ Establish figure set-up with subplots. """
+    import seaborn as sns
+    from matplotlib import gridspec, pyplot as plt
+
+    setup_matplotlib()
     sns.set(
         style=style,
         font_scale=0.7,
@@ -86,19 +92,20 @@ def subplotLabel(axs):
 def genFigure():
     """ Main figure generation function. """
     logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
-    fdir = './output/'
-    start = time.time()
-    nameOut = 'figure' + sys.argv[1]
-
-    exec('from tfac.figures.' + nameOut + ' import makeFigure', globals())
-    ff = makeFigure()
-    ff.savefig(fdir + nameOut + '.svg', dpi=300, bbox_inches='tight', pad_inches=0)
+    from .build import build
+    from .. import instrument
 
-    logging.info(f'Figure {sys.argv[1]} is done after {time.time() - start} seconds.')
+    names = [name for name in sys.argv[1:] if name != '--force']
+    try:
+        build(names, fdir='./output/', force='--force' in sys.argv)
+    finally:
+        if instrument.is_enabled():
+            instrument.save('./output/profile.json', './output/profile.folded')
 
 
 def overlayCartoon(figFile, cartoonFile, x, y, scalee=1):
     """ Add cartoon to a figure file. """
+    import svgutils.transform as st
 
     # Overlay Figure cartoons
     template = st.fromfile(figFile)
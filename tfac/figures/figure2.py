@@ -1,19 +1,25 @@
 """
 Creates Figure 2 -- CMTF Plotting
 """
+from os.path import join
+
 import numpy as np
 import pandas as pd
 
 from .common import getSetup
-from ..dataImport import form_tensor, get_factors
+from ..checkpoint import Sweep
+from ..dataImport import PATH_HERE, form_tensor, get_factors
 from ..predict import run_model
 from ..cmtf import calcR2X, PCArand
 
+CHECKPOINT_DIR = join(PATH_HERE, 'output', '.checkpoints')
+
 
 def get_r2x_results():
     """
     Calculates CMTF R2X with regards to the number of CMTF components and
-    RNA/cytokine scaling.
+    RNA/cytokine scaling. Each sweep is checkpointed, so that an interrupted
+    run resumes where it stopped.
 
     Parameters:
         None
@@ -25,22 +31,12 @@ def get_r2x_results():
     # R2X v. Components
     tensor, matrix, patient_data = form_tensor()
     labels = patient_data.loc[:, 'status']
-    components = 12
+    components = np.arange(2, 13)
 
-    r2x_v_components = pd.DataFrame(
-        columns=['CMTF', 'PCA'],
-        index=np.arange(2, components + 1),
-        dtype=float
-    )
-    acc_v_components = pd.DataFrame(
-        columns=['CMTF', 'PCA'],
-        index=np.arange(2, components + 1).tolist(),
-        dtype=float
-    )
-    for n_components in r2x_v_components.index:
+    def by_components(n_components):
+        n_components = int(n_components)
         print(f"Starting decomposition with {n_components} components.")
         t_fac, pcaFac, _ = get_factors(r=n_components)
-        r2x_v_components.loc[n_components, 'CMTF'] = t_fac.R2X
         pca = PCArand(
             pcaFac.data,
             ncomp=n_components,
@@ -49,36 +45,54 @@ def get_r2x_results():
             normalize=True,
             missing='fill-em'
         )
-        r2x_v_components.loc[n_components, 'PCA'] = calcR2X(
-            pca.projection,
-            mIn=pca.data
-        )
-        acc_v_components.loc[n_components, 'CMTF'] = \
-            run_model(t_fac.factors[0], labels)[0]
-        acc_v_components.loc[n_components, 'PCA'] = \
+        return (
+            t_fac.R2X,
+            calcR2X(pca.projection, mIn=pca.data),
+            run_model(t_fac.factors[0], labels)[0],
             run_model(pcaFac.scores, labels)[0]
+        )
+
+    results = Sweep(
+        join(CHECKPOINT_DIR, 'fig2_components.npz')
+    ).run(by_components, components)
+    r2x_v_components = pd.DataFrame(
+        results[:, :2],
+        columns=['CMTF', 'PCA'],
+        index=components
+    )
+    acc_v_components = pd.DataFrame(
+        results[:, 2:],
+        columns=['CMTF', 'PCA'],
+        index=components.tolist()
+    )
 
     # R2X v. Scaling
     scalingV = np.logspace(-10, 10, base=2, num=21)
+
+    def by_scaling(scaling):
+        tensor, matrix, _ = form_tensor(scaling)
+        t_fac, pcaFac, _ = get_factors(variance_scaling=scaling)
+        return (
+            t_fac.R2X,
+            calcR2X(t_fac, tIn=tensor),
+            calcR2X(t_fac, mIn=matrix),
+            run_model(t_fac.factors[0], labels)[0],
+            run_model(pcaFac.scores, labels)[0]
+        )
+
+    results = Sweep(
+        join(CHECKPOINT_DIR, 'fig2_scaling.npz')
+    ).run(by_scaling, scalingV)
     r2x_v_scaling = pd.DataFrame(
+        results[:, :3],
         index=scalingV,
         columns=["Total", "Tensor", "Matrix"]
     )
     acc_v_scaling = pd.DataFrame(
+        results[:, 3:],
         columns=['CMTF', 'PCA'],
-        index=scalingV.tolist(),
-        dtype=float
+        index=scalingV.tolist()
     )
-    for scaling in r2x_v_scaling.index:
-        tensor, matrix, _ = form_tensor(scaling)
-        t_fac, pcaFac, _ = get_factors(variance_scaling=scaling)
-        r2x_v_scaling.loc[scaling, "Total"] = t_fac.R2X
-        r2x_v_scaling.loc[scaling, "Tensor"] = calcR2X(t_fac, tIn=tensor)
-        r2x_v_scaling.loc[scaling, "Matrix"] = calcR2X(t_fac, mIn=matrix)
-        acc_v_scaling.loc[scaling, 'CMTF'] = \
-            run_model(t_fac.factors[0], labels)[0]
-        acc_v_scaling.loc[scaling, 'PCA'] = \
-            run_model(pcaFac.scores, labels)[0]
 
     return r2x_v_components, acc_v_components, r2x_v_scaling, acc_v_scaling
 
@@ -10,7 +10,7 @@ from sklearn.metrics import r2_score, roc_curve
 
 from .common import getSetup
 from ..dataImport import import_validation_patient_metadata, get_factors, import_cytokines, import_rna
-from ..predict import get_accuracy, predict_known, predict_validation, predict_regression
+from ..predict import evaluate_sources, get_accuracy, predict_regression
 
 COLOR_CYCLE = matplotlib.rcParams['axes.prop_cycle'].by_key()['color'][2:]
 PATH_HERE = dirname(dirname(abspath(__file__)))
@@ -27,27 +27,15 @@ def run_validation(data_types, patient_data):
     Returns:
         predictions (pandas.Series): predictions for each data source
     """
-    predictions = pd.DataFrame(
-        index=patient_data.index
+    labels = patient_data.loc[:, 'status']
+    jobs = [(source, data, labels) for source, data in data_types]
+    predictions, probabilities = evaluate_sources(
+        jobs,
+        index=patient_data.index[patient_data['status'] == 'Unknown'],
+        validation=True
     )
-    predictions = predictions.loc[patient_data['status'] == 'Unknown']
-    probabilities = predictions.copy()
 
     validation_meta = import_validation_patient_metadata()
-
-    for data_type in data_types:
-        source = data_type[0]
-        data = data_type[1]
-
-        data = data.reindex(index=patient_data.index)
-        data = data.dropna(axis=0)
-        labels = patient_data.loc[data.index, 'status']
-
-        _predictions = predict_validation(data, labels)
-        _probabilities = predict_validation(data, labels, predict_proba=True)
-        predictions.loc[_predictions.index, source] = _predictions
-        probabilities.loc[_probabilities.index, source] = _probabilities
-
     predictions.loc[:, 'Actual'] = validation_meta.loc[:, 'status']
     return predictions, probabilities
 
@@ -63,50 +51,30 @@ def run_cv(data_types, patient_data):
     Returns:
         predictions (pandas.Series): predictions for each data source
     """
-    predictions = pd.DataFrame(
-        index=patient_data.index
-    )
-    sex_predictions = pd.DataFrame(
-        index=patient_data.index
-    )
-    race_predictions = pd.DataFrame(
-        index=patient_data.index
-    )
-    probabilities = predictions.copy()
-
-    prediction_types = [
-        predictions,
-        sex_predictions,
-        race_predictions
-    ]
     columns = [
         'status',
         'gender',
         'race'
     ]
-    for column, df in zip(columns, prediction_types):
-        for data_type in data_types:
-            source = data_type[0]
-            data = data_type[1]
-
-            data = data.reindex(index=patient_data.index)
-            data = data.dropna(axis=0)
-            labels = patient_data.loc[data.index, column]
-
-            _predictions, _ = predict_known(data, labels)
-            if column == 'status':
-                _probabilities, _ = predict_known(
-                    data,
-                    labels,
-                    method='predict_proba'
-                )
-                probabilities.loc[_probabilities.index, source] = _probabilities
-
-            df.loc[_predictions.index, source] = _predictions
+    jobs = [
+        ((column, source), data, patient_data.loc[:, column])
+        for column in columns
+        for source, data in data_types
+    ]
+    predictions, probabilities = evaluate_sources(
+        jobs,
+        index=patient_data.index,
+        predict_proba=[job[0] for job in jobs if job[0][0] == 'status']
+    )
 
+    prediction_types = []
+    for column in columns:
+        df = predictions.loc[:, column].copy()
         df.loc[:, 'Actual'] = patient_data.loc[:, column]
+        prediction_types.append(df)
 
-    return predictions, probabilities, sex_predictions, race_predictions
+    return prediction_types[0], probabilities.loc[:, 'status'], \
+        prediction_types[1], prediction_types[2]
 
 
 def run_age_regression(data, patient_data):
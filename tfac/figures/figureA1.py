@@ -5,7 +5,7 @@ import pandas as pd
 import numpy as np
 
 from .common import subplotLabel, getSetup
-from ..impute import evaluate_missing
+from ..impute import evaluate_missing_replicates
 
 
 def makeFigure():
@@ -29,8 +29,8 @@ def makeFigure():
     except FileNotFoundError:
         print("Building chords...")
         # Imputing chords dataframe
-        chords_df = pd.concat([pd.DataFrame({'Components': comps, 'R2X': evaluate_missing(comps, 15, chords=True)[0]})
-                               for _ in range(rep)], axis=0)
+        chords = evaluate_missing_replicates(comps, 15, chords=True, rep=rep)[0]
+        chords_df = pd.DataFrame({'Components': np.tile(comps, rep), 'R2X': chords.ravel()})
         chords_df.to_csv('tfac/data/fig3_chords_df.csv', index=False)
     chords_df = chords_df.groupby('Components').agg({'R2X': ['mean', 'sem']})
 
@@ -39,8 +39,8 @@ def makeFigure():
     except FileNotFoundError:
         print("Building singles...")
         # Single imputations dataframe
-        single_df = pd.concat([pd.DataFrame(np.vstack((evaluate_missing(comps, 15, chords=False)[0:2], comps)).T,
-                                            columns=['CMTF', 'PCA', 'Components']) for _ in range(rep)], axis=0)
+        CMTFR2X, PCAR2X = evaluate_missing_replicates(comps, 15, chords=False, rep=rep)
+        single_df = pd.DataFrame({'CMTF': CMTFR2X.ravel(), 'PCA': PCAR2X.ravel(), 'Components': np.tile(comps, rep)})
         single_df.to_csv('tfac/data/fig3_single_df.csv', index=False)
     single_df = single_df.groupby(['Components']).agg(['mean', 'sem'])
 
@@ -11,8 +11,7 @@ from sklearn.metrics import r2_score, roc_curve
 from .common import getSetup
 from ..cmtf import OPTIMAL_RANK
 from ..dataImport import import_validation_patient_metadata, get_factors
-from ..predict import get_accuracy, predict_known, predict_validation, \
-    predict_regression
+from ..predict import evaluate_sources, get_accuracy
 
 COLOR_CYCLE = matplotlib.rcParams['axes.prop_cycle'].by_key()['color'][2:]
 PATH_HERE = dirname(dirname(abspath(__file__)))
@@ -29,54 +28,24 @@ def get_predictions(data_types, patient_data):
     Returns:
         predictions (pandas.Series): predictions for each data source
     """
-    predictions = pd.DataFrame(
+    labels = patient_data.loc[:, 'status']
+    jobs = []
+    for source, data in data_types:
+        for svc in [True, False]:
+            name = source + (': SVM' if svc else ': LR')
+            jobs.append((name, data, labels, svc))
+
+    val_predictions, val_probabilities = evaluate_sources(
+        jobs,
+        index=patient_data.index[patient_data['status'] == 'Unknown'],
+        validation=True
+    )
+    predictions, probabilities = evaluate_sources(
+        jobs,
         index=patient_data.index
     )
-    probabilities = predictions.copy()
-
-    val_predictions = predictions.copy(deep=True)
-    val_predictions = val_predictions.loc[patient_data['status'] == 'Unknown']
-    val_probabilities = val_predictions.copy(deep=True)
 
     validation_meta = import_validation_patient_metadata()
-
-    for data_type in data_types:
-        for svc in [True, False]:
-            if data_type == 'CMTF' and svc:
-                continue
-
-            source = data_type[0]
-            data = data_type[1]
-
-            if svc:
-                source = source + ': SVM'
-            else:
-                source = source + ': LR'
-
-            data = data.reindex(index=patient_data.index)
-            data = data.dropna(axis=0)
-            labels = patient_data.loc[data.index, 'status']
-
-            _predictions = predict_validation(data, labels, svc=svc)
-            _probabilities = predict_validation(
-                data,
-                labels,
-                svc=svc,
-                predict_proba=True
-            )
-            val_predictions.loc[_predictions.index, source] = _predictions
-            val_probabilities.loc[_probabilities.index, source] = _probabilities
-
-            _predictions, _ = predict_known(data, labels, svc=svc)
-            _probabilities, _ = predict_known(
-                data,
-                labels,
-                method='predict_proba',
-                svc=svc
-            )
-            predictions.loc[_predictions.index, source] = _predictions
-            probabilities.loc[_probabilities.index, source] = _probabilities
-
     predictions.loc[:, 'Actual'] = patient_data.loc[:, 'status']
     val_predictions.loc[:, 'Actual'] = validation_meta.loc[:, 'status']
     return predictions, probabilities, val_predictions, val_probabilities
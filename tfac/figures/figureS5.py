@@ -8,7 +8,7 @@ import pandas as pd
 
 from .common import getSetup
 from ..dataImport import import_validation_patient_metadata, get_factors, import_cytokines, import_rna
-from ..predict import get_accuracy, predict_known, predict_validation, predict_regression
+from ..predict import evaluate_sources, get_accuracy, predict_regression
 
 COLOR_CYCLE = matplotlib.rcParams['axes.prop_cycle'].by_key()['color'][2:]
 PATH_HERE = dirname(dirname(abspath(__file__)))
@@ -25,24 +25,15 @@ def run_validation(data_types, patient_data):
     Returns:
         predictions (pandas.Series): predictions for each data source
     """
-    predictions = pd.DataFrame(
-        index=patient_data.index
+    labels = patient_data.loc[:, 'status']
+    jobs = [(source, data, labels) for source, data in data_types]
+    predictions, _ = evaluate_sources(
+        jobs,
+        index=patient_data.index[patient_data['status'] == 'Unknown'],
+        validation=True
     )
-    predictions = predictions.loc[patient_data['status'] == 'Unknown']
-    validation_meta = import_validation_patient_metadata()
-
-    for data_type in data_types:
-        source = data_type[0]
-        data = data_type[1]
-
-        data = data.reindex(index=patient_data.index)
-        data = data.dropna(axis=0)
-        labels = patient_data.loc[data.index, 'status']
-
-        _predictions = predict_validation(data, labels)
-        _probabilities = predict_validation(data, labels, predict_proba=True)
-        predictions.loc[_predictions.index, source] = _predictions
 
+    validation_meta = import_validation_patient_metadata()
     predictions.loc[:, 'Actual'] = validation_meta.loc[:, 'status']
     return predictions
 
@@ -58,21 +49,9 @@ def run_cv(data_types, patient_data):
     Returns:
         predictions (pandas.Series): predictions for each data source
     """
-    predictions = pd.DataFrame(
-        index=patient_data.index
-    )
-
-    for data_type in data_types:
-        source = data_type[0]
-        data = data_type[1]
-
-        data = data.reindex(index=patient_data.index)
-        data = data.dropna(axis=0)
-        labels = patient_data.loc[data.index, 'status']
-
-        _predictions, _ = predict_known(data, labels)
-        predictions.loc[_predictions.index, source] = _predictions
-
+    labels = patient_data.loc[:, 'status']
+    jobs = [(source, data, labels) for source, data in data_types]
+    predictions, _ = evaluate_sources(jobs, index=patient_data.index)
     predictions.loc[:, 'Actual'] = patient_data.loc[:, 'status']
 
     return predictions
@@ -1,9 +1,9 @@
 """ Evaluate the ability of CMTF to impute data. """
 
 import numpy as np
-from statsmodels.multivariate.pca import PCA
 from .dataImport import form_tensor
-from .cmtf import perform_CMTF, calcR2X
+from .cmtf import perform_CMTF, calcR2X, split_budget
+from .instrument import profiled
 
 
 def flatten_to_mat(tensor, matrix=None):
@@ -16,8 +16,15 @@ def flatten_to_mat(tensor, matrix=None):
     return tMat
 
 
-def gen_missing(cube, missing_num, emin=6):
-    """ Generate a cube with missing values """
+def _protected(cube, emin=6, rng=np.random):
+    """
+    Chooses emin measured values of each subject and of each chord, which
+    are kept when values are removed.
+
+    Returns:
+        fill_cube (numpy.array): 1 for values to keep
+        choose_cube (numpy.array): whether each other value is measured
+    """
     choose_cube = np.isfinite(cube)
     fill_cube = np.zeros_like(cube, dtype=int)
 
@@ -27,7 +34,7 @@ def gen_missing(cube, missing_num, emin=6):
         idxs = np.argwhere(choose_cube[ii, :])
         if len(idxs) <= 0:
             continue
-        jk = idxs[np.random.choice(idxs.shape[0], emin, replace=False)]
+        jk = idxs[rng.choice(idxs.shape[0], emin, replace=False)]
         if cube.ndim == 3:
             fill_cube[ii, jk[:, 0], jk[:, 1]] = 1
             choose_cube[ii, jk[:, 0], jk[:, 1]] = 0
@@ -41,7 +48,7 @@ def gen_missing(cube, missing_num, emin=6):
         idxs = np.argwhere(choose_cube[:, jk[0], jk[1]]) if cube.ndim == 3 else np.argwhere(choose_cube[:, jk[0]])
         if len(idxs) <= 0:
             continue
-        iis = idxs[np.random.choice(idxs.shape[0], fill_feat[jk[0], jk[1]], replace=False)]
+        iis = idxs[rng.choice(idxs.shape[0], fill_feat[tuple(jk)], replace=False)]
         if cube.ndim == 3:
             fill_cube[iis, jk[0], jk[1]] = 1
             choose_cube[iis, jk[0], jk[1]] = 0
@@ -49,6 +56,13 @@ def gen_missing(cube, missing_num, emin=6):
             fill_cube[iis, jk[0]] = 1
             choose_cube[iis, jk[0]] = 0
     assert np.all((np.sum(fill_cube, axis=0) >= emin) == np.any(np.isfinite(cube), axis=0))
+    return fill_cube, choose_cube
+
+
+@profiled
+def gen_missing(cube, missing_num, emin=6):
+    """ Generate a cube with missing values """
+    fill_cube, choose_cube = _protected(cube, emin)
 
     # fill up the rest to the missing nums
     to_fill = np.sum(np.isfinite(cube)) - missing_num - np.sum(fill_cube)
@@ -66,24 +80,84 @@ def gen_missing(cube, missing_num, emin=6):
     return gen_cube
 
 
+def _chord_missing(cube, numSample):
+    """ Removes numSample random chords of cytokine and source from cube. """
+    missingCube = np.copy(cube)
+    for _ in range(numSample):
+        idxs = np.argwhere(np.isfinite(missingCube))
+        i, j, k = idxs[np.random.choice(idxs.shape[0], 1)][0]
+        missingCube[:, j, k] = np.nan
+    return missingCube
+
+
+@profiled
 def evaluate_missing(comps, numSample=15, chords=True):
     """ Wrapper for chord loss or individual loss """
     cube, glyCube, _ = form_tensor()
     if chords:
-        missingCube = np.copy(cube)
-        for _ in range(numSample):
-            idxs = np.argwhere(np.isfinite(missingCube))
-            i, j, k = idxs[np.random.choice(idxs.shape[0], 1)][0]
-            missingCube[:, j, k] = np.nan
+        missingCube = _chord_missing(cube, numSample)
     else:
         missingCube = gen_missing(np.copy(cube), numSample)
 
     return impute_accuracy(missingCube, glyCube, comps, PCAcompare=(not chords))
 
 
-def impute_accuracy(missingCube, missingGlyCube, comps, PCAcompare=True):
-    """ Calculate the imputation R2X """
+@profiled
+def evaluate_missing_replicates(comps, numSample=15, chords=True, rep=10, max_seconds=None):
+    """
+    Runs evaluate_missing for rep replicates, fitting every replicate at
+    once with perform_CMTF_batched, within max_seconds of CMTF fitting if
+    given.
+
+    Returns:
+        CMTFR2X (numpy.array): replicates x comps imputation R2X of CMTF
+        PCAR2X (numpy.array): replicates x comps imputation R2X of PCA;
+            zeros for chords
+    """
     cube, glyCube, _ = form_tensor()
+    if chords:
+        missingCubes = [_chord_missing(cube, numSample) for _ in range(rep)]
+    else:
+        missingCubes = [gen_missing(np.copy(cube), numSample) for _ in range(rep)]
+
+    return impute_accuracy_batched(
+        np.stack(missingCubes),
+        glyCube,
+        comps,
+        PCAcompare=(not chords),
+        cube=cube,
+        glyCube=glyCube,
+        max_seconds=max_seconds
+    )
+
+
+def _pca_inputs(missingCube, missingGlyCube, cube, glyCube):
+    """ Flattened data with missing values, and the values to impute. """
+    missingMat = flatten_to_mat(missingCube, missingGlyCube)
+    imputeMat = np.copy(flatten_to_mat(cube, glyCube))
+    imputeMat[np.isfinite(missingMat)] = np.nan
+    return missingMat, imputeMat
+
+
+def _pca_R2X(missingMat, imputeMat, nComp):
+    """ Imputation R2X of PCA with nComp components. """
+    from statsmodels.multivariate.pca import PCA
+
+    outt = PCA(missingMat, ncomp=nComp, missing="fill-em", standardize=False, demean=False, normalize=False)
+    recon_pca = outt.scores @ outt.loadings.T
+    return calcR2X(recon_pca, mIn=imputeMat)
+
+
+@profiled
+def impute_accuracy(missingCube, missingGlyCube, comps, PCAcompare=True, cube=None, glyCube=None, max_seconds=None):
+    """
+    Calculate the imputation R2X. cube and glyCube are the complete data
+    that missingCube and missingGlyCube were derived from, and default to
+    the output of form_tensor. If max_seconds is given, it is split over the
+    CMTF fits in proportion to their number of components.
+    """
+    if cube is None or glyCube is None:
+        cube, glyCube, _ = form_tensor()
     CMTFR2X = np.zeros(comps.shape)
     PCAR2X = np.zeros(comps.shape)
 
@@ -94,18 +168,56 @@ def impute_accuracy(missingCube, missingGlyCube, comps, PCAcompare=True):
     imputeGlyCube[np.isfinite(missingGlyCube)] = np.nan
 
     if PCAcompare:
-        missingMat = flatten_to_mat(missingCube, missingGlyCube)
-        imputeMat = np.copy(flatten_to_mat(cube, glyCube))
-        imputeMat[np.isfinite(missingMat)] = np.nan
+        missingMat, imputeMat = _pca_inputs(missingCube, missingGlyCube, cube, glyCube)
 
+    budgets = split_budget(max_seconds, comps)
     for ii, nComp in enumerate(comps):
         # reconstruct with some values missing
-        recon_cmtf, _ = perform_CMTF(missingCube, missingGlyCube, nComp)
+        recon_cmtf, _ = perform_CMTF(missingCube, missingGlyCube, nComp, max_seconds=next(budgets))
         CMTFR2X[ii] = calcR2X(recon_cmtf, tIn=imputeCube, mIn=imputeGlyCube)
 
         if PCAcompare:
-            outt = PCA(missingMat, ncomp=nComp, missing="fill-em", standardize=False, demean=False, normalize=False)
-            recon_pca = outt.scores @ outt.loadings.T
-            PCAR2X[ii] = calcR2X(recon_pca, mIn=imputeMat)
+            PCAR2X[ii] = _pca_R2X(missingMat, imputeMat, nComp)
+
+    return CMTFR2X, PCAR2X
+
+
+@profiled
+def impute_accuracy_batched(missingCubes, missingGlyCube, comps, PCAcompare=True, cube=None, glyCube=None, max_seconds=None, init='pca'):
+    """
+    Calculate the imputation R2X, as impute_accuracy does, for a stack of
+    replicate missingCubes sharing missingGlyCube. CMTF is fit to all
+    replicates at once by perform_CMTF_batched, and max_seconds is split
+    over the batches as in impute_accuracy. Each replicate is initialized by
+    PCA, as in impute_accuracy, unless init is None for the batched SVD.
+
+    Returns:
+        CMTFR2X (numpy.array): replicates x comps imputation R2X of CMTF
+        PCAR2X (numpy.array): replicates x comps imputation R2X of PCA
+    """
+    from .batched import perform_CMTF_batched
+
+    if cube is None or glyCube is None:
+        cube, glyCube, _ = form_tensor()
+    CMTFR2X = np.zeros((missingCubes.shape[0], comps.size))
+    PCAR2X = np.zeros((missingCubes.shape[0], comps.size))
+
+    # compare artificially introduced missingness only
+    imputeCubes = np.repeat(cube[np.newaxis], missingCubes.shape[0], axis=0)
+    imputeCubes[np.isfinite(missingCubes)] = np.nan
+    imputeGlyCube = np.copy(glyCube)
+    imputeGlyCube[np.isfinite(missingGlyCube)] = np.nan
+
+    budgets = split_budget(max_seconds, comps)
+    for ii, nComp in enumerate(comps):
+        tFacs = perform_CMTF_batched(missingCubes, missingGlyCube, nComp, init=init, max_seconds=next(budgets))
+        for jj, recon_cmtf in enumerate(tFacs):
+            CMTFR2X[jj, ii] = calcR2X(recon_cmtf, tIn=imputeCubes[jj], mIn=imputeGlyCube)
+
+    if PCAcompare:
+        for jj, missingCube in enumerate(missingCubes):
+            missingMat, imputeMat = _pca_inputs(missingCube, missingGlyCube, cube, glyCube)
+            for ii, nComp in enumerate(comps):
+                PCAR2X[jj, ii] = _pca_R2X(missingMat, imputeMat, nComp)
 
     return CMTFR2X, PCAR2X
@@ -0,0 +1,234 @@
+"""
+Lightweight timing instrumentation. Spans record wall time, CPU time and the
+peak resident set size of the process so far as they end, and nest within
+each other. The peak is the process's lifetime peak, not that of the span:
+every span ending after the largest allocation reports the same value.
+
+Instrumentation is disabled unless the TFAC_PROFILE environment variable is
+set or enable() is called; disabled spans cost a single flag check.
+"""
+from functools import wraps
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_enabled = bool(os.environ.get('TFAC_PROFILE'))
+_local = threading.local()
+_roots = []
+_lock = threading.Lock()
+
+
+def enable():
+    """ Starts recording spans. """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """ Stops recording spans. """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """ Returns whether spans are being recorded. """
+    return _enabled
+
+
+def reset():
+    """
+    Discards all recorded spans, and forgets spans open in this thread, e.g.
+    those inherited by a forked worker process.
+    """
+    _local.stack = []
+    with _lock:
+        _roots.clear()
+
+
+def _process_peak():
+    """ Peak resident set size of this process so far, in megabytes. """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+class _NullSpan:
+    """ Span returned while instrumentation is disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """ Records one timed region and the spans nested within it. """
+
+    def __init__(self, name):
+        self.record = {'name': name, 'children': []}
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+
+        if stack:
+            stack[-1]['children'].append(self.record)
+        else:
+            with _lock:
+                _roots.append(self.record)
+
+        stack.append(self.record)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.record['wall'] = time.perf_counter() - self._wall
+        self.record['cpu'] = time.process_time() - self._cpu
+        self.record['process_peak_mb'] = _process_peak()
+        _local.stack.pop()
+        return False
+
+
+def span(name):
+    """
+    Context manager timing the enclosed block.
+
+    Parameters:
+        name (str): span name
+
+    Returns:
+        span: context manager
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def profiled(func=None, name=None):
+    """
+    Decorator timing every call of a function. When combined with lru_cache,
+    apply lru_cache outermost so cached calls are not recorded.
+
+    Parameters:
+        func (callable): function to wrap
+        name (str, default: None): span name; defaults to the qualified
+            function name
+
+    Returns:
+        wrapped (callable): instrumented function
+    """
+    if func is None:
+        return lambda f: profiled(f, name=name)
+
+    if name is None:
+        name = f'{func.__module__}.{func.__qualname__}'
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        with _Span(name):
+            return func(*args, **kwargs)
+
+    return wrapped
+
+
+def spans():
+    """
+    Returns the recorded spans.
+
+    Returns:
+        spans (list[dict]): top-level spans; each has a name, wall and CPU
+            seconds, the peak RSS of the process at their end in megabytes,
+            and child spans
+    """
+    with _lock:
+        return list(_roots)
+
+
+def add_spans(records):
+    """
+    Adds spans recorded elsewhere, e.g. in a worker process, under the
+    currently open span if there is one.
+
+    Parameters:
+        records (list[dict]): output of spans
+
+    Returns:
+        None
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1]['children'].extend(records)
+    else:
+        with _lock:
+            _roots.extend(records)
+
+
+def collapsed(records=None):
+    """
+    Converts spans to collapsed stacks, as read by flamegraph.pl and
+    speedscope. Each line is a semicolon-separated stack and the wall time
+    spent in that span itself, excluding its children, in microseconds.
+
+    Parameters:
+        records (list[dict], default: None): spans; defaults to those
+            recorded
+
+    Returns:
+        lines (list[str]): collapsed stacks
+    """
+    if records is None:
+        records = spans()
+
+    totals = {}
+
+    def visit(record, prefix):
+        stack = f"{prefix};{record['name']}" if prefix else record['name']
+        children = record['children']
+        own = record.get('wall', 0.0) - \
+            sum(child.get('wall', 0.0) for child in children)
+        totals[stack] = totals.get(stack, 0) + max(int(own * 1E6), 0)
+        for child in children:
+            visit(child, stack)
+
+    for record in records:
+        visit(record, '')
+
+    return [f'{stack} {value}' for stack, value in totals.items()]
+
+
+def save(path, folded_path=None):
+    """
+    Writes the recorded spans as JSON, and optionally as collapsed stacks.
+
+    Parameters:
+        path (str): JSON file to write
+        folded_path (str, default: None): collapsed stack file to write
+
+    Returns:
+        None
+    """
+    records = spans()
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=2)
+
+    if folded_path is not None:
+        with open(folded_path, 'w') as f:
+            f.write('\n'.join(collapsed(records)) + '\n')
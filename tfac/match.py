@@ -0,0 +1,191 @@
+"""
+Component matching across CMTF fits, e.g. of multiple starts, bootstrap
+resamples or a sweep. sort_factors and reorient_factors only order the
+components within one fit; here every pair of fits is matched at once, by
+the factor match score (FMS), the product over modes of the absolute
+congruence of components, and each fit is permuted and sign flipped onto a
+reference fit.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from .instrument import profiled
+
+MODES = ('subjects', 'cytokines', 'sources')
+
+
+def _modes(fits):
+    """
+    Factors of each mode, stacked over fits, with the RNA factors as the
+    last mode if the fits have them.
+
+    Returns:
+        stacks (list of numpy.array): fits x rows x components, by mode
+        names (list of str): name of each mode
+    """
+    if len(fits) < 2:
+        raise ValueError("At least two fits are needed to match components")
+    if len({fit.rank for fit in fits}) > 1:
+        raise ValueError("Fits must have the same rank to be matched")
+
+    n_modes = len(fits[0].factors)
+    names = [MODES[m] if n_modes == len(MODES) else f'mode {m}'
+             for m in range(n_modes)]
+    stacks = [np.stack([fit.factors[m] for fit in fits])
+              for m in range(n_modes)]
+    if all(getattr(fit, 'mFactor', None) is not None for fit in fits):
+        stacks.append(np.stack([fit.mFactor for fit in fits]))
+        names.append('RNA')
+    return stacks, names
+
+
+def _normalized(stack):
+    """ Scales each component of a fits x rows x components stack to 1. """
+    norms = np.linalg.norm(stack, axis=1, keepdims=True)
+    return stack / np.where(norms > 0.0, norms, 1.0)
+
+
+def _congruence(stack):
+    """
+    Signed congruence of every component of every fit with every component
+    of every other fit, in one product.
+
+    Returns:
+        congruence (numpy.array): fits x fits x components x components
+    """
+    n_fits, n_rows, rank = stack.shape
+    flat = _normalized(stack).transpose(1, 0, 2).reshape(n_rows, -1)
+    gram = flat.T @ flat
+    return gram.reshape(n_fits, rank, n_fits, rank).transpose(0, 2, 1, 3)
+
+
+def _sign_patterns(n_modes, coupled):
+    """
+    Sign flips that leave a fit unchanged: the signs of the tensor modes
+    multiply to 1, and the RNA factors flip with the subjects.
+
+    Returns:
+        patterns (numpy.array): patterns x modes of 1 and -1
+    """
+    n_tensor = n_modes - 1 if coupled else n_modes
+    patterns = []
+    for free in itertools.product((1, -1), repeat=n_tensor - 1):
+        signs = list(free) + [np.prod(free)]
+        if coupled:
+            signs.append(signs[0])
+        patterns.append(signs)
+    return np.array(patterns, dtype=np.int8)
+
+
+@profiled
+def pairwise_match(fits):
+    """
+    Matches the components of every pair of fits. Congruences of all pairs
+    are computed in one matrix product per mode. Each component is matched
+    to its best scoring one where these already form a permutation, which
+    is then optimal, and otherwise by the Hungarian algorithm. The signs of
+    matched components are chosen, among flips that leave the fit
+    unchanged, to make their congruence in each mode positive where
+    possible.
+
+    Parameters:
+        fits (list of CPTensor): fits of the same rank, e.g. from
+            perform_CMTF; their RNA factors are matched too, if all have them
+
+    Returns:
+        scores (numpy.array): fits x fits x components, FMS of each
+            component of the first fit with its match in the second
+        permutation (numpy.array): fits x fits x components, component of
+            the second fit matched to each of the first
+        signs (numpy.array): fits x fits x modes x components, flips of the
+            matched components of the second fit
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    stacks, names = _modes(fits)
+    fms = np.abs(_congruence(stacks[0]))
+    for stack in stacks[1:]:
+        fms *= np.abs(_congruence(stack))
+
+    # Where each component's best match is distinct, that is the optimum
+    permutation = np.argmax(fms, axis=3)
+    rank = permutation.shape[2]
+    distinct = np.all(np.sort(permutation, axis=2) == np.arange(rank), axis=2)
+    for a, b in zip(*np.nonzero(~distinct)):
+        permutation[a, b] = linear_sum_assignment(fms[a, b], maximize=True)[1]
+    scores = np.take_along_axis(fms, permutation[..., np.newaxis], axis=3)
+    del fms
+
+    # Signed congruence of matched components, and the best valid flips
+    matched = np.stack([
+        np.take_along_axis(
+            _congruence(stack), permutation[..., np.newaxis], axis=3
+        )[..., 0]
+        for stack in stacks
+    ], axis=2)
+    patterns = _sign_patterns(len(stacks), names[-1] == 'RNA')
+    best = np.argmax(np.einsum('pm,abmk->abkp', patterns, matched), axis=3)
+    signs = patterns[best].transpose(0, 1, 3, 2)
+
+    return scores[..., 0], permutation, signs
+
+
+@profiled
+def align_fits(fits, reference=None, threshold=0.9):
+    """
+    Permutes and sign flips the components of each fit onto a reference
+    fit, and scores how stable each component is across fits.
+
+    Parameters:
+        fits (list of CPTensor): fits of the same rank
+        reference (int, default: None): index of the reference fit;
+            defaults to the fit with the highest mean FMS to the others
+        threshold (float, default: 0.9): FMS at which a component counts as
+            reproduced
+
+    Returns:
+        reference (int): index of the reference fit
+        stacks (dict): aligned factors of each mode, fits x rows x
+            components, and 'weights', fits x components
+        stability (pandas.DataFrame): for each component of the reference,
+            the mean and StD of its FMS with the other fits, the fraction
+            reproduced, and its mean congruence in each mode
+    """
+    scores, permutation, signs = pairwise_match(fits)
+    n_fits = len(fits)
+    if reference is None:
+        fms = np.mean(scores, axis=2)
+        np.fill_diagonal(fms, 0.0)
+        reference = int(np.argmax(np.sum(fms, axis=1)))
+
+    stacks, names = _modes(fits)
+    order = permutation[reference][:, np.newaxis, :]
+    flips = signs[reference]
+    aligned = {
+        name: np.take_along_axis(stack, order, axis=2) * flips[:, m, np.newaxis]
+        for m, (name, stack) in enumerate(zip(names, stacks))
+    }
+    weights = np.stack([
+        np.ones(fit.rank) if fit.weights is None else fit.weights
+        for fit in fits
+    ])
+    aligned['weights'] = np.take_along_axis(weights, order[:, 0], axis=1)
+
+    others = np.arange(n_fits) != reference
+    fms = scores[reference, others]
+    stability = pd.DataFrame(
+        {
+            'FMS': np.mean(fms, axis=0),
+            'FMS StD': np.std(fms, axis=0, ddof=1) if n_fits > 2 else np.nan,
+            'reproduced': np.mean(fms >= threshold, axis=0)
+        },
+        index=pd.RangeIndex(1, fms.shape[1] + 1, name='component')
+    )
+    for name in names:
+        unit = _normalized(aligned[name])
+        congruence = np.sum(unit[others] * unit[reference], axis=1)
+        stability[name] = np.mean(congruence, axis=0)
+
+    return reference, aligned, stability
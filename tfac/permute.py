@@ -0,0 +1,294 @@
+"""
+Permutation tests for cross-validated prediction accuracy.
+"""
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+
+from .predict import get_cv_splits, run_model
+
+
+def fold_designs(data, splits):
+    """
+    Builds the training and test design matrices for each fold once, with an
+    intercept column appended.
+
+    Parameters:
+        data (numpy.array): samples x features
+        splits (tuple): cross-validation folds
+
+    Returns:
+        designs (list[tuple]): (train, test, train design, test design) for
+            each fold
+    """
+    design = np.hstack((data, np.ones((data.shape[0], 1))))
+    return [(train, test, design[train], design[test]) for train, test in splits]
+
+
+def batched_logistic(design, labels, C=1.0, n_iter=25):
+    """
+    Fits L2-penalized logistic regressions for many label vectors at once by
+    Newton's method. The intercept (last column of design) is not penalized.
+
+    Parameters:
+        design (numpy.array): samples x features, including the intercept
+        labels (numpy.array): label sets x samples; binary
+        C (float, default: 1.0): inverse regularization strength
+        n_iter (int, default: 25): Newton iterations
+
+    Returns:
+        coef (numpy.array): label sets x features
+    """
+    penalty = np.full(design.shape[1], 1.0 / C)
+    penalty[-1] = 1E-8
+    coef = np.zeros((labels.shape[0], design.shape[1]))
+
+    for _ in range(n_iter):
+        prob = 1.0 / (1.0 + np.exp(-coef @ design.T))
+        grad = (prob - labels) @ design + coef * penalty
+        hess = np.einsum(
+            'pn,ni,nj->pij',
+            prob * (1.0 - prob),
+            design,
+            design
+        ) + np.diag(penalty)
+        step = np.linalg.solve(hess, grad[:, :, np.newaxis])[:, :, 0]
+        coef -= step
+        if np.max(np.abs(step)) < 1E-8:
+            break
+
+    return coef
+
+
+def batched_elastic_net(design, labels, C=1.0, l1_ratio=0.8, tol=1E-8,
+                        max_iter=5000):
+    """
+    Fits elastic-net logistic regressions for many label vectors at once by
+    accelerated proximal gradient descent, with the objective of
+    sklearn.linear_model.LogisticRegression(penalty='elasticnet'). The
+    intercept (last column of design) is not penalized.
+
+    Parameters:
+        design (numpy.array): samples x features, including the intercept
+        labels (numpy.array): label sets x samples; binary
+        C (float, default: 1.0): inverse regularization strength
+        l1_ratio (float, default: 0.8): share of the L1 penalty
+        tol (float, default: 1E-8): largest coefficient change at convergence
+        max_iter (int, default: 5000): most iterations
+
+    Returns:
+        coef (numpy.array): label sets x features
+    """
+    l2 = np.full(design.shape[1], (1.0 - l1_ratio) / C)
+    l1 = np.full(design.shape[1], l1_ratio / C)
+    l2[-1] = l1[-1] = 0.0
+    step = 1.0 / (np.linalg.norm(design, 2) ** 2 / 4.0 + np.max(l2))
+
+    coef = np.zeros((labels.shape[0], design.shape[1]))
+    momentum, t = coef, 1.0
+    for _ in range(max_iter):
+        prob = 1.0 / (1.0 + np.exp(-momentum @ design.T))
+        grad = (prob - labels) @ design + momentum * l2
+        shifted = momentum - step * grad
+        new = np.sign(shifted) * np.maximum(np.abs(shifted) - step * l1, 0.0)
+
+        t_new = (1.0 + np.sqrt(1.0 + 4.0 * t ** 2)) / 2.0
+        momentum = new + (t - 1.0) / t_new * (new - coef)
+        change = np.max(np.abs(new - coef))
+        coef, t = new, t_new
+        if change < tol:
+            break
+
+    return coef
+
+
+def balanced_accuracies(predicted, labels):
+    """
+    Balanced accuracy of many binary prediction sets at once.
+
+    Parameters:
+        predicted (numpy.array): prediction sets x samples
+        labels (numpy.array): label sets x samples
+
+    Returns:
+        accuracies (numpy.array): balanced accuracy of each set
+    """
+    positive = labels == 1
+    tpr = np.sum(predicted & positive, axis=1) / np.sum(positive, axis=1)
+    tnr = np.sum(~predicted & ~positive, axis=1) / np.sum(~positive, axis=1)
+    return (tpr + tnr) / 2.0
+
+
+def cv_accuracies(labels, designs, C=1.0, l1_ratio=0.0):
+    """
+    Cross-validated balanced accuracy for a batch of label sets, fitting
+    every set in each fold together.
+
+    Parameters:
+        labels (numpy.array): label sets x samples; binary
+        designs (list[tuple]): output of fold_designs
+        C (float, default: 1.0): inverse regularization strength
+        l1_ratio (float, default: 0.0): share of the L1 penalty; with none,
+            fits are solved by batched_logistic, and otherwise by
+            batched_elastic_net
+
+    Returns:
+        accuracies (numpy.array): balanced accuracy of each label set
+    """
+    predicted = np.zeros(labels.shape, dtype=bool)
+    for train, test, train_design, test_design in designs:
+        if l1_ratio > 0.0:
+            coef = batched_elastic_net(
+                train_design, labels[:, train], C, l1_ratio
+            )
+        else:
+            coef = batched_logistic(train_design, labels[:, train], C)
+        predicted[:, test] = coef @ test_design.T > 0
+
+    return balanced_accuracies(predicted, labels)
+
+
+def model_accuracies(labels, data, splits, model):
+    """
+    Cross-validated balanced accuracy for a batch of label sets with any
+    classifier, refitting it for each set and fold.
+
+    Parameters:
+        labels (numpy.array): label sets x samples; binary
+        data (numpy.array): samples x features
+        splits (tuple): cross-validation folds
+        model (sklearn estimator): classifier with fixed hyperparameters
+
+    Returns:
+        accuracies (numpy.array): balanced accuracy of each label set
+    """
+    predicted = np.zeros(labels.shape, dtype=bool)
+    for ii, label_set in enumerate(labels):
+        for train, test in splits:
+            fitted = clone(model).fit(data[train], label_set[train])
+            predicted[ii, test] = fitted.predict(data[test]) == 1
+
+    return balanced_accuracies(predicted, labels)
+
+
+def _null_batch(labels, n_permutations, seed, data, splits, designs, C,
+                l1_ratio, model):
+    """ Accuracies for one batch of label permutations. """
+    rng = np.random.default_rng(seed)
+    permuted = rng.permuted(np.tile(labels, (n_permutations, 1)), axis=1)
+    if model is None:
+        return cv_accuracies(permuted, designs, C, l1_ratio)
+
+    return model_accuracies(permuted, data, splits, model)
+
+
+def permutation_test(data, labels, n_permutations=1000, batch_size=100,
+                     C=None, l1_ratio=None, model=None, n_jobs=3,
+                     random_state=None):
+    """
+    Tests whether data predicts labels better than chance by permuting the
+    labels. The observed and permuted accuracies are computed on the same
+    cached cross-validation folds as predict_known, with a classifier whose
+    hyperparameters are held fixed.
+
+    By default, the classifier is the elastic-net logistic regression that
+    predict_known selects, with the C and l1_ratio run_model chooses on the
+    unpermuted labels; pass the C and l1_ratio of the model returned by
+    predict_known for the observed accuracy to be the one get_accuracy
+    reports for its predictions, as the search is not seeded. The search is
+    not rerun for each permutation. Each batch of permutations is fit in one
+    vectorized solve per fold. Passing model (e.g., an SVC) instead refits
+    that classifier for every permutation and fold, which is much slower.
+
+    Parameters:
+        data (pandas.DataFrame or pandas.Series): data to classify
+        labels (pandas.Series): binary labels for samples in data
+        n_permutations (int, default: 1000): label permutations
+        batch_size (int, default: 100): permutations evaluated per batch
+        C (float, default: None): inverse regularization strength of the
+            logistic regression; defaults to that chosen by run_model
+        l1_ratio (float, default: None): share of the L1 penalty; defaults
+            to that chosen by run_model, and 0 fits an L2 penalty
+        model (sklearn estimator, default: None): classifier to use instead
+        n_jobs (int, default: 3): batches evaluated in parallel
+        random_state (int, default: None): seed for the permutations
+
+    Returns:
+        accuracy (float): observed balanced accuracy
+        p_value (float): permutation p-value
+        null (numpy.array): balanced accuracy of each permutation
+    """
+    labels = labels.loc[labels != 'Unknown']
+    if isinstance(data, pd.Series):
+        data = data.loc[labels.index].to_numpy(dtype=float).reshape(-1, 1)
+    else:
+        data = data.loc[labels.index, :].to_numpy(dtype=float)
+
+    labels = labels.astype(float).astype(int).to_numpy()
+    assert set(np.unique(labels)) <= {0, 1}, "Labels must be binary"
+
+    splits = get_cv_splits(labels)
+    designs = fold_designs(data, splits) if model is None else None
+
+    if model is None:
+        if C is None or l1_ratio is None:
+            _, selected = run_model(data, labels, n_jobs=n_jobs)
+            C = selected.C if C is None else C
+            l1_ratio = selected.l1_ratio if l1_ratio is None else l1_ratio
+        accuracy = cv_accuracies(
+            labels[np.newaxis, :], designs, C, l1_ratio
+        )[0]
+    else:
+        accuracy = model_accuracies(
+            labels[np.newaxis, :], data, splits, model
+        )[0]
+
+    sizes = [batch_size] * (n_permutations // batch_size)
+    if n_permutations % batch_size:
+        sizes.append(n_permutations % batch_size)
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+
+    null = Parallel(n_jobs=n_jobs)(
+        delayed(_null_batch)(
+            labels, size, seed, data, splits, designs, C, l1_ratio, model
+        ) for size, seed in zip(sizes, seeds)
+    )
+    null = np.concatenate(null)
+    p_value = (1 + np.sum(null >= accuracy)) / (1 + len(null))
+
+    return float(accuracy), p_value, null
+
+
+def permutation_tests(jobs, **kwargs):
+    """
+    Runs permutation_test for several data sources.
+
+    Parameters:
+        jobs (list[tuple]): (name, data, target) for each data source; target
+            is a pandas.Series of binary labels. Samples missing from data
+            are dropped.
+        **kwargs: passed to permutation_test
+
+    Returns:
+        results (pandas.DataFrame): observed accuracy and p-value for each
+            data source
+        null (pandas.DataFrame): permutation accuracies; columns are data
+            sources
+    """
+    results = pd.DataFrame(
+        index=[job[0] for job in jobs],
+        columns=['Accuracy', 'P-Value'],
+        dtype=float
+    )
+    null = {}
+    for name, data, target in jobs:
+        data = data.reindex(index=target.index).dropna(axis=0)
+        accuracy, p_value, null[name] = permutation_test(
+            data,
+            target.loc[data.index],
+            **kwargs
+        )
+        results.loc[name, :] = [accuracy, p_value]
+
+    return results, pd.DataFrame(null)
@@ -1,3 +1,5 @@
+from functools import lru_cache
+import os
 import warnings
 
 import numpy as np
@@ -9,7 +11,10 @@ from sklearn.model_selection import cross_val_predict, cross_val_score, \
     RepeatedStratifiedKFold, StratifiedKFold
 from sklearn.svm import SVC
 
+from . import shared
 from .dataImport import import_validation_patient_metadata
+from .instrument import profiled
+from .shared import SharedData
 
 warnings.filterwarnings('ignore', category=UserWarning)
 
@@ -19,21 +24,41 @@ skf = RepeatedStratifiedKFold(
 )
 
 
-def predict_validation(data, labels, predict_proba=False, svc=False):
+@lru_cache
+def _cached_splits(labels, n_splits):
+    kf = StratifiedKFold(n_splits=n_splits)
+    return tuple(kf.split(np.zeros(len(labels)), labels))
+
+
+def get_cv_splits(labels, n_splits=10):
     """
-    Trains a LogisticRegressionCV model using samples with known outcomes,
-    then predicts samples with unknown outcomes.
+    Returns the cross-validation folds used by predict_known; folds are
+    cached, so repeated calls with the same labels reuse the same splits.
+
+    Parameters:
+        labels (pandas.Series): labels for samples
+        n_splits (int, default: 10): number of folds
+
+    Returns:
+        splits (tuple[tuple]): (train, test) index arrays for each fold
+    """
+    labels = tuple(np.asarray(labels).astype(str))
+    return _cached_splits(labels, n_splits)
+
+
+def _split_validation(data, labels):
+    """
+    Separates samples in the validation cohort from training samples.
 
     Parameters:
         data (pandas.DataFrame): data to classify
         labels (pandas.Series): labels for samples in data
-        predict_proba (bool, default: False): predict probability of positive
-            case
-        svc (bool): sets model to be svc
 
     Returns:
-        predictions (pandas.Series): predictions for samples with unknown
-            outcomes
+        train_data (numpy.array): training samples
+        train_labels (pandas.Series): labels for training samples
+        test_data (numpy.array): validation samples
+        test_labels (pandas.Series): labels for validation samples
     """
     validation_data = import_validation_patient_metadata()
     validation_samples = list(set(validation_data.index) & set(labels.index))
@@ -42,21 +67,40 @@ def predict_validation(data, labels, predict_proba=False, svc=False):
     test_labels = labels.loc[validation_samples]
 
     if isinstance(data, pd.Series):
-        train_data = data.loc[train_labels.index]
-        test_data = data.loc[test_labels.index]
+        train_data = data.loc[train_labels.index].values.reshape(-1, 1)
+        test_data = data.loc[test_labels.index].values.reshape(-1, 1)
     else:
         train_data = data.loc[train_labels.index, :]
         test_data = data.loc[test_labels.index, :]
 
+    return train_data, train_labels, test_data, test_labels
+
+
+@profiled
+def predict_validation(data, labels, predict_proba=False, svc=False):
+    """
+    Trains a LogisticRegressionCV model using samples with known outcomes,
+    then predicts samples with unknown outcomes.
+
+    Parameters:
+        data (pandas.DataFrame): data to classify
+        labels (pandas.Series): labels for samples in data
+        predict_proba (bool, default: False): predict probability of positive
+            case
+        svc (bool): sets model to be svc
+
+    Returns:
+        predictions (pandas.Series): predictions for samples with unknown
+            outcomes
+    """
+    train_data, train_labels, test_data, test_labels = \
+        _split_validation(data, labels)
+
     if svc:
         _, model = run_svc(data, labels)
     else:
         _, model = run_model(data, labels)
 
-    if isinstance(data, pd.Series):
-        train_data = train_data.values.reshape(-1, 1)
-        test_data = test_data.values.reshape(-1, 1)
-
     model.fit(train_data, train_labels)
 
     if predict_proba:
@@ -71,7 +115,8 @@ def predict_validation(data, labels, predict_proba=False, svc=False):
     return predictions
 
 
-def predict_known(data, labels, method='predict', svc=False):
+@profiled
+def predict_known(data, labels, method='predict', svc=False, n_jobs=3):
     """
     Predicts outcomes for all samples in data via cross-validation.
 
@@ -81,6 +126,7 @@ def predict_known(data, labels, method='predict', svc=False):
         method (str, default: 'predict'): prediction method to use; accepts any
             of ‘predict’, ‘predict_proba’, ‘predict_log_proba’, or ‘decision_function’
         svc (bool): sets model to be svc
+        n_jobs (int, default: 3): parallel jobs for model fitting
 
     Returns:
         predictions (pandas.Series): predictions for samples
@@ -95,7 +141,7 @@ def predict_known(data, labels, method='predict', svc=False):
     if svc:
         _, model = run_svc(data, labels)
     else:
-        _, model = run_model(data, labels)
+        _, model = run_model(data, labels, n_jobs=n_jobs)
 
     if isinstance(data, pd.Series):
         data = data.values.reshape(-1, 1)
@@ -106,7 +152,7 @@ def predict_known(data, labels, method='predict', svc=False):
         labels,
         cv=10,
         method=method,
-        n_jobs=3
+        n_jobs=n_jobs
     )
 
     if len(predictions.shape) > 1:
@@ -120,6 +166,7 @@ def predict_known(data, labels, method='predict', svc=False):
     return predictions, model
 
 
+@profiled
 def predict_regression(data, labels):
     """
     Predicts value for all samples in data via cross-validation.
@@ -156,7 +203,8 @@ def predict_regression(data, labels):
     return predictions, model.coef_
 
 
-def run_model(data, labels, return_coef=False):
+@profiled
+def run_model(data, labels, return_coef=False, n_jobs=3):
     """
     Runs provided LogisticRegressionCV model with the provided data
     and labels.
@@ -165,6 +213,7 @@ def run_model(data, labels, return_coef=False):
         data (pandas.DataFrame): DataFrame of CMTF components
         labels (pandas.Series): Labels for provided data
         return_coef (bool, default: False): return model coefficients
+        n_jobs (int, default: 3): parallel jobs for the hyperparameter search
 
     Returns:
         score (float): Accuracy for best-performing model (considers
@@ -190,7 +239,7 @@ def run_model(data, labels, return_coef=False):
         l1_ratios=[0.8],
         solver="saga",
         penalty="elasticnet",
-        n_jobs=3,
+        n_jobs=n_jobs,
         cv=skf,
         max_iter=100000,
         scoring='balanced_accuracy',
@@ -233,6 +282,7 @@ def get_accuracy(predicted, actual):
     return balanced_accuracy_score(actual, predicted)
 
 
+@profiled
 def run_svc(data, labels, gamma=1E-3):
     """
     Runs SVC model with the provided data and labels.
@@ -286,3 +336,152 @@ def run_svc(data, labels, gamma=1E-3):
     model.fit(data, labels)
 
     return best[1], model
+
+
+@profiled
+def _evaluate_source(data, labels, validation=False, svc=False, n_jobs=3,
+                     predict_proba=True):
+    """
+    Predicts outcomes for one data source, running a single hyperparameter
+    search for both the predictions and probabilities.
+
+    Parameters:
+        data (pandas.DataFrame): data to classify
+        labels (pandas.Series): labels for samples in data
+        validation (bool, default: False): predict the validation cohort
+            rather than cross-validating samples with known outcomes
+        svc (bool, default: False): sets model to be svc
+        n_jobs (int, default: 3): parallel jobs for model fitting
+        predict_proba (bool, default: True): also predict probabilities
+
+    Returns:
+        predictions (pandas.Series): predictions for samples
+        probabilities (pandas.Series): probability of the positive case, or
+            None if not predicted
+    """
+    if svc:
+        _, model = run_svc(data, labels)
+    else:
+        _, model = run_model(data, labels, n_jobs=n_jobs)
+
+    if validation:
+        train_data, train_labels, test_data, test_labels = \
+            _split_validation(data, labels)
+        model.fit(train_data, train_labels)
+        predictions = model.predict(test_data)
+        if predict_proba:
+            probabilities = model.predict_proba(test_data)[:, -1]
+        index = test_labels.index
+    else:
+        labels = labels.loc[labels != 'Unknown']
+        if isinstance(data, pd.Series):
+            data = data.loc[labels.index].values.reshape(-1, 1)
+        else:
+            data = data.loc[labels.index, :]
+
+        predictions = cross_val_predict(
+            model, data, labels, cv=10, n_jobs=n_jobs
+        )
+        if predict_proba:
+            probabilities = cross_val_predict(
+                model, data, labels, cv=10, method='predict_proba',
+                n_jobs=n_jobs
+            )[:, -1]
+        index = labels.index
+
+    if not predict_proba:
+        return pd.Series(predictions, index=index), None
+    return pd.Series(predictions, index=index), \
+        pd.Series(probabilities, index=index)
+
+
+def _evaluate_shared(ii, validation, svc, n_jobs, predict_proba):
+    """ Runs _evaluate_source on the ii-th data source of a shared pool. """
+    return _evaluate_source(
+        shared.get(f'data{ii}'),
+        shared.get(f'labels{ii}'),
+        validation,
+        svc,
+        n_jobs,
+        predict_proba
+    )
+
+
+@profiled
+def evaluate_sources(jobs, index=None, validation=False, svc=False,
+                     n_cpus=None, predict_proba=True):
+    """
+    Predicts outcomes for several data sources concurrently. Each source runs
+    its own hyperparameter search in a separate process; the number of
+    processes is chosen so that all searches together use at most n_cpus.
+
+    Parameters:
+        jobs (list[tuple]): (name, data, target) for each data source; target
+            is a pandas.Series of labels. An optional fourth element
+            overrides svc for that source. Samples missing from data are
+            dropped.
+        index (pandas.Index, default: None): samples to align results to;
+            defaults to the first target's index
+        validation (bool, default: False): predict the validation cohort
+            rather than cross-validating samples with known outcomes
+        svc (bool, default: False): sets model to be svc
+        n_cpus (int, default: None): CPU budget; defaults to all CPUs
+        predict_proba (bool or list, default: True): whether to predict
+            probabilities, or the names of the sources to predict them for,
+            as they only make sense for binary targets
+
+    Returns:
+        predictions (pandas.DataFrame): predictions for each data source
+        probabilities (pandas.DataFrame): probability of the positive case
+            for each data source predicted
+    """
+    if n_cpus is None:
+        n_cpus = os.cpu_count()
+    if index is None:
+        index = jobs[0][2].index
+
+    n_jobs = min(3, n_cpus)
+    workers = max(1, min(n_cpus // n_jobs, len(jobs)))
+
+    args = []
+    for job in jobs:
+        data = job[1].reindex(index=job[2].index)
+        data = data.dropna(axis=0)
+        labels = job[2].loc[data.index]
+        job_svc = job[3] if len(job) > 3 else svc
+        job_proba = predict_proba if isinstance(predict_proba, bool) \
+            else job[0] in predict_proba
+        args.append((data, labels, validation, job_svc, n_jobs, job_proba))
+
+    if workers == 1:
+        results = [_evaluate_source(*arg) for arg in args]
+    else:
+        # Share the data once; tasks carry only their index and flags
+        values = {}
+        for ii, arg in enumerate(args):
+            values[f'data{ii}'], values[f'labels{ii}'] = arg[:2]
+        with SharedData(**values) as shared_data:
+            with shared_data.executor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_evaluate_shared, ii, *arg[2:])
+                    for ii, arg in enumerate(args)
+                ]
+                results = [future.result() for future in futures]
+
+    names = [job[0] for job in jobs]
+    predictions = pd.concat(
+        [result[0] for result in results],
+        axis=1,
+        keys=names
+    ).reindex(index)
+    probabilities = {
+        name: result[1] for name, result in zip(names, results)
+        if result[1] is not None
+    }
+    probabilities = pd.concat(
+        probabilities.values(),
+        axis=1,
+        keys=probabilities.keys()
+    ).reindex(index) if probabilities else pd.DataFrame(index=index)
+
+    return predictions, probabilities
@@ -0,0 +1,191 @@
+"""
+Rank selection by cross-validation. Observed tensor entries, and RNA rows,
+are split into folds; each fold is held out in turn, CMTF is fit to the
+rest, and the held-out values are scored by their Q2X. Folds are fit in
+parallel, each rank warm started from the fit of the rank below, and
+larger ranks are only tried while the mean Q2X still improves.
+"""
+from contextlib import ExitStack
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import shared
+from .cmtf import calcR2X, perform_CMTF
+from .impute import _protected
+from .instrument import profiled
+from .shared import SharedData
+
+
+def cv_folds(tOrig, mOrig, n_folds=5, emin=6, seed=None):
+    """
+    Assigns observed values to folds. As in impute.gen_missing, emin values
+    of each subject and each tensor chord are never held out. RNA is held
+    out by whole rows, as perform_CMTF solves for the RNA factors from
+    complete rows, and only for subjects with cytokine measurements.
+
+    Parameters:
+        tOrig (numpy.array): subjects x cytokines x sources
+        mOrig (numpy.array): subjects x RNA modules
+        n_folds (int, default: 5): number of folds
+        emin (int, default: 6): values kept for each subject and chord
+        seed (int, default: None): random seed
+
+    Returns:
+        tFolds (numpy.array): fold of each tensor value; -1 if not held out
+        mFolds (numpy.array): fold of each RNA row; -1 if not held out
+    """
+    rng = np.random.default_rng(seed)
+    _, choose = _protected(tOrig, emin, rng=rng)
+
+    tFolds = np.full(tOrig.shape, -1)
+    free = np.flatnonzero(choose)
+    tFolds.flat[rng.permutation(free)] = np.arange(free.size) % n_folds
+
+    mFolds = np.full(mOrig.shape[0], -1)
+    rows = np.flatnonzero(
+        np.all(np.isfinite(mOrig), axis=1) &
+        np.any(np.isfinite(tOrig), axis=(1, 2))
+    )
+    mFolds[rng.permutation(rows)] = np.arange(rows.size) % n_folds
+    return tFolds, mFolds
+
+
+def _fit_fold(fold, r, init, seed, tol, maxiter):
+    """
+    Fits CMTF without a fold, from the shared data of select_rank.
+
+    Returns:
+        Q2X (float): Q2X of the held-out values
+        subjects (numpy.array): subject factors, to warm start from
+    """
+    tOrig, mOrig = shared.get('tensor'), shared.get('matrix')
+    tHeld = shared.get('tensor_folds') == fold
+    mHeld = shared.get('matrix_folds') == fold
+
+    np.random.seed(seed)
+    tFac, _ = perform_CMTF(
+        np.where(tHeld, np.nan, tOrig),
+        np.where(mHeld[:, np.newaxis], np.nan, mOrig),
+        r=r,
+        tol=tol,
+        maxiter=maxiter,
+        progress=False,
+        init=init
+    )
+    Q2X = calcR2X(
+        tFac,
+        tIn=np.where(tHeld, tOrig, np.nan),
+        mIn=np.where(mHeld[:, np.newaxis], mOrig, np.nan)
+    )
+    return Q2X, tFac.factors[0] * tFac.weights
+
+
+def _warm_start(subjects, rng):
+    """ Adds a small random component to the subject factors of a fit. """
+    scale = np.mean(np.linalg.norm(subjects, axis=0)) / \
+        np.sqrt(subjects.shape[0])
+    column = rng.standard_normal((subjects.shape[0], 1)) * scale
+    return np.hstack((subjects, column))
+
+
+def _one_se(table):
+    """ Smallest rank within a standard error of the best mean Q2X. """
+    best = table['mean'].idxmax()
+    cutoff = table.loc[best, 'mean'] - table.loc[best, 'sem']
+    return int(table.index[table['mean'] >= cutoff][0])
+
+
+@profiled
+def select_rank(tOrig, mOrig, max_rank=12, n_folds=5, emin=6, patience=2,
+                plateau=1e-3, confidence=0.95, tol=1e-6, maxiter=300,
+                n_jobs=None, seed=None):
+    """
+    Selects the CMTF rank by K-fold cross-validation over observed values.
+    Ranks from 1 are fit to every fold at once, in parallel; each fold's
+    fit of rank r + 1 starts from its fit of rank r with a new component.
+    Once the mean Q2X has not improved by plateau for patience ranks,
+    larger ranks are skipped. The rank chosen is the smallest whose mean
+    Q2X is within a standard error of the best.
+
+    Parameters:
+        tOrig (numpy.array): subjects x cytokines x sources
+        mOrig (numpy.array): subjects x RNA modules
+        max_rank (int, default: 12): largest rank tried
+        n_folds (int, default: 5): number of folds
+        emin (int, default: 6): values never held out per subject and chord
+        patience (int, default: 2): ranks without improvement before
+            stopping
+        plateau (float, default: 1e-3): Q2X improvement that counts
+        confidence (float, default: 0.95): level of the confidence bands
+        tol (float, default: 1e-6): R2X improvement at convergence of fits
+        maxiter (int, default: 300): most iterations of fits
+        n_jobs (int, default: None): worker processes; defaults to one per
+            fold, at most the number of CPUs, and 1 fits in this process
+        seed (int, default: None): random seed for folds and fits
+
+    Returns:
+        rank (int): chosen rank
+        Q2X (pandas.DataFrame): ranks tried x Q2X of each fold, with their
+            'mean', 'sem' and the 'lower' and 'upper' confidence bands
+    """
+    from scipy.stats import t
+
+    rng = np.random.default_rng(seed)
+    tFolds, mFolds = cv_folds(tOrig, mOrig, n_folds, emin,
+                              seed=rng.integers(2 ** 31))
+    if n_jobs is None:
+        n_jobs = min(n_folds, os.cpu_count())
+
+    Q2X = []
+    inits = [None] * n_folds
+    best, since_best = -np.inf, 0
+    with ExitStack() as stack:
+        data = stack.enter_context(SharedData(
+            tensor=tOrig,
+            matrix=mOrig,
+            tensor_folds=tFolds,
+            matrix_folds=mFolds
+        ))
+        if n_jobs == 1:
+            shared.attach(data.handles)
+            run = map
+        else:
+            run = stack.enter_context(data.executor(max_workers=n_jobs)).map
+
+        for r in range(1, max_rank + 1):
+            seeds = rng.integers(2 ** 31, size=n_folds)
+            results = list(run(
+                _fit_fold,
+                range(n_folds),
+                [r] * n_folds,
+                inits,
+                seeds,
+                [tol] * n_folds,
+                [maxiter] * n_folds
+            ))
+            Q2X.append([result[0] for result in results])
+            inits = [_warm_start(result[1], rng) for result in results]
+
+            mean = np.mean(Q2X[-1])
+            if mean > best + plateau:
+                best, since_best = mean, 0
+            else:
+                since_best += 1
+                if since_best >= patience:
+                    break
+
+    table = pd.DataFrame(
+        Q2X,
+        index=pd.RangeIndex(1, len(Q2X) + 1, name='rank'),
+        columns=[f'fold {ii}' for ii in range(n_folds)]
+    )
+    folds = table.to_numpy()
+    table['mean'] = np.mean(folds, axis=1)
+    table['sem'] = np.std(folds, axis=1, ddof=1) / np.sqrt(n_folds)
+    width = t.ppf(0.5 + confidence / 2, n_folds - 1) * table['sem']
+    table['lower'] = table['mean'] - width
+    table['upper'] = table['mean'] + width
+
+    return _one_se(table), table
@@ -0,0 +1,159 @@
+"""
+Search of the RNA/cytokine variance scaling. form_tensor only multiplies
+the tensor by the scaling, so the data are formed once. A coarse grid over
+log2 scaling is fit in parallel; golden-section search then refines
+around its best point, each fit warm started from the fit at the nearest
+scaling already tried, as the factors change smoothly along the path.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import shared
+from .cmtf import OPTIMAL_RANK, calcR2X, perform_CMTF
+from .instrument import profiled
+from .shared import SharedData
+
+CRITERIA = ("balance", "accuracy")
+_GOLDEN = (np.sqrt(5.0) - 1.0) / 2.0
+
+
+def _score(tensor, matrix, labels, log_scaling, r, criterion, init, seed,
+           tol, maxiter):
+    """
+    Fits CMTF at a scaling, and scores it by criterion.
+
+    Returns:
+        scores (dict): criterion score, R2X of the fit, the tensor and the
+            matrix, and the accuracy for 'accuracy'
+        subjects (numpy.array): subject factors, to warm start from
+    """
+    tensor = tensor * 2.0 ** log_scaling
+    np.random.seed(seed)
+    tFac, _ = perform_CMTF(
+        tensor,
+        matrix,
+        r=r,
+        tol=tol,
+        maxiter=maxiter,
+        progress=False,
+        init=init
+    )
+    # The matrix R2X follows from those of the fit and the tensor
+    tensor_R2X = calcR2X(tFac, tIn=tensor)
+    tensor_ss, matrix_ss = np.nansum(tensor ** 2.0), np.nansum(matrix ** 2.0)
+    matrix_error = (1.0 - tFac.R2X) * (tensor_ss + matrix_ss) - \
+        (1.0 - tensor_R2X) * tensor_ss
+    scores = {
+        "R2X": tFac.R2X,
+        "Tensor": tensor_R2X,
+        "Matrix": 1.0 - matrix_error / matrix_ss
+    }
+    if criterion == "balance":
+        scores["score"] = min(scores["Tensor"], scores["Matrix"])
+    else:
+        from .predict import run_model
+
+        scores["accuracy"] = run_model(tFac.factors[0], labels, n_jobs=1)[0]
+        scores["score"] = scores["accuracy"]
+    return scores, tFac.factors[0] * tFac.weights
+
+
+def _score_shared(log_scaling, *args):
+    """ Runs _score on the shared data of scaling_search. """
+    return _score(
+        shared.get("tensor"),
+        shared.get("matrix"),
+        shared.get("labels"),
+        log_scaling,
+        *args
+    )
+
+
+@profiled
+def scaling_search(tensor=None, matrix=None, labels=None, criterion="balance",
+                   r=OPTIMAL_RANK, bounds=(-10.0, 10.0), coarse=6, xtol=0.25,
+                   tol=1e-6, maxiter=300, n_jobs=None, seed=None):
+    """
+    Finds the RNA/cytokine variance scaling that maximizes a criterion:
+    'balance', the lesser of the tensor and matrix R2X, which is largest
+    where they cross, or 'accuracy', the cross-validated accuracy of
+    run_model on the subject factors. The coarse grid is fit in parallel,
+    and golden-section search, on the log2 scale, narrows the bracket
+    around its best point to xtol.
+
+    Parameters:
+        tensor (numpy.array, default: None): subjects x cytokines x sources
+            at a scaling of 1; defaults to form_tensor(1.0)
+        matrix (numpy.array, default: None): subjects x RNA modules
+        labels (pandas.Series, default: None): outcome of each subject, for
+            'accuracy'; defaults to the status of form_tensor
+        criterion (str, default: 'balance'): one of CRITERIA
+        r (int, default: OPTIMAL_RANK): number of components
+        bounds (tuple, default: (-10, 10)): log2 scaling range
+        coarse (int, default: 6): points of the coarse grid
+        xtol (float, default: 0.25): width of the final bracket in log2
+        tol (float, default: 1e-6): R2X improvement at convergence of fits
+        maxiter (int, default: 300): most iterations of fits
+        n_jobs (int, default: None): worker processes for the coarse grid;
+            defaults to one per point, at most the number of CPUs
+        seed (int, default: None): seed of the PCA initialization of the
+            coarse fits
+
+    Returns:
+        scaling (float): best variance scaling found
+        path (pandas.DataFrame): scores of each log2 scaling fit, sorted
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"criterion must be one of {CRITERIA}")
+    if tensor is None:
+        from .dataImport import form_tensor
+
+        tensor, matrix, patient_data = form_tensor(1.0)
+        if labels is None:
+            labels = patient_data.loc[:, "status"]
+    if criterion == "accuracy" and labels is None:
+        raise ValueError("labels are needed for the 'accuracy' criterion")
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    if n_jobs is None:
+        n_jobs = min(coarse, os.cpu_count())
+    args = (r, criterion, None, seed, tol, maxiter)
+
+    # Coarse grid, fit in parallel from PCA
+    grid = np.linspace(bounds[0], bounds[1], coarse)
+    with SharedData(tensor=tensor, matrix=matrix, labels=labels) as data:
+        results = data.map(
+            _score_shared,
+            grid,
+            *[[arg] * coarse for arg in args],
+            max_workers=n_jobs
+        )
+    fits = dict(zip(grid, results))
+
+    def evaluate(x):
+        """ Scores x, warm started from the nearest scaling fit. """
+        if x not in fits:
+            nearest = min(fits, key=lambda y: abs(y - x))
+            fits[x] = _score(tensor, matrix, labels, x, r, criterion,
+                             fits[nearest][1], seed, tol, maxiter)
+        return fits[x][0]["score"]
+
+    # Golden-section search within the neighbours of the best grid point
+    best = int(np.argmax([fits[x][0]["score"] for x in grid]))
+    a, b = grid[max(best - 1, 0)], grid[min(best + 1, coarse - 1)]
+    c, d = b - _GOLDEN * (b - a), a + _GOLDEN * (b - a)
+    while b - a > xtol:
+        if evaluate(c) > evaluate(d):
+            b, d = d, c
+            c = b - _GOLDEN * (b - a)
+        else:
+            a, c = c, d
+            d = a + _GOLDEN * (b - a)
+
+    path = pd.DataFrame(
+        [fits[x][0] for x in sorted(fits)],
+        index=pd.Index(sorted(fits), name="log2 scaling")
+    )
+    return 2.0 ** path["score"].idxmax(), path
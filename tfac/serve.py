@@ -0,0 +1,325 @@
+"""
+Long-lived local scoring service. A model artifact is loaded once, and
+requests that arrive close together are folded in as a single batch.
+
+Requests and responses are newline-delimited JSON over a Unix socket or a
+localhost TCP port. Each request is an object with an "op" of "project"
+(components only), "score" (components and outcome probability) or
+"metrics" (latency percentiles), and an optional "id" echoed in the
+response. "project" and "score" take a "sample" object mapping input
+columns (see artifact.input_columns) to raw measurements.
+"""
+import asyncio
+from collections import deque
+import json
+import os
+import socket
+import stat
+import time
+
+import numpy as np
+import pandas as pd
+
+from .artifact import input_columns, load_artifact, score_samples
+
+
+class ScoringServer:
+    """ Micro-batching scoring service around one model artifact. """
+
+    def __init__(self, artifact, max_batch=64, max_delay=0.002,
+                 n_latencies=10000):
+        """
+        Parameters:
+            artifact (dict): model artifact from artifact.load_artifact
+            max_batch (int, default: 64): most samples scored together
+            max_delay (float, default: 0.002): seconds to wait for more
+                requests after the first of a batch arrives
+            n_latencies (int, default: 10000): recent latencies kept for
+                metrics
+        """
+        self.artifact = artifact
+        self.columns = input_columns(artifact)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.latencies = deque(maxlen=n_latencies)
+        self.batch_sizes = deque(maxlen=n_latencies)
+        self.queue = None
+
+    def metrics(self):
+        """
+        Summarizes recent request latencies.
+
+        Returns:
+            metrics (dict): request count, p50 and p99 latency in
+                milliseconds, and mean batch size
+        """
+        if len(self.latencies) == 0:
+            return {'requests': 0}
+
+        latencies = np.array(self.latencies) * 1000.0
+        return {
+            'requests': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_batch': float(np.mean(self.batch_sizes))
+        }
+
+    def _sample(self, sample):
+        """
+        Checks the sample of a request before it joins a batch, so that a
+        malformed sample only fails its own request.
+
+        Parameters:
+            sample (dict): input column: raw measurement
+
+        Returns:
+            sample (dict): measurements of the input columns, as floats
+        """
+        if not isinstance(sample, dict):
+            raise ValueError('sample must be an object')
+
+        values = {}
+        for column in self.columns:
+            if column in sample:
+                try:
+                    values[column] = float(sample[column])
+                except (TypeError, ValueError):
+                    raise ValueError(
+                        f'{column} must be a number, not {sample[column]!r}'
+                    ) from None
+        return values
+
+    async def _batcher(self):
+        """ Collects queued samples into batches and scores them. """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self.queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            data = pd.DataFrame(
+                [sample for sample, _ in batch],
+                columns=self.columns,
+                dtype=float
+            )
+            try:
+                scores = await loop.run_in_executor(
+                    None,
+                    score_samples,
+                    data,
+                    self.artifact
+                )
+            except Exception as err:
+                for _, future in batch:
+                    future.set_exception(err)
+                continue
+
+            self.batch_sizes.append(len(batch))
+            for (_, future), row in zip(batch, scores.to_numpy()):
+                future.set_result(row)
+
+    async def _respond(self, request):
+        """ Answers a single decoded request. """
+        op = request.get('op')
+        response = {'id': request.get('id')}
+        if op == 'metrics':
+            response['metrics'] = self.metrics()
+            return response
+        if op not in ('project', 'score'):
+            response['error'] = f'Unknown op {op}'
+            return response
+
+        start = time.perf_counter()
+        sample = self._sample(request.get('sample', {}))
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sample, future))
+        row = await future
+
+        components = row[:-2]
+        response['components'] = None if np.isnan(components).any() \
+            else components.tolist()
+        if op == 'score':
+            response['prediction'] = None if np.isnan(row[-2]) \
+                else float(row[-2])
+            response['probability'] = None if np.isnan(row[-1]) \
+                else float(row[-1])
+
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    async def _handle(self, reader, writer):
+        """ Serves one client connection; requests are answered in order. """
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self._respond(json.loads(line))
+                except Exception as err:
+                    response = {'error': str(err)}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, host='127.0.0.1', port=8765):
+        """
+        Serves requests until cancelled.
+
+        Parameters:
+            path (str, default: None): Unix socket path; if None, listens on
+                host and port instead
+            host (str, default: '127.0.0.1'): TCP host
+            port (int, default: 8765): TCP port
+        """
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batcher())
+        if path is not None:
+            _remove_stale(path)
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def _remove_stale(path):
+    """
+    Removes a socket file left by a server that exited without cleaning
+    up, so that binding to path does not fail; a socket a live server still
+    accepts connections on is left alone.
+    """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.remove(path)
+            return
+    raise OSError(f'A server is already listening on {path}')
+
+
+def serve(artifact_path, path=None, host='127.0.0.1', port=8765,
+          max_batch=64, max_delay=0.002):
+    """
+    Loads a model artifact and serves scoring requests until interrupted.
+
+    Parameters:
+        artifact_path (str): artifact file from artifact.save_artifact
+        path (str, default: None): Unix socket path; if None, listens on
+            host and port instead
+        host (str, default: '127.0.0.1'): TCP host
+        port (int, default: 8765): TCP port
+        max_batch (int, default: 64): most samples scored together
+        max_delay (float, default: 0.002): seconds to wait for more requests
+            after the first of a batch arrives
+    """
+    server = ScoringServer(
+        load_artifact(artifact_path),
+        max_batch=max_batch,
+        max_delay=max_delay
+    )
+    asyncio.run(server.serve(path=path, host=host, port=port))
+
+
+async def _open(path, host, port):
+    """ Opens a client connection to the scoring service. """
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+
+async def _load_client(samples, n_requests, path, host, port, op):
+    """ Sends requests on one connection, returning their latencies. """
+    reader, writer = await _open(path, host, port)
+    latencies = []
+    for ii in range(n_requests):
+        request = {'id': ii, 'op': op, 'sample': samples[ii % len(samples)]}
+        start = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+
+    writer.close()
+    return latencies
+
+
+async def _load_test(samples, n_requests, concurrency, path, host, port, op):
+    """ Runs concurrent load clients and gathers server metrics. """
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[
+        _load_client(
+            samples,
+            n_requests // concurrency + (ii < n_requests % concurrency),
+            path,
+            host,
+            port,
+            op
+        )
+        for ii in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await _open(path, host, port)
+    writer.write(json.dumps({'op': 'metrics'}).encode() + b'\n')
+    await writer.drain()
+    server_metrics = json.loads(await reader.readline())['metrics']
+    writer.close()
+
+    latencies = np.concatenate(latencies) * 1000.0
+    return {
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'server': server_metrics
+    }
+
+
+def load_test(samples, n_requests=1000, concurrency=16, path=None,
+              host='127.0.0.1', port=8765, op='score'):
+    """
+    Measures client-side latency and throughput against a running service.
+
+    Parameters:
+        samples (pandas.DataFrame): raw measurements to send, cycled through
+            in order
+        n_requests (int, default: 1000): total requests
+        concurrency (int, default: 16): concurrent connections
+        path (str, default: None): Unix socket path; if None, connects to
+            host and port instead
+        host (str, default: '127.0.0.1'): TCP host
+        port (int, default: 8765): TCP port
+        op (str, default: 'score'): request type to send
+
+    Returns:
+        results (dict): request count, duration, throughput, client p50/p99
+            latency in milliseconds and the server's own metrics
+    """
+    samples = [
+        {key: value for key, value in row.items() if np.isfinite(value)}
+        for row in samples.to_dict(orient='records')
+    ]
+    return asyncio.run(
+        _load_test(samples, n_requests, concurrency, path, host, port, op)
+    )
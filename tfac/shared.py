@@ -0,0 +1,235 @@
+"""
+Shared-memory transport of data to process pools. Arrays, and DataFrames or
+Series, are placed in multiprocessing.shared_memory blocks once; workers
+attach to them by name in a pool initializer and read them as read-only,
+zero-copy numpy views, so tasks need only carry indices and seeds.
+
+    with share_form_tensor() as data:
+        with data.executor(max_workers=4) as executor:
+            results = list(executor.map(task, seeds))
+
+where task reads the data with shared.get('tensor').
+"""
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Blocks created by this process, by name, until closed, with the process
+# ID of their creator, as forked workers inherit this registry
+_OWNED = {}
+# Blocks this process has open, by name, with the views of the current data
+_ATTACHED = {}
+_VIEWS = {}
+
+
+def _open(name):
+    """
+    Attaches to a block once per process. Pool workers share the resource
+    tracker of the process that created the block, so attaching does not
+    cause the block to be removed when a worker exits.
+    """
+    if name not in _ATTACHED:
+        _ATTACHED[name] = SharedMemory(name=name)
+    return _ATTACHED[name]
+
+
+def _block(data):
+    """ Copies a numpy array or bytes into a new shared memory block. """
+    buffer = np.frombuffer(data, dtype=np.uint8) \
+        if isinstance(data, bytes) else data
+    shm = SharedMemory(create=True, size=max(buffer.nbytes, 1))
+    view = np.ndarray(buffer.shape, dtype=buffer.dtype, buffer=shm.buf)
+    view[...] = buffer
+    _OWNED[shm.name] = (os.getpid(), shm)
+    _ATTACHED[shm.name] = shm
+    return shm.name
+
+
+def _put(value):
+    """
+    Places value in shared memory, returning a picklable handle. Numeric
+    DataFrames and Series share their values and pickle their index; other
+    objects are pickled into a block.
+    """
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        value = np.ascontiguousarray(value)
+        return ("array", _block(value), value.shape, value.dtype.str)
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        dtypes = list(value.dtypes) if isinstance(value, pd.DataFrame) \
+            else [value.dtype]
+        if len(set(dtypes)) == 1 and \
+                all(np.issubdtype(dtype, np.number) for dtype in dtypes):
+            values = _put(value.to_numpy())
+            if isinstance(value, pd.DataFrame):
+                return ("frame", values, value.index, value.columns)
+            return ("series", values, value.index, value.name)
+
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    return ("pickle", _block(data), len(data))
+
+
+def _get(handle):
+    """ Returns a read-only view of the value a handle refers to. """
+    kind = handle[0]
+    if kind == "array":
+        _, name, shape, dtype = handle
+        view = np.ndarray(shape, dtype=dtype, buffer=_open(name).buf)
+        view.flags.writeable = False
+        return view
+    if kind == "frame":
+        return pd.DataFrame(_get(handle[1]), index=handle[2],
+                            columns=handle[3], copy=False)
+    if kind == "series":
+        return pd.Series(_get(handle[1]), index=handle[2], name=handle[3],
+                         copy=False)
+
+    _, name, size = handle
+    return pickle.loads(_open(name).buf[:size])
+
+
+def attach(handles):
+    """
+    Makes the shared data of handles available to get in this process. Used
+    as the initializer of pool workers.
+
+    Parameters:
+        handles (dict): handles, from SharedData.handles
+    """
+    _VIEWS.clear()
+    for key, handle in handles.items():
+        _VIEWS[key] = _get(handle)
+
+
+def get(key):
+    """
+    Returns shared data in a worker.
+
+    Parameters:
+        key (str): name the data was shared under
+
+    Returns:
+        value (numpy.array, pandas.DataFrame or object): read-only view of
+            arrays and numeric DataFrames; a copy of other objects
+    """
+    return _VIEWS[key]
+
+
+class SharedData:
+    """
+    Data placed in shared memory, with handles that workers attach to. The
+    blocks are removed on close, on leaving a with block, or at exit.
+    """
+
+    def __init__(self, **values):
+        """
+        Parameters:
+            values: arrays, DataFrames, Series or other picklable objects,
+                by the key workers get them with
+        """
+        self.handles = {key: _put(value) for key, value in values.items()}
+
+    @property
+    def names(self):
+        """ Names of the shared memory blocks. """
+        names = []
+        for handle in self.handles.values():
+            while handle[0] in ("frame", "series"):
+                handle = handle[1]
+            names.append(handle[1])
+        return names
+
+    def executor(self, max_workers=None, **kwargs):
+        """
+        Returns a ProcessPoolExecutor whose workers attach to the data.
+
+        Parameters:
+            max_workers (int, default: None): worker processes
+            kwargs: further arguments of ProcessPoolExecutor
+
+        Returns:
+            executor (ProcessPoolExecutor): process pool
+        """
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=attach,
+            initargs=(self.handles, ),
+            **kwargs
+        )
+
+    def map(self, func, *iterables, max_workers=None):
+        """
+        Calls func over iterables, as Executor.map does, in a pool attached
+        to the data, or in this process if max_workers is 1.
+
+        Returns:
+            results (list): result of each call
+        """
+        if max_workers == 1:
+            attach(self.handles)
+            return list(map(func, *iterables))
+
+        with self.executor(max_workers=max_workers) as executor:
+            return list(executor.map(func, *iterables))
+
+    def close(self):
+        """ Removes the shared memory blocks. """
+        for key in self.handles:
+            _VIEWS.pop(key, None)
+        for name in self.names:
+            _ATTACHED.pop(name, None)
+            _release(*_OWNED.pop(name, (None, None)))
+        self.handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def share_form_tensor(variance_scaling=None):
+    """
+    Shares the output of form_tensor as 'tensor', 'matrix' and
+    'patient_data'.
+
+    Parameters:
+        variance_scaling (float, default: None): RNA/cytokine variance
+            scaling; defaults to that of form_tensor
+
+    Returns:
+        data (SharedData): shared data
+    """
+    from .dataImport import form_tensor
+
+    if variance_scaling is None:
+        tensor, matrix, patient_data = form_tensor()
+    else:
+        tensor, matrix, patient_data = form_tensor(variance_scaling)
+    return SharedData(tensor=tensor, matrix=matrix, patient_data=patient_data)
+
+
+def _release(pid, shm):
+    """ Closes and removes a block, if this process created it. """
+    if pid != os.getpid():
+        return
+    try:
+        shm.close()
+    except BufferError:
+        # Views are still in use; the memory is freed with them
+        pass
+    shm.unlink()
+
+
+@atexit.register
+def _cleanup():
+    """ Removes blocks left open by this process. """
+    _VIEWS.clear()
+    for pid, shm in _OWNED.values():
+        _release(pid, shm)
+    _OWNED.clear()
@@ -0,0 +1,223 @@
+"""
+Sketched ALS for cohorts with many subjects or RNA features. Each least
+squares solve of chunked.fit is replaced by one over rows sampled by their
+leverage scores, reweighted so that it is unbiased. Whenever a sketched
+iteration fails to improve R2X by sketch_tol, the sketch doubles, and once
+it reaches its largest size, exact sweeps finish the fit, so that the final
+R2X matches the exact solver to within tol.
+"""
+import numpy as np
+from tensorly.tenalg.core_tenalg import khatri_rao
+
+from .chunked import _Problem, fit, masked_gram
+from .cmtf import OPTIMAL_RANK
+from .instrument import profiled
+
+
+def leverage(A, uniform=0.1):
+    """
+    Sampling probabilities of the rows of A from their leverage scores,
+    mixed with a uniform distribution so that no row is too unlikely.
+
+    Parameters:
+        A (numpy.array): rows x columns
+        uniform (float, default: 0.1): weight of the uniform distribution
+
+    Returns:
+        p (numpy.array): probability of each row
+    """
+    q, _ = np.linalg.qr(A)
+    scores = np.sum(q ** 2.0, axis=1)
+    return (1.0 - uniform) * scores / np.sum(scores) + uniform / A.shape[0]
+
+
+def _masked_solve(data, design, previous):
+    """
+    Least squares of the measured values in each row of data against the
+    rows of design. Rows whose sampled values do not determine a solution
+    keep their previous value.
+    """
+    mask = np.isfinite(data)
+    gram = masked_gram(mask, design)
+    rhs = np.where(mask, data, 0.0) @ design
+
+    x = previous.copy()
+    solvable = np.linalg.matrix_rank(gram) == design.shape[1]
+    if np.any(solvable):
+        x[solvable] = np.linalg.solve(
+            gram[solvable],
+            rhs[solvable, :, np.newaxis]
+        )[:, :, 0]
+    return x
+
+
+class Sketch:
+    """
+    Sketched solves in place of those of a _Problem, for in-memory arrays.
+    Systems with no more rows than the sketch are solved exactly.
+    """
+
+    def __init__(self, problem, size, max_size=None, tol=1e-4, seed=None):
+        """
+        Parameters:
+            problem (_Problem): exact solves, over numpy arrays
+            size (int): rows sampled per solve at first
+            max_size (int, default: None): largest sketch before finishing
+                with exact sweeps; defaults to 16 times size
+            tol (float, default: 1e-4): R2X improvement below which the
+                sketch grows
+            seed (int, default: None): random seed
+        """
+        self.problem = problem
+        self.size = size
+        self.max_size = 16 * size if max_size is None else max_size
+        self.tol = tol
+        self.rng = np.random.default_rng(seed)
+        self.done = False
+
+    def grow(self):
+        """ Doubles the sketch; after the largest sketch, sets done. """
+        self.size *= 2
+        self.done = self.size > self.max_size
+
+    def _sample(self, p):
+        """ Rows drawn by probability p, and their importance weights. """
+        rows = self.rng.choice(p.size, self.size, p=p)
+        return rows, 1.0 / np.sqrt(self.size * p[rows])
+
+    def solve_mode(self, factors, mode):
+        """ Solves for the factors of a non-subject mode. """
+        shape = self.problem.shape
+        if self.size >= np.prod(shape) // shape[mode]:
+            return self.problem.solve_mode(factors, mode)
+
+        # Sample each other mode by leverage, as Khatri-Rao rows
+        others = [m for m in range(len(shape)) if m != mode]
+        index = []
+        design = np.ones((self.size, factors[0].shape[1]))
+        weight = np.ones(self.size)
+        for m in others:
+            rows, w = self._sample(leverage(factors[m]))
+            index.append(rows)
+            design *= factors[m][rows]
+            weight *= w
+
+        tensor = np.moveaxis(np.asarray(self.problem.tOrig), mode, -1)
+        data = tensor[tuple(index)] * weight[:, np.newaxis]
+        return _masked_solve(
+            data.T,
+            design * weight[:, np.newaxis],
+            factors[mode]
+        )
+
+    def solve_mFactor(self, subjects):
+        """ Solves for the RNA factors from subjects with complete RNA. """
+        complete = np.flatnonzero(self.problem.complete)
+        if self.size >= complete.size:
+            return self.problem.solve_mFactor(subjects)
+
+        rows, w = self._sample(leverage(subjects[complete]))
+        design = subjects[complete[rows]] * w[:, np.newaxis]
+        data = self.problem.mOrig[complete[rows]] * w[:, np.newaxis]
+        return np.linalg.lstsq(design, data, rcond=None)[0].T
+
+    def solve_subjects(self, factors, mFactor):
+        """ Solves for the subject factors over sampled columns. """
+        kr = khatri_rao(factors, skip_matrix=0)
+        design = np.vstack((kr, mFactor))
+        if self.size >= design.shape[0]:
+            return self.problem.solve_subjects(factors, mFactor)
+
+        cols, w = self._sample(leverage(design))
+        tensor = np.asarray(self.problem.tOrig)
+        tensor = tensor.reshape(tensor.shape[0], -1)
+        t_cols = cols[cols < kr.shape[0]]
+        m_cols = cols[cols >= kr.shape[0]] - kr.shape[0]
+        data = np.hstack((
+            tensor[:, t_cols],
+            np.asarray(self.problem.mOrig)[:, m_cols]
+        ))
+
+        # Columns were regrouped by source, so reorder the weights to match
+        order = np.concatenate((
+            np.flatnonzero(cols < kr.shape[0]),
+            np.flatnonzero(cols >= kr.shape[0])
+        ))
+        return _masked_solve(
+            data * w[order],
+            design[cols[order]] * w[order, np.newaxis],
+            factors[0]
+        )
+
+
+@profiled
+def perform_CMTF_sketched(tOrig, mOrig, r=OPTIMAL_RANK, tol=1e-6, maxiter=300,
+                          linesearch=True, callback=None, sketch_size=None,
+                          max_sketch_size=None, sketch_tol=1e-4,
+                          chunk_size=10000, column_chunk_size=4096, seed=None,
+                          max_seconds=None, factor_tol=None, stall=None,
+                          init=None):
+    """
+    Performs CMTF as perform_CMTF does, solving each least squares system
+    over a leverage score sample of its rows until the sketch reaches
+    max_sketch_size, then finishing with exact sweeps of
+    chunked.perform_CMTF_chunked, with line search. Sketched iterations
+    that lower R2X are undone. The sketch size of each iteration is
+    recorded in the trace, 0 for exact sweeps.
+
+    Parameters:
+        tOrig (numpy.array): subjects x cytokines x sources
+        mOrig (numpy.array): subjects x RNA modules
+        r (int, default: OPTIMAL_RANK): number of components
+        tol (float, default: 1e-6): R2X improvement at convergence
+        maxiter (int, default: 300): most iterations, sketched and exact
+        linesearch (bool, default: True): use line search acceleration in
+            the exact sweeps
+        callback (callable, default: None): as in perform_CMTF
+        sketch_size (int, default: None): rows sampled per solve at first;
+            defaults to 50 times r
+        max_sketch_size (int, default: None): largest sketch; defaults to
+            16 times sketch_size
+        sketch_tol (float, default: 1e-4): R2X improvement below which the
+            sketch grows
+        chunk_size (int, default: 10000): subjects per block in exact solves
+        column_chunk_size (int, default: 4096): RNA columns per block in
+            exact solves
+        seed (int, default: None): seed for initialization and sampling; by
+            default, drawn from numpy's global random state
+        max_seconds (float, default: None): as in perform_CMTF
+        factor_tol (float, default: None): as in perform_CMTF
+        stall (int, default: None): as in perform_CMTF
+        init (numpy.array, default: None): as in perform_CMTF
+
+    Returns:
+        tFac (CPTensor): factorization, with R2X and trace attributes
+    """
+    assert tOrig.shape[0] == mOrig.shape[0]
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    if sketch_size is None:
+        sketch_size = 50 * r
+
+    problem = _Problem(tOrig, mOrig, chunk_size, column_chunk_size)
+    sketch = Sketch(
+        problem,
+        sketch_size,
+        max_sketch_size,
+        tol=sketch_tol,
+        seed=seed
+    )
+    return fit(
+        problem,
+        r,
+        tol=tol,
+        maxiter=maxiter,
+        linesearch=linesearch,
+        callback=callback,
+        seed=seed,
+        sketch=sketch,
+        max_seconds=max_seconds,
+        factor_tol=factor_tol,
+        stall=stall,
+        init=init
+    )
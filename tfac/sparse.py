@@ -0,0 +1,279 @@
+"""
+Sparse storage of the observed entries of highly incomplete tensors, and
+CMTF over them. Work scales with the number of observed entries rather
+than with the dense volume of the tensor.
+"""
+import numpy as np
+import scipy.sparse as sps
+
+from .chunked import _Problem, fit
+from .cmtf import OPTIMAL_RANK
+from .instrument import profiled
+
+
+class ObservedTensor:
+    """
+    Observed entries of a tensor in coordinate (COO) format, sorted by
+    subject (mode 0). Entries are grouped into blocks of subjects, and for
+    each block and mode the matrix scattering entries onto the indices of
+    that mode is built once, so that per-mode sums over entries are sparse
+    matrix products.
+    """
+
+    def __init__(self, indices, values, shape, chunk_size=10000):
+        """
+        Parameters:
+            indices (numpy.array): observed entries x modes; coordinates
+            values (numpy.array): value of each observed entry
+            shape (tuple): shape of the dense tensor
+            chunk_size (int, default: 10000): subjects per block
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        order = np.lexsort(indices.T[::-1])
+        self.indices = indices[order]
+        self.values = np.asarray(values, dtype=float)[order]
+        self.shape = tuple(shape)
+        self.indptr = np.searchsorted(
+            self.indices[:, 0],
+            np.arange(self.shape[0] + 1)
+        )
+        self.chunk_size = chunk_size
+        self._scatter = {}
+
+    @classmethod
+    def from_dense(cls, tensor, chunk_size=10000):
+        """
+        Stores the finite entries of a dense tensor with NaN for missing.
+
+        Parameters:
+            tensor (numpy.array): dense tensor
+            chunk_size (int, default: 10000): subjects per block
+
+        Returns:
+            observed (ObservedTensor): observed entries
+        """
+        indices = np.argwhere(np.isfinite(tensor))
+        return cls(indices, tensor[tuple(indices.T)], tensor.shape, chunk_size)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nnz(self):
+        return self.values.size
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def to_dense(self):
+        """ Returns the dense tensor, with NaN for unobserved entries. """
+        tensor = np.full(self.shape, np.nan)
+        tensor[tuple(self.indices.T)] = self.values
+        return tensor
+
+    def entries(self, rows):
+        """
+        Returns the entries of a block of subjects.
+
+        Parameters:
+            rows (slice): subjects
+
+        Returns:
+            indices (numpy.array): coordinates of the entries
+            values (numpy.array): values of the entries
+        """
+        span = slice(self.indptr[rows.start], self.indptr[rows.stop])
+        return self.indices[span], self.values[span]
+
+    def scatter(self, rows, mode):
+        """
+        Returns the matrix summing the entries of a block of subjects onto
+        the indices of mode. For mode 0, indices are relative to rows.start.
+
+        Parameters:
+            rows (slice): subjects
+            mode (int): mode to sum onto
+
+        Returns:
+            scatter (scipy.sparse.csr_matrix): mode indices x entries
+        """
+        key = (rows.start, rows.stop, mode)
+        if key not in self._scatter:
+            indices, _ = self.entries(rows)
+            target = indices[:, mode]
+            size = self.shape[mode]
+            if mode == 0:
+                target = target - rows.start
+                size = rows.stop - rows.start
+            self._scatter[key] = sps.csr_matrix(
+                (np.ones(target.size), (target, np.arange(target.size))),
+                shape=(size, target.size)
+            )
+
+        return self._scatter[key]
+
+    def unfolded(self, rows):
+        """
+        Returns the subject unfolding of a block of subjects as a sparse
+        matrix, matching tl.unfold(tensor, 0) with missing values as zero.
+
+        Parameters:
+            rows (slice): subjects
+
+        Returns:
+            unfolded (scipy.sparse.csr_matrix): subjects x other modes
+        """
+        indices, values = self.entries(rows)
+        columns = np.ravel_multi_index(tuple(indices[:, 1:].T), self.shape[1:])
+        return sps.csr_matrix(
+            (values, (indices[:, 0] - rows.start, columns)),
+            shape=(rows.stop - rows.start, int(np.prod(self.shape[1:])))
+        )
+
+    def reconstruct(self, factors, weights=None, rows=None):
+        """
+        Evaluates a CP model at the observed entries.
+
+        Parameters:
+            factors (list[numpy.array]): factor matrices
+            weights (numpy.array, default: None): component weights
+            rows (slice, default: None): only evaluate this block of subjects
+
+        Returns:
+            values (numpy.array): model value at each observed entry
+        """
+        indices = self.indices if rows is None else self.entries(rows)[0]
+        product = factors[0][indices[:, 0]]
+        if weights is not None:
+            product = product * weights
+        for mode in range(1, self.ndim):
+            product = product * factors[mode][indices[:, mode]]
+
+        return np.sum(product, axis=1)
+
+
+def _products(indices, factors, skip):
+    """ Elementwise product of the factor rows of each entry, except skip. """
+    product = None
+    for mode, factor in enumerate(factors):
+        if mode == skip:
+            continue
+        rows = factor[indices[:, mode]]
+        product = rows if product is None else product * rows
+
+    return product
+
+
+def _outer(z):
+    """ Flattened outer product of each row of z with itself. """
+    return (z[:, :, np.newaxis] * z[:, np.newaxis, :]).reshape(z.shape[0], -1)
+
+
+class SparseProblem(_Problem):
+    """ Blockwise access to an ObservedTensor and a dense RNA matrix. """
+
+    def __init__(self, tOrig, mOrig, column_chunk_size):
+        super().__init__(tOrig, mOrig, tOrig.chunk_size, column_chunk_size)
+
+    def _tensor_sumsq(self, rows):
+        _, values = self.tOrig.entries(rows)
+        return np.sum(values ** 2.0)
+
+    def _tensor_mode(self, rows, factors, mode):
+        indices, values = self.tOrig.entries(rows)
+        z = _products(indices, factors, mode)
+        scatter = self.tOrig.scatter(rows, mode)
+        rank = z.shape[1]
+        gram = (scatter @ _outer(z)).reshape(-1, rank, rank)
+        return gram, scatter @ (z * values[:, np.newaxis])
+
+    def _tensor_subjects(self, rows, factors):
+        return self._tensor_mode(rows, factors, 0)
+
+    def _tensor_error(self, rows, factors):
+        _, values = self.tOrig.entries(rows)
+        recon = self.tOrig.reconstruct(factors, rows=rows)
+        return np.sum((recon - values) ** 2.0)
+
+    def _tensor_project(self, rows, omega):
+        return self.tOrig.unfolded(rows) @ omega
+
+    def _tensor_adjoint(self, rows, basis):
+        return self.tOrig.unfolded(rows).T @ basis
+
+
+@profiled
+def perform_CMTF_sparse(tOrig, mOrig, r=OPTIMAL_RANK, tol=1e-6, maxiter=300,
+                        linesearch=True, callback=None,
+                        column_chunk_size=4096, seed=None, max_seconds=None,
+                        factor_tol=None, stall=None, init=None):
+    """
+    Performs CMTF as perform_CMTF does, over the observed entries of the
+    tensor. The subject factors are initialized by a randomized range finder
+    rather than PCA.
+
+    Parameters:
+        tOrig (ObservedTensor): observed entries; subjects are mode 0
+        mOrig (numpy.array): subjects x RNA modules
+        r (int, default: OPTIMAL_RANK): number of components
+        tol (float, default: 1e-6): R2X improvement at convergence
+        maxiter (int, default: 300): most iterations
+        linesearch (bool, default: True): use line search acceleration
+        callback (callable, default: None): as in perform_CMTF
+        column_chunk_size (int, default: 4096): RNA columns read at once
+        seed (int, default: None): seed for the range finder
+        max_seconds (float, default: None): as in perform_CMTF
+        factor_tol (float, default: None): as in perform_CMTF
+        stall (int, default: None): as in perform_CMTF
+        init (numpy.array, default: None): as in perform_CMTF
+
+    Returns:
+        tFac (CPTensor): factorization, with R2X and trace attributes
+    """
+    assert tOrig.shape[0] == mOrig.shape[0]
+    problem = SparseProblem(tOrig, mOrig, column_chunk_size)
+    return fit(
+        problem,
+        r,
+        tol=tol,
+        maxiter=maxiter,
+        linesearch=linesearch,
+        callback=callback,
+        seed=seed,
+        max_seconds=max_seconds,
+        factor_tol=factor_tol,
+        stall=stall,
+        init=init
+    )
+
+
+def calcR2X_sparse(tFac, tIn=None, mIn=None):
+    """
+    R2X of a factorization over the observed entries of an ObservedTensor
+    and, optionally, a dense RNA matrix, as tensorpack's calcR2X computes
+    for dense inputs.
+
+    Parameters:
+        tFac (CPTensor): factorization
+        tIn (ObservedTensor, default: None): observed tensor entries
+        mIn (numpy.array, default: None): RNA matrix with NaN for missing
+
+    Returns:
+        R2X (float): fraction of variance explained
+    """
+    assert (tIn is not None) or (mIn is not None)
+    top, bottom = 0.0, 0.0
+    if tIn is not None:
+        recon = tIn.reconstruct(tFac.factors, weights=tFac.weights)
+        top += np.sum((recon - tIn.values) ** 2.0)
+        bottom += np.sum(tIn.values ** 2.0)
+    if mIn is not None:
+        mFactor = tFac.mFactor * getattr(tFac, "mWeights", 1.0)
+        mask = np.isfinite(mIn)
+        mIn = np.nan_to_num(mIn)
+        top += np.sum(((tFac.factors[0] @ mFactor.T) * mask - mIn) ** 2.0)
+        bottom += np.sum(mIn ** 2.0)
+
+    return 1.0 - top / bottom
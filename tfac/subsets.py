@@ -0,0 +1,179 @@
+"""
+Search over subsets of CMTF components for reduced prediction models.
+"""
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import balanced_accuracy_score, roc_auc_score
+from sklearn.svm import SVC
+
+from .predict import get_cv_splits
+
+CS = np.logspace(-4, 4, 9)
+
+
+def component_distances(data):
+    """
+    Calculates squared pairwise sample distances along each component. The
+    RBF kernel of any component subset is exp(-gamma * sum of the subset's
+    distances), so these are computed once and restricted per subset.
+
+    Parameters:
+        data (numpy.array): samples x components
+
+    Returns:
+        distances (numpy.array): components x samples x samples
+    """
+    data = data.T
+    return (data[:, :, np.newaxis] - data[:, np.newaxis, :]) ** 2
+
+
+def _score_folds(decisions, labels):
+    """
+    Pools out-of-fold decision values into accuracy and AUC.
+
+    Parameters:
+        decisions (numpy.array): out-of-fold decision values
+        labels (numpy.array): binary labels
+
+    Returns:
+        accuracy (float): balanced accuracy
+        auc (float): AUC-ROC of the decision values
+    """
+    predicted = (decisions > 0).astype(int)
+    return (
+        balanced_accuracy_score(labels, predicted),
+        roc_auc_score(labels, decisions)
+    )
+
+
+def evaluate_subset(subset, data, distances, labels, splits, svc=True,
+                    gamma=1E-3, cs=CS):
+    """
+    Evaluates one component subset over the cached folds, selecting C by
+    cross-validated balanced accuracy as run_svc does.
+
+    Parameters:
+        subset (tuple[int]): column positions of the components to use
+        data (numpy.array): samples x components
+        distances (numpy.array): output of component_distances; only used if
+            svc is True
+        labels (numpy.array): binary labels
+        splits (tuple): cross-validation folds
+        svc (bool, default: True): use an RBF SVC; otherwise elastic net
+            logistic regression
+        gamma (float, default:1E-3): gamma value for the SVC kernel
+        cs (numpy.array): regularization strengths to search
+
+    Returns:
+        result (tuple): subset, accuracy, AUC and selected C
+    """
+    subset = list(subset)
+    if svc:
+        kernel = np.exp(-gamma * distances[subset].sum(axis=0))
+    else:
+        data = data[:, subset]
+
+    best = (-np.inf, np.nan, np.nan)
+    for c in cs:
+        decisions = np.zeros(len(labels))
+        for train, test in splits:
+            if svc:
+                model = SVC(C=c, kernel='precomputed')
+                model.fit(kernel[np.ix_(train, train)], labels[train])
+                decisions[test] = model.decision_function(
+                    kernel[np.ix_(test, train)]
+                )
+            else:
+                model = LogisticRegression(
+                    C=c,
+                    l1_ratio=0.8,
+                    solver="saga",
+                    penalty="elasticnet",
+                    max_iter=100000
+                )
+                model.fit(data[train], labels[train])
+                decisions[test] = model.decision_function(data[test])
+
+        accuracy, auc = _score_folds(decisions, labels)
+        if accuracy > best[0]:
+            best = (accuracy, auc, c)
+
+    return tuple(subset), *best
+
+
+def search_subsets(components, labels, svc=True, gamma=1E-3, cs=CS,
+                   beam_width=None, max_size=None, n_jobs=3):
+    """
+    Ranks subsets of CMTF components by cross-validated prediction accuracy.
+
+    With beam_width set to None, every non-empty subset is evaluated (2^R - 1
+    for R components). Otherwise, subsets are grown one component at a time,
+    only extending the beam_width most accurate subsets of each size.
+
+    Parameters:
+        components (pandas.DataFrame): CMTF components; columns are components
+        labels (pandas.Series): labels for samples in components
+        svc (bool, default: True): use an RBF SVC; otherwise elastic net
+            logistic regression
+        gamma (float, default:1E-3): gamma value for the SVC kernel
+        cs (numpy.array): regularization strengths to search
+        beam_width (int, default: None): subsets kept per size; None searches
+            exhaustively
+        max_size (int, default: None): largest subset size to consider
+        n_jobs (int, default: 3): parallel workers
+
+    Returns:
+        results (pandas.DataFrame): subsets ranked by accuracy, then AUC
+    """
+    labels = labels.loc[labels != 'Unknown']
+    data = components.loc[labels.index, :].to_numpy(dtype=float)
+    labels = labels.astype(int).to_numpy()
+    splits = get_cv_splits(labels)
+    distances = component_distances(data) if svc else None
+
+    n_components = data.shape[1]
+    if max_size is None:
+        max_size = n_components
+
+    evaluated = {}
+    candidates = [(i,) for i in range(n_components)]
+    for size in range(1, max_size + 1):
+        if beam_width is None:
+            candidates = list(combinations(range(n_components), size))
+
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(evaluate_subset)(
+                subset, data, distances, labels, splits, svc, gamma, cs
+            ) for subset in candidates
+        )
+        for score in scores:
+            evaluated[score[0]] = score
+
+        if beam_width is not None:
+            scores.sort(key=lambda score: (score[1], score[2]), reverse=True)
+            beam = [score[0] for score in scores[:beam_width]]
+            candidates = sorted({
+                tuple(sorted(subset + (i,)))
+                for subset in beam
+                for i in range(n_components)
+                if i not in subset
+            } - evaluated.keys())
+
+    results = pd.DataFrame(
+        list(evaluated.values()),
+        columns=['Components', 'Accuracy', 'AUC', 'C']
+    )
+    results['Components'] = results['Components'].apply(
+        lambda subset: tuple(components.columns[list(subset)])
+    )
+    results.insert(1, 'Size', results['Components'].apply(len))
+    results = results.sort_values(
+        ['Accuracy', 'AUC'],
+        ascending=False
+    ).reset_index(drop=True)
+
+    return results
@@ -0,0 +1,161 @@
+"""
+Synthetic coupled tensor and matrix data with known low-rank structure,
+shaped like the output of form_tensor, for testing and scaling experiments.
+"""
+import numpy as np
+import pandas as pd
+import tensorly as tl
+
+from .dataImport import OPTIMAL_SCALING
+
+# Patients of each data type in patient_metadata.txt, less those with only
+# RNAseq, which import_patient_metadata drops
+TYPE_COUNTS = {
+    '0Serum2RNAseq': 57,
+    '1Plasma': 43,
+    '0Serum1Plasma': 41,
+    '0Serum1Plasma2RNAseq': 26,
+    '1Plasma2RNAseq': 5,
+    '0Serum': 5
+}
+
+
+def type_blocks(data_type):
+    """
+    Returns which data blocks a patient data type includes.
+
+    Parameters:
+        data_type (str): data type, e.g. '0Serum2RNAseq'
+
+    Returns:
+        blocks (tuple[bool]): whether serum, plasma and RNA are measured
+    """
+    return 'Serum' in data_type, 'Plasma' in data_type, 'RNAseq' in data_type
+
+
+def generate_cohort(n_subjects=177, n_cytokines=38, n_sources=2, n_modules=40,
+                    rank=8, noise=0.1, type_counts=None, entry_missing=0.0,
+                    variance_scaling=OPTIMAL_SCALING, dtype='float64',
+                    seed=None):
+    """
+    Generates a CMTF problem with known factors. Patients are assigned data
+    types in proportion to type_counts, and the serum, plasma and RNA blocks
+    of each patient are removed according to their type. Sources past the
+    second are measured alongside plasma. Data are scaled as in form_tensor.
+
+    Parameters:
+        n_subjects (int, default: 177): subjects
+        n_cytokines (int, default: 38): cytokines
+        n_sources (int, default: 2): cytokine sources
+        n_modules (int, default: 40): RNA modules
+        rank (int, default: 8): rank of the true factors
+        noise (float, default: 0.1): standard deviation of Gaussian noise,
+            relative to that of the noiseless data
+        type_counts (dict, default: None): relative frequency of each data
+            type; defaults to TYPE_COUNTS
+        entry_missing (float, default: 0.0): fraction of the remaining
+            entries also removed at random
+        variance_scaling (float, default: OPTIMAL_SCALING): RNA/cytokine
+            variance scaling
+        dtype (str, default: 'float64'): floating point type
+        seed (int, default: None): random seed
+
+    Returns:
+        tensor (numpy.array): subjects x cytokines x sources
+        matrix (numpy.array): subjects x RNA modules
+        patient_data (pandas.DataFrame): data type of each subject
+        truth (CPTensor): true factors, with the RNA factors as mFactor
+    """
+    rng = np.random.default_rng(seed)
+    if type_counts is None:
+        type_counts = TYPE_COUNTS
+
+    types = np.array(list(type_counts))
+    weights = np.array(list(type_counts.values()), dtype=float)
+    subject_types = rng.choice(types, n_subjects, p=weights / weights.sum())
+    blocks = np.array([type_blocks(t) for t in subject_types])
+    if not np.any(blocks[:, 2]):
+        subject_types[0] = '0Serum1Plasma2RNAseq'
+        blocks[0] = True
+
+    factors = [
+        rng.standard_normal((n_subjects, rank)),
+        rng.standard_normal((n_cytokines, rank)),
+        rng.standard_normal((n_sources, rank))
+    ]
+    truth = tl.cp_tensor.CPTensor((np.ones(rank), factors))
+    truth.mFactor = rng.standard_normal((n_modules, rank))
+
+    tensor = tl.cp_to_tensor(truth)
+    matrix = factors[0] @ truth.mFactor.T
+    tensor += rng.standard_normal(tensor.shape) * noise * np.std(tensor)
+    matrix += rng.standard_normal(matrix.shape) * noise * np.std(matrix)
+
+    tensor[~blocks[:, 0], :, 0] = np.nan
+    tensor[~blocks[:, 1], :, 1:] = np.nan
+    matrix[~blocks[:, 2], :] = np.nan
+    if entry_missing > 0.0:
+        tensor[rng.random(tensor.shape) < entry_missing] = np.nan
+        matrix[rng.random(matrix.shape) < entry_missing] = np.nan
+
+    tensor = tensor / np.nanvar(tensor) * variance_scaling
+    matrix /= np.nanvar(matrix)
+
+    patient_data = pd.DataFrame(
+        {'type': subject_types},
+        index=pd.RangeIndex(n_subjects, name='sid')
+    )
+    return tensor.astype(dtype), matrix.astype(dtype), patient_data, truth
+
+
+def factor_congruence(estimate, truth):
+    """
+    Absolute cosine similarity between every pair of estimated and true
+    components, for each mode.
+
+    Parameters:
+        estimate (numpy.array): rows x estimated components
+        truth (numpy.array): rows x true components
+
+    Returns:
+        congruence (numpy.array): estimated x true components
+    """
+    estimate = estimate / np.linalg.norm(estimate, axis=0)
+    truth = truth / np.linalg.norm(truth, axis=0)
+    return np.abs(estimate.T @ truth)
+
+
+def recovery_scores(tFac, truth):
+    """
+    Scores how well a factorization recovers the true factors. Components
+    are matched to the true components to maximize the factor match score
+    (FMS), the product over modes of their congruence, ignoring sign.
+
+    Parameters:
+        tFac (CPTensor): factorization from perform_CMTF
+        truth (CPTensor): true factors from generate_cohort
+
+    Returns:
+        scores (dict): mean FMS over true components ('FMS'), the mean
+            congruence of matched components in each mode, and the matched
+            estimated component of each true component ('matching'; -1 if
+            unmatched)
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    names = ['subjects', 'cytokines', 'sources', 'RNA']
+    estimates = list(tFac.factors) + [tFac.mFactor]
+    trues = list(truth.factors) + [truth.mFactor]
+    congruence = [factor_congruence(e, t) for e, t in zip(estimates, trues)]
+
+    fms = np.prod(congruence, axis=0)
+    rows, cols = linear_sum_assignment(fms, maximize=True)
+
+    matching = np.full(truth.rank, -1)
+    matching[cols] = rows
+    scores = {'FMS': float(np.sum(fms[rows, cols]) / truth.rank)}
+    for name, cong in zip(names, congruence):
+        scores[name] = float(np.mean(cong[rows, cols]))
+    scores['matching'] = matching.tolist()
+
+    return scores
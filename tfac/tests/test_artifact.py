@@ -0,0 +1,67 @@
+"""
+Test that model artifacts can be saved, loaded and used for scoring.
+"""
+import numpy as np
+import pandas as pd
+import tensorly as tl
+from sklearn.linear_model import LogisticRegression
+
+from ..artifact import input_columns, load_artifact, save_artifact, \
+    score_samples
+
+
+def make_artifact(rank=3, n_cyto=4, n_rna=5):
+    """ Build a small artifact from random factors. """
+    rng = np.random.default_rng(0)
+    t_fac = tl.cp_tensor.CPTensor((
+        np.ones(rank),
+        [
+            rng.normal(size=(20, rank)),
+            rng.normal(size=(n_cyto, rank)),
+            rng.normal(size=(2, rank))
+        ]
+    ))
+    t_fac.mFactor = rng.normal(size=(n_rna, rank))
+    t_fac.R2X = 0.5
+    model = LogisticRegression().fit(
+        t_fac.factors[0],
+        rng.integers(0, 2, 20)
+    )
+    scaling = {
+        'cytokines': ['IL-10', 'IL-12(p70)', 'IL-6', 'TNFa'][:n_cyto],
+        'cyto_means': rng.normal(size=(2, n_cyto)),
+        'tensor_scale': 2.0,
+        'rna_modules': [f'M{i}' for i in range(n_rna)],
+        'rna_means': rng.normal(size=n_rna),
+        'rna_stds': np.ones(n_rna),
+        'matrix_scale': 0.5
+    }
+    metadata = {'artifact_version': 1, 'rank': rank}
+    return {
+        'factors': t_fac,
+        'scaling': scaling,
+        'model': model,
+        'metadata': metadata
+    }
+
+
+def test_roundtrip(tmp_path):
+    """ Test that a saved artifact scores samples identically. """
+    artifact = make_artifact()
+    path = tmp_path / 'model.npz'
+    save_artifact(artifact, path)
+    loaded = load_artifact(path)
+
+    rng = np.random.default_rng(1)
+    columns = input_columns(artifact)
+    data = pd.DataFrame(
+        np.exp(rng.normal(size=(6, len(columns)))),
+        columns=columns
+    )
+    data.iloc[0, :8] = np.nan
+    data.iloc[1, :] = np.nan
+
+    scores = score_samples(data, artifact)
+    np.testing.assert_allclose(score_samples(data, loaded), scores)
+    assert scores.iloc[1, :].isna().all()
+    assert scores.drop(1).notna().all().all()
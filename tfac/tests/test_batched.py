@@ -0,0 +1,59 @@
+"""
+Test batched CMTF.
+"""
+import numpy as np
+
+from ..batched import perform_CMTF_batched
+from ..cmtf import perform_CMTF
+from ..impute import gen_missing, impute_accuracy_batched
+from ..synthetic import generate_cohort
+
+
+def test_batched():
+    """ Test that replicates fit together as they do alone, and as perform_CMTF. """
+    tensor, matrix, _, _ = generate_cohort(60, rank=3, noise=0.05, seed=6)
+    np.random.seed(0)
+    tensors = np.stack([gen_missing(tensor, 500) for _ in range(4)])
+
+    tFacs = perform_CMTF_batched(tensors, matrix, r=3)
+    alone = perform_CMTF_batched(tensors[2:3], matrix, r=3)[0]
+    assert alone.R2X == tFacs[2].R2X
+    np.testing.assert_allclose(alone.factors[0], tFacs[2].factors[0])
+
+    for tFac, missing in zip(tFacs, tensors):
+        assert tFac.trace.stop_reason == "converged"
+        assert tFac.trace.R2X[-1] == tFac.R2X
+        single, _ = perform_CMTF(missing, matrix, r=3, progress=False)
+        np.testing.assert_allclose(tFac.R2X, single.R2X, atol=1e-3)
+
+    limited = perform_CMTF_batched(tensors, matrix, r=3, tol=0.0,
+                                   max_seconds=0.2)
+    for tFac in limited:
+        assert tFac.trace.stop_reason == "max_seconds"
+        assert tFac.R2X == np.max(tFac.trace.R2X)
+
+
+def test_batched_pca():
+    """ Test that the PCA init fits each replicate as perform_CMTF does. """
+    tensor, matrix, _, _ = generate_cohort(60, rank=3, noise=0.05, seed=8)
+    np.random.seed(0)
+    tensors = np.stack([gen_missing(tensor, 500) for _ in range(2)])
+
+    tFacs = perform_CMTF_batched(tensors, matrix, r=3, init='pca')
+    for tFac, missing in zip(tFacs, tensors):
+        assert tFac.trace.init == 'pca'
+        single, _ = perform_CMTF(missing, matrix, r=3, progress=False)
+        np.testing.assert_allclose(tFac.R2X, single.R2X, atol=1e-4)
+
+
+def test_impute_batched():
+    """ Test batched imputation accuracy on synthetic data. """
+    tensor, matrix, _, _ = generate_cohort(60, rank=3, noise=0.05, seed=7)
+    np.random.seed(0)
+    tensors = np.stack([gen_missing(tensor, 200) for _ in range(3)])
+
+    CMTFR2X, PCAR2X = impute_accuracy_batched(
+        tensors, matrix, np.array([2, 3]), cube=tensor, glyCube=matrix
+    )
+    assert CMTFR2X.shape == PCAR2X.shape == (3, 2)
+    assert np.all(CMTFR2X[:, 1] > 0.9)
@@ -0,0 +1,42 @@
+"""
+Test the benchmark harness on small cases.
+"""
+import numpy as np
+
+from ..benchmarks import block_types, compare, run_case
+from ..synthetic import generate_cohort
+
+
+def test_block_types():
+    """ Test that every synthetic subject keeps at least one block. """
+    type_counts = block_types(0.5)
+    assert len(type_counts) == 7
+    tensor, matrix, _, _ = generate_cohort(
+        50, rank=3, type_counts=type_counts, dtype='float32', seed=0
+    )
+
+    assert tensor.dtype == np.float32
+    measured = np.any(np.isfinite(tensor), axis=(1, 2)) | \
+        np.any(np.isfinite(matrix), axis=1)
+    assert np.all(measured)
+
+
+def test_run_case():
+    """ Test that a case is timed and compared against a baseline. """
+    result = run_case(
+        'perform_CMTF',
+        {'rank': 2, 'n_subjects': 30, 'missing': 0.2, 'dtype': 'float32'},
+        repeat=2
+    )
+
+    assert len(result['walls']) == 2
+    assert result['iterations'] > 0
+    assert result['peak_mb'] > 0.0
+
+    slower = dict(result, wall=result['wall'] * 2.0)
+    comparison = compare(
+        {'results': [slower]},
+        {'results': [result]},
+        threshold=0.5
+    )
+    assert comparison[0]['regressed']
@@ -0,0 +1,77 @@
+"""
+Tests the incremental figure build cache.
+"""
+import pickle
+from os.path import join
+
+from .. import dataImport
+from ..figures import build
+
+
+def test_factors_rebuild(tmp_path, monkeypatch):
+    """ Tests that editing a module not yet imported recomputes factors. """
+    hashes = build.node_hashes()
+    for name in build.node_order(['factors']):
+        func_name = build.NODES[name][0]
+        monkeypatch.setattr(dataImport, func_name,
+                            getattr(dataImport, func_name))
+        with open(join(tmp_path, f'{name}-{hashes[name]}.pkl'), 'wb') as f:
+            pickle.dump(name, f)
+
+    timings = build.compute_nodes(['factors'], hashes, str(tmp_path))
+    assert timings['factors']['loaded']
+
+    # An edit to sparse.py, which importing tfac does not load
+    hash_file = build.hash_file
+    monkeypatch.setattr(
+        build,
+        'hash_file',
+        lambda path: 'edited' if path.endswith('sparse.py')
+        else hash_file(path)
+    )
+    edited = build.node_hashes()
+    assert edited['factors'] != hashes['factors']
+
+    monkeypatch.setattr(dataImport, '_fit_factors', lambda: 'refit')
+    for name in build.node_order(['tensor']):
+        with open(join(tmp_path, f'{name}-{edited[name]}.pkl'), 'wb') as f:
+            pickle.dump(name, f)
+    timings = build.compute_nodes(['factors'], edited, str(tmp_path))
+    assert not timings['factors']['loaded']
+
+
+def test_render_hook(tmp_path, monkeypatch):
+    """ Tests that renders share one audit hook and record their own reads. """
+    class Figure:
+        def __init__(self, data_file):
+            self.data_file = data_file
+
+        def makeFigure(self):
+            with open(self.data_file):
+                pass
+            return self
+
+        def savefig(self, path, **kwargs):
+            open(path, 'w').close()
+
+    data_files = [join(build.DATA_DIR, 'mrsa', 'patient_metadata.txt'),
+                  join(build.DATA_DIR, 'mrsa', 'serum_cytokines.txt')]
+    hooks = []
+    add_hook = build.sys.addaudithook
+
+    def counted(hook):
+        hooks.append(hook)
+        add_hook(hook)
+
+    monkeypatch.setattr(build.sys, 'addaudithook', counted)
+    monkeypatch.setattr(build, '_hooked', False)
+    monkeypatch.setattr(build, 'setup_matplotlib', lambda: None)
+
+    for data_file in data_files:
+        monkeypatch.setattr(build, 'import_module',
+                            lambda name, f=data_file: Figure(f))
+        _, inputs = build.render_figure('X', str(tmp_path))
+        assert list(inputs['data']) == [data_file]
+        assert build._files_read is None
+
+    assert hooks == [build._record_open]
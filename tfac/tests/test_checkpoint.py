@@ -0,0 +1,96 @@
+"""
+Tests checkpointing and resuming fits and sweeps.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from ..checkpoint import Checkpoint, Sweep
+from ..cmtf import perform_CMTF
+from ..synthetic import generate_cohort
+
+
+class Killed(Exception):
+    """ Stands in for the process being killed. """
+
+
+def _kill_at(iteration):
+    """ Callback that stops a fit abruptly at iteration. """
+    def callback(iter, tFac, trace):
+        if iter == iteration:
+            raise Killed()
+    return callback
+
+
+def test_resume_CMTF(tmp_path):
+    """ Tests that a resumed fit is identical to an uninterrupted one. """
+    tensor, matrix, _, _ = generate_cohort(200, rank=3, seed=1)
+    path = tmp_path / "fit.npz"
+
+    np.random.seed(0)
+    full, full_pca = perform_CMTF(tensor, matrix, r=3, progress=False)
+    after_full = np.random.rand()
+
+    np.random.seed(0)
+    with pytest.raises(Killed):
+        perform_CMTF(tensor, matrix, r=3, progress=False,
+                     checkpoint=Checkpoint(path, every=5),
+                     callback=_kill_at(12))
+    assert os.path.exists(path)
+    assert int(Checkpoint(path).load()["trace_n_iter"]) == 10
+
+    np.random.rand(100)
+    resumed, resumed_pca = perform_CMTF(tensor, matrix, r=3, progress=False,
+                                        checkpoint=path)
+    assert not os.path.exists(path)
+    assert np.random.rand() == after_full
+
+    assert resumed.R2X == full.R2X
+    assert resumed.trace.n_iter == full.trace.n_iter
+    np.testing.assert_array_equal(resumed.trace.R2X, full.trace.R2X)
+    np.testing.assert_array_equal(resumed.mFactor, full.mFactor)
+    for resumed_factor, full_factor in zip(resumed.factors, full.factors):
+        np.testing.assert_array_equal(resumed_factor, full_factor)
+    np.testing.assert_array_equal(resumed_pca.factors, full_pca.factors)
+
+    with pytest.raises(ValueError):
+        perform_CMTF(tensor, matrix, r=3, chunk_size=64, checkpoint=path)
+
+
+def test_sweep(tmp_path):
+    """ Tests that a resumed sweep skips done items and matches a full one. """
+    path = tmp_path / "sweep.npz"
+    items = np.arange(6)
+    calls = []
+    kill = []
+
+    def func(item):
+        calls.append(item)
+        if item in kill:
+            raise Killed()
+        return item, np.random.rand()
+
+    np.random.seed(0)
+    full = Sweep(tmp_path / "full.npz").run(func, items)
+    assert not os.path.exists(tmp_path / "full.npz")
+
+    np.random.seed(0)
+    kill.append(4)
+    with pytest.raises(Killed):
+        Sweep(path, every=2).run(func, items)
+
+    calls.clear()
+    kill.clear()
+    resumed = Sweep(path, every=2, keep=True).run(func, items)
+    assert calls == [4, 5]
+    np.testing.assert_array_equal(resumed, full)
+
+    # A kept checkpoint returns the results without calling func
+    calls.clear()
+    np.testing.assert_array_equal(Sweep(path).run(func, items), full)
+    assert calls == []
+
+    Sweep(path, keep=True).run(func, items)
+    with pytest.raises(ValueError):
+        Sweep(path).run(func, items[:3])
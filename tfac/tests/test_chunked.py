@@ -0,0 +1,45 @@
+"""
+Test out-of-core CMTF.
+"""
+import numpy as np
+
+from ..chunked import masked_gram
+from ..cmtf import perform_CMTF
+from ..synthetic import generate_cohort, recovery_scores
+
+
+def test_masked_gram():
+    """ Test the Gram matrices against a direct computation. """
+    rng = np.random.default_rng(0)
+    mask = rng.random((20, 30)) < 0.5
+    mask[10:] = mask[0]
+    factor = rng.standard_normal((30, 4))
+
+    gram = masked_gram(mask, factor)
+    for ii in range(mask.shape[0]):
+        selected = factor[mask[ii]]
+        np.testing.assert_allclose(gram[ii], selected.T @ selected)
+
+
+def test_chunked(tmp_path):
+    """ Test that memory-mapped data give the same fit as in-memory blocks. """
+    tensor, matrix, _, truth = generate_cohort(
+        300, n_modules=50, rank=3, noise=0.01, seed=3
+    )
+    np.save(tmp_path / 'tensor.npy', tensor)
+    np.save(tmp_path / 'matrix.npy', matrix)
+
+    # Both fits start from the same range finder draw
+    np.random.seed(0)
+    tFac, pca = perform_CMTF(tensor, matrix, r=3, chunk_size=64)
+    np.random.seed(0)
+    mapped, _ = perform_CMTF(
+        np.load(tmp_path / 'tensor.npy', mmap_mode='r'),
+        np.load(tmp_path / 'matrix.npy', mmap_mode='r'),
+        r=3
+    )
+
+    assert pca is None
+    assert tFac.R2X > 0.99
+    np.testing.assert_allclose(tFac.R2X, mapped.R2X)
+    assert recovery_scores(tFac, truth)['FMS'] > 0.95
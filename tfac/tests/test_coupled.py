@@ -0,0 +1,47 @@
+"""
+Test coupled factorization of N-way tensors with several matrices.
+"""
+import numpy as np
+import tensorly as tl
+
+from ..coupled import calcR2X_coupled, perform_coupled
+from ..synthetic import generate_cohort, recovery_scores
+
+
+def test_coupled():
+    """ Test a 4-way tensor with matrices coupled on two modes. """
+    rng = np.random.default_rng(0)
+    factors = [rng.standard_normal((n, 3)) for n in (40, 12, 6, 3)]
+    tensor = tl.cp_to_tensor((None, factors))
+    matrices = [
+        (0, factors[0] @ rng.standard_normal((20, 3)).T),
+        (2, factors[2] @ rng.standard_normal((8, 3)).T),
+        (0, factors[0] @ rng.standard_normal((5, 3)).T)
+    ]
+    tensor[rng.random(tensor.shape) < 0.3] = np.nan
+    matrices[0][1][rng.random((40, 20)) < 0.3] = np.nan
+    matrices[2][1][:10] = np.nan
+
+    tFac = perform_coupled(tensor, matrices, r=3, seed=0)
+
+    assert tFac.R2X > 0.999
+    assert tFac.modes == [0, 2, 0]
+    assert [f.shape for f in tFac.mFactors] == [(20, 3), (8, 3), (5, 3)]
+    np.testing.assert_allclose(
+        calcR2X_coupled(tFac, tensor, list(enumerate(m for _, m in matrices))),
+        tFac.R2X
+    )
+
+
+def test_coupled_CMTF():
+    """ Test that one matrix coupled on subjects recovers the CMTF model. """
+    tensor, matrix, _, truth = generate_cohort(
+        300, n_modules=50, rank=3, noise=0.01, seed=3
+    )
+
+    tFac = perform_coupled(tensor, [(0, matrix)], r=3, seed=0)
+    tFac.mFactor = tFac.mFactors[0]
+
+    assert tFac.R2X > 0.99
+    assert tFac.trace.stop_reason == 'converged'
+    assert recovery_scores(tFac, truth)['FMS'] > 0.95
@@ -1,8 +1,11 @@
 """
 Test that we can factor the data.
 """
+import numpy as np
+import pytest
 from ..dataImport import form_tensor
-from ..cmtf import perform_CMTF
+from ..cmtf import INITIALIZERS, _Budget, perform_CMTF, split_budget
+from ..synthetic import generate_cohort
 
 
 def test_CMTF():
@@ -10,3 +13,101 @@ def test_CMTF():
     tensor, matrix, _ = form_tensor()
     tFac, _ = perform_CMTF(tensor, matrix, r=8)
     assert tFac.R2X > 0.0
+
+
+def test_trace():
+    """ Test that the convergence trace is recorded and the callback can stop fitting. """
+    rng = np.random.default_rng(1)
+    tensor = rng.random((30, 8, 2))
+    matrix = rng.random((30, 12))
+    tensor[:4, :, 1] = np.nan
+    matrix[20:, :] = np.nan
+
+    tFac, _ = perform_CMTF(tensor, matrix, r=3, progress=False)
+    trace = tFac.trace
+    assert trace.R2X.shape == (trace.n_iter, )
+    assert trace.R2X[-1] == tFac.R2X
+    assert trace.stop_reason in ("converged", "maxiter")
+    assert np.all(np.isnan(trace.jump) | (trace.jump > 1.0))
+
+    tFac, _ = perform_CMTF(
+        tensor, matrix, r=3, progress=False, callback=lambda ii, *_: ii == 2
+    )
+    assert tFac.trace.n_iter == 3
+    assert tFac.trace.stop_reason == "callback"
+
+
+def test_compress():
+    """ Test that lossless RNA compression gives the uncompressed fit. """
+    tensor, matrix, _, _ = generate_cohort(
+        60, n_modules=300, rank=3, noise=0.2, seed=4
+    )
+
+    np.random.seed(0)
+    tFac, _ = perform_CMTF(tensor, matrix, r=3, progress=False)
+    np.random.seed(0)
+    compressed, _ = perform_CMTF(
+        tensor, matrix, r=3, progress=False, compress=True
+    )
+    assert compressed.trace.n_iter == tFac.trace.n_iter
+    np.testing.assert_allclose(compressed.R2X, tFac.R2X)
+    np.testing.assert_allclose(compressed.mFactor, tFac.mFactor, atol=1e-8)
+
+    np.random.seed(0)
+    truncated, _ = perform_CMTF(tensor, matrix, r=3, progress=False, compress=3)
+    assert truncated.mFactor.shape == tFac.mFactor.shape
+    np.testing.assert_allclose(truncated.R2X, tFac.R2X, rtol=0.01)
+
+
+def test_budget():
+    """ Test the time, factor change and stall stopping criteria. """
+    tensor, matrix, _, _ = generate_cohort(300, rank=4, noise=0.2, seed=5)
+
+    tFac, _ = perform_CMTF(
+        tensor, matrix, r=4, progress=False, tol=0.0, maxiter=100000,
+        max_seconds=0.5
+    )
+    assert tFac.trace.stop_reason == "max_seconds"
+    assert 0 < tFac.trace.n_iter < 100000
+    assert tFac.R2X == np.max(tFac.trace.R2X)
+    assert tFac.trace.R2X[tFac.trace.best_iter] == tFac.R2X
+
+    tFac, _ = perform_CMTF(
+        tensor, matrix, r=4, progress=False, tol=0.0, factor_tol=1e-2
+    )
+    assert tFac.trace.stop_reason == "factor_tol"
+
+    # The best iterate is kept when R2X falls, and stalls are detected
+    budget = _Budget(stall=3, tol=1e-3)
+    factors = [np.ones((2, 1))]
+    for ii, R2X in enumerate([0.5, 0.9, 0.8, 0.9005, 0.85]):
+        reason = budget.step(ii, R2X, factors, np.full((1, 1), ii), factors)
+    assert reason == "stalled"
+    assert budget.best_R2X == 0.9005
+    assert budget.best_iter == 3
+    assert budget.best[1] == 3
+
+    # Time a fit leaves unused goes to those after it
+    shares = list(split_budget(10.0, [1, 2, 2]))
+    np.testing.assert_allclose(shares, [2.0, 5.0, 10.0], rtol=1e-3)
+    assert list(split_budget(None, [1, 2])) == [None, None]
+
+
+def test_init():
+    """ Test each initialization, and starting from a previous fit. """
+    tensor, matrix, _, _ = generate_cohort(200, rank=3, seed=2)
+
+    for init in INITIALIZERS:
+        tFac, _ = perform_CMTF(tensor, matrix, r=3, progress=False, init=init)
+        assert tFac.R2X > 0.5
+        assert tFac.trace.init == init
+        assert tFac.trace.init_time > 0.0
+
+    tFac, _ = perform_CMTF(tensor, matrix, r=3, progress=False)
+    cached, _ = perform_CMTF(tensor, matrix, r=3, progress=False, init=tFac)
+    assert cached.trace.init == "given"
+    assert cached.trace.n_iter <= tFac.trace.n_iter
+    assert cached.R2X >= tFac.R2X - 1e-3
+
+    with pytest.raises(ValueError):
+        perform_CMTF(tensor, matrix, r=3, chunk_size=64, init="em")
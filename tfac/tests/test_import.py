@@ -4,7 +4,10 @@ Test that we can successfully import the datasets.
 import pytest
 import numpy as np
 import pandas as pd
-from ..dataImport import import_patient_metadata, form_tensor, import_rna
+from .. import dataImport
+from ..dataImport import import_patient_metadata, form_tensor, get_factors, \
+    import_rna
+from ..synthetic import generate_cohort
 
 
 @pytest.mark.parametrize("call", [import_patient_metadata, import_rna])
@@ -23,3 +26,24 @@ def test_fullImport():
     assert isinstance(matrix, np.ndarray)
     assert tensor.shape[0] == matrix.shape[0]
     assert isinstance(patient_data, pd.DataFrame)
+
+
+def test_get_factors(monkeypatch):
+    """ Test that cached factors are copied and reseed on every call. """
+    tensor, matrix, patient_data, _ = generate_cohort(60, rank=2, seed=0)
+    monkeypatch.setattr(dataImport, 'form_tensor',
+                        lambda *args: (tensor, matrix, patient_data))
+    dataImport._fit_factors.cache_clear()
+    try:
+        t_fac, _, data = get_factors(r=2)
+        after = np.random.rand()
+        t_fac.factors[0][:] = 0.0
+        data.loc[:, 'type'] = 'edited'
+
+        np.random.rand(10)
+        t_fac, _, data = get_factors(r=2)
+        assert np.random.rand() == after
+        assert np.all(t_fac.factors[0] != 0.0)
+        assert not (data.loc[:, 'type'] == 'edited').any()
+    finally:
+        dataImport._fit_factors.cache_clear()
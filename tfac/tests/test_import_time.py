@@ -0,0 +1,127 @@
+"""
+Test that data loading and scoring entry points import quickly, measured in
+the same way as python -X importtime, and which dependencies importing them
+loads in a fresh interpreter.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Plotting and model fitting dependencies
+HEAVY = ('matplotlib', 'seaborn', 'svgutils', 'statsmodels', 'tensorpack')
+
+# Also kept out of the package import, which only needs dataImport
+FITTING = ('sklearn', 'scipy.optimize', 'tensorpack')
+
+# Recorded cumulative import time of each entry point, relative to that of
+# pandas in the same interpreter, so that the baseline holds on slower or
+# faster machines. Loading sklearn alone adds about 2.5.
+BASELINES = {
+    'tfac.dataImport': 1.5,
+    'tfac.artifact': 3.0,
+    'tfac.serve': 3.1
+}
+TOLERANCE = 1.5
+
+
+def import_times(module):
+    """
+    Imports module in a fresh interpreter with -X importtime.
+
+    Parameters:
+        module (str): module to import
+
+    Returns:
+        times (dict): cumulative microseconds spent importing each module
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def loaded_modules(module):
+    """
+    Imports module in a fresh interpreter.
+
+    Parameters:
+        module (str): module to import
+
+    Returns:
+        modules (list): names of every module loaded
+    """
+    result = subprocess.run(
+        [sys.executable, '-c',
+         f'import sys, {module}; print("\\n".join(sys.modules))'],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return result.stdout.split()
+
+
+def _loads(modules, packages):
+    """ Returns the modules that are, or are within, any of packages. """
+    return [name for name in modules
+            if any(name == package or name.startswith(package + '.')
+                   for package in packages)]
+
+
+@pytest.mark.parametrize(
+    "module",
+    ['tfac', 'tfac.dataImport', 'tfac.artifact', 'tfac.serve', 'tfac.cli',
+     'tfac.figures.common']
+)
+def test_import_time(module):
+    """ Test entry points do not import plotting or fitting dependencies. """
+    modules = loaded_modules(module)
+
+    assert module in modules
+    assert _loads(modules, HEAVY) == []
+    if module in ('tfac', 'tfac.dataImport'):
+        assert _loads(modules, FITTING) == []
+
+
+@pytest.mark.parametrize("module", list(BASELINES))
+def test_import_baseline(module):
+    """ Test entry points import within tolerance of their baseline. """
+    ratios = []
+    for _ in range(3):
+        times = import_times(module)
+        ratios.append(times[module] / times['pandas'])
+
+    assert min(ratios) < BASELINES[module] * TOLERANCE
+
+
+def test_submodules():
+    """ Test that every submodule resolves as an attribute of tfac. """
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    names = sorted(
+        name[:-3] if name.endswith('.py') else name
+        for name in os.listdir(package)
+        if name.endswith('.py') and name != '__init__.py' or
+        os.path.exists(os.path.join(package, name, '__init__.py'))
+    )
+    names.remove('tests')
+    result = subprocess.run(
+        [sys.executable, '-c',
+         'import tfac, types; '
+         f'print(all(isinstance(getattr(tfac, name), types.ModuleType) '
+         f'for name in {names!r}))'],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    assert result.stdout.strip() == 'True'
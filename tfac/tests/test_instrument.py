@@ -0,0 +1,41 @@
+"""
+Test the timing instrumentation.
+"""
+import time
+
+from .. import instrument
+from ..instrument import profiled, span
+
+
+@profiled(name='inner')
+def inner():
+    """ Sleep briefly. """
+    time.sleep(0.01)
+
+
+def test_spans():
+    """ Test that spans nest and are only recorded when enabled. """
+    instrument.reset()
+    instrument.disable()
+    with span('ignored'):
+        inner()
+    assert instrument.spans() == []
+
+    instrument.enable()
+    try:
+        with span('outer'):
+            inner()
+            inner()
+    finally:
+        instrument.disable()
+
+    records = instrument.spans()
+    assert [r['name'] for r in records] == ['outer']
+    assert [c['name'] for c in records[0]['children']] == ['inner', 'inner']
+    assert records[0]['wall'] >= sum(c['wall'] for c in records[0]['children'])
+    assert records[0]['children'][0]['wall'] >= 0.01
+
+    lines = dict(line.rsplit(' ', 1) for line in instrument.collapsed())
+    assert set(lines) == {'outer', 'outer;inner'}
+    assert int(lines['outer;inner']) >= 20000
+    instrument.reset()
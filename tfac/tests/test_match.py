@@ -0,0 +1,57 @@
+"""
+Tests matching and aligning components across fits.
+"""
+import numpy as np
+import pytest
+import tensorly as tl
+
+from ..match import align_fits, pairwise_match
+from ..synthetic import generate_cohort
+
+
+def _shuffled(truth, rng, noise=0.0):
+    """ A copy of a fit with its components permuted and signs flipped. """
+    order = rng.permutation(truth.rank)
+    flip = rng.choice([-1.0, 1.0], size=(2, truth.rank))
+    signs = [flip[0], flip[1], flip[0] * flip[1]]
+    factors = [
+        (factor + noise * rng.standard_normal(factor.shape))[:, order] * sign
+        for factor, sign in zip(truth.factors, signs)
+    ]
+    fit = tl.cp_tensor.CPTensor((truth.weights[order], factors))
+    fit.mFactor = truth.mFactor[:, order] * flip[0]
+    return fit, order
+
+
+def test_align_fits():
+    """ Tests that shuffled copies of a fit are matched back onto it. """
+    _, _, _, truth = generate_cohort(100, rank=4, seed=3)
+    truth.weights = np.arange(1.0, 5.0)
+    rng = np.random.default_rng(0)
+    fits = [truth] + [_shuffled(truth, rng, noise=0.01)[0] for _ in range(20)]
+    fit, order = _shuffled(truth, rng)
+    fits.append(fit)
+
+    scores, permutation, signs = pairwise_match(fits)
+    assert scores.shape == permutation.shape == (22, 22, 4)
+    assert signs.shape == (22, 22, 4, 4)
+    np.testing.assert_array_equal(permutation[0, -1], np.argsort(order))
+    np.testing.assert_array_equal(permutation[-1, 0], order)
+    assert np.all(scores > 0.9)
+
+    reference, stacks, stability = align_fits(fits, reference=0)
+    assert reference == 0
+    np.testing.assert_allclose(stacks['subjects'][-1], truth.factors[0])
+    np.testing.assert_allclose(stacks['RNA'][-1], truth.mFactor)
+    np.testing.assert_allclose(stacks['weights'][-1], truth.weights)
+    assert np.all(stability['reproduced'] == 1.0)
+    assert np.all(stability[['subjects', 'cytokines', 'sources', 'RNA']] > 0.9)
+
+    # An unrelated fit is not reproduced, and is not chosen as reference
+    _, _, _, other = generate_cohort(100, rank=4, seed=4)
+    reference, _, stability = align_fits(fits + [other])
+    assert reference != len(fits)
+    assert np.all(stability['FMS StD'] > 0.0)
+
+    with pytest.raises(ValueError):
+        pairwise_match(fits[:1])
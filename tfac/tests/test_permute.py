@@ -0,0 +1,85 @@
+"""
+Test the permutation testing of prediction accuracy.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+
+from ..permute import batched_elastic_net, batched_logistic, \
+    permutation_test
+from ..predict import get_accuracy, predict_known
+
+
+def make_data(signal, n_samples=60):
+    """ Two features, the first shifted by signal in positive samples. """
+    rng = np.random.default_rng(0)
+    labels = pd.Series(rng.integers(0, 2, n_samples))
+    data = pd.DataFrame(rng.normal(size=(n_samples, 2)))
+    data.loc[:, 0] += signal * labels
+    return data, labels
+
+
+def test_batched_logistic():
+    """ Test that the batched fit matches scikit-learn. """
+    data, labels = make_data(1.0)
+    design = np.hstack((data.to_numpy(), np.ones((data.shape[0], 1))))
+    coef = batched_logistic(design, labels.to_numpy()[np.newaxis, :], C=0.5)
+
+    model = LogisticRegression(C=0.5, tol=1E-10).fit(data, labels)
+    np.testing.assert_allclose(coef[0, :-1], model.coef_[0], rtol=1E-4)
+    np.testing.assert_allclose(coef[0, -1], model.intercept_[0], rtol=1E-4)
+
+
+def test_batched_elastic_net():
+    """ Test that the batched elastic-net fit matches scikit-learn. """
+    data, labels = make_data(1.0)
+    design = np.hstack((data.to_numpy(), np.ones((data.shape[0], 1))))
+    coef = batched_elastic_net(
+        design, labels.to_numpy()[np.newaxis, :], C=0.5, l1_ratio=0.8
+    )
+
+    model = LogisticRegression(
+        C=0.5, l1_ratio=0.8, penalty='elasticnet', solver='saga',
+        max_iter=100000, tol=1E-10
+    ).fit(data, labels)
+    np.testing.assert_allclose(coef[0, :-1], model.coef_[0], atol=1E-5)
+    np.testing.assert_allclose(coef[0, -1], model.intercept_[0], atol=1E-5)
+
+
+def test_permutation_test():
+    """ Test that p-values separate signal from noise. """
+    data, labels = make_data(3.0)
+    accuracy, p_value, null = permutation_test(
+        data,
+        labels,
+        n_permutations=99,
+        batch_size=40,
+        n_jobs=1,
+        random_state=0
+    )
+    assert null.shape == (99,)
+    assert accuracy > 0.8
+    assert p_value == 0.01
+
+    # With its hyperparameters, the observed accuracy is that of
+    # predict_known
+    predictions, model = predict_known(data, labels.astype(str), n_jobs=1)
+    accuracy, _, _ = permutation_test(
+        data,
+        labels,
+        n_permutations=9,
+        C=model.C,
+        l1_ratio=model.l1_ratio,
+        n_jobs=1
+    )
+    assert accuracy == get_accuracy(predictions, labels)
+
+    data, labels = make_data(0.0)
+    _, p_value, _ = permutation_test(
+        data,
+        labels,
+        n_permutations=99,
+        n_jobs=1,
+        random_state=0
+    )
+    assert p_value > 0.05
@@ -0,0 +1,39 @@
+"""
+Test cross-validated rank selection.
+"""
+import numpy as np
+
+from ..rank import cv_folds, select_rank
+from ..synthetic import generate_cohort
+
+
+def test_cv_folds():
+    """ Test that folds hold out observed values, keeping enough of each subject and chord. """
+    tensor, matrix, _, _ = generate_cohort(80, rank=2, seed=8)
+    tFolds, mFolds = cv_folds(tensor, matrix, n_folds=4, emin=6, seed=0)
+
+    assert np.all(tFolds[~np.isfinite(tensor)] == -1)
+    assert np.all(mFolds[~np.all(np.isfinite(matrix), axis=1)] == -1)
+    counts = np.bincount(tFolds[tFolds >= 0])
+    assert counts.size == 4 and counts.max() - counts.min() <= 1
+
+    for fold in range(4):
+        train = np.isfinite(tensor) & (tFolds != fold)
+        measured = np.any(np.isfinite(tensor), axis=(1, 2))
+        assert np.all(np.sum(train, axis=(1, 2))[measured] >= 6)
+        chords = np.any(np.isfinite(tensor), axis=0)
+        assert np.all(np.sum(train, axis=0)[chords] >= 6)
+        assert np.any(np.all(np.isfinite(matrix[mFolds != fold]), axis=1))
+
+
+def test_select_rank():
+    """ Test that cross-validation finds the rank of a synthetic cohort. """
+    tensor, matrix, _, _ = generate_cohort(80, rank=2, noise=0.2, seed=9)
+    rank, Q2X = select_rank(
+        tensor, matrix, max_rank=5, n_folds=3, n_jobs=1, seed=0
+    )
+
+    assert rank == 2
+    assert Q2X.index[0] == 1 and Q2X.index[-1] < 5
+    assert np.all(Q2X['lower'] <= Q2X['mean'])
+    assert np.all(Q2X['mean'] <= Q2X['upper'])
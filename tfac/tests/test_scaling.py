@@ -0,0 +1,29 @@
+"""
+Test the variance scaling search.
+"""
+import numpy as np
+import pytest
+
+from ..scaling import scaling_search
+from ..synthetic import generate_cohort
+
+
+def test_scaling_search():
+    """ Test that the search refines to where the tensor and matrix R2X cross. """
+    tensor, matrix, _, _ = generate_cohort(
+        80, rank=2, noise=0.3, variance_scaling=1.0, seed=10
+    )
+    scaling, path = scaling_search(
+        tensor, matrix, r=2, bounds=(-6.0, 6.0), coarse=4, xtol=0.5,
+        n_jobs=1, seed=0
+    )
+
+    assert len(path) < 13
+    assert np.log2(scaling) == path['score'].idxmax()
+    assert np.all(path['score'] == np.minimum(path['Tensor'], path['Matrix']))
+    gap = np.abs(path['Tensor'] - path['Matrix'])
+    coarse = np.linspace(-6.0, 6.0, 4)
+    assert gap[np.log2(scaling)] <= np.min(gap[coarse])
+
+    with pytest.raises(ValueError):
+        scaling_search(tensor, matrix, criterion='accuracy')
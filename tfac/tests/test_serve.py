@@ -0,0 +1,91 @@
+"""
+Test the micro-batching scoring service.
+"""
+import asyncio
+import json
+import socket
+
+import numpy as np
+import pandas as pd
+
+from ..artifact import input_columns, score_samples
+from ..serve import ScoringServer
+from .test_artifact import make_artifact
+
+
+async def _request(path, request):
+    """ Sends one request on its own connection. """
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(json.dumps(request).encode() + b'\n')
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    writer.close()
+    return response
+
+
+async def _exercise(server, path, samples):
+    """ Starts the server, sends concurrent requests, then stops it. """
+    task = asyncio.create_task(server.serve(path=path))
+    while True:
+        try:
+            await _request(path, {'op': 'metrics'})
+            break
+        except (ConnectionRefusedError, FileNotFoundError):
+            await asyncio.sleep(0.01)
+
+    requests = [
+        {'id': ii, 'op': 'score' if ii % 2 else 'project', 'sample': sample}
+        for ii, sample in enumerate(samples)
+    ]
+    requests.append({'id': 'bad', 'op': 'score',
+                     'sample': {input_columns(server.artifact)[0]: 'high'}})
+    responses = await asyncio.gather(
+        *[_request(path, request) for request in requests]
+    )
+    metrics = await _request(path, {'op': 'metrics'})
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return responses, metrics
+
+
+def test_server(tmp_path):
+    """ Test scoring over a Unix socket, batching and request errors. """
+    artifact = make_artifact()
+    columns = input_columns(artifact)
+    rng = np.random.default_rng(2)
+    data = pd.DataFrame(
+        np.exp(rng.normal(size=(8, len(columns)))),
+        columns=columns
+    )
+    expected = score_samples(data, artifact).to_numpy()
+
+    # A socket file left by a server that crashed
+    path = str(tmp_path / 'score.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+
+    server = ScoringServer(artifact, max_delay=0.05)
+    responses, metrics = asyncio.run(
+        _exercise(server, path, data.to_dict(orient='records'))
+    )
+
+    for ii, response in enumerate(responses[:-1]):
+        assert response['id'] == ii
+        np.testing.assert_allclose(response['components'],
+                                   expected[ii, :-2])
+        if ii % 2:
+            assert response['prediction'] == expected[ii, -2]
+            np.testing.assert_allclose(response['probability'],
+                                       expected[ii, -1])
+        else:
+            assert 'probability' not in response
+
+    # Only the malformed request fails, and requests were batched
+    assert 'must be a number' in responses[-1]['error']
+    assert metrics['metrics']['requests'] == 8
+    assert metrics['metrics']['mean_batch'] > 1.0
@@ -0,0 +1,62 @@
+"""
+Tests shared-memory transport to process pools.
+"""
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tfac import shared
+from tfac.shared import SharedData
+
+
+def _sum(key):
+    """ Sums shared data in a worker. """
+    return float(np.nansum(np.asarray(shared.get(key), dtype=float)))
+
+
+def test_round_trip():
+    """ Tests that shared data reads back unchanged and read-only. """
+    array = np.random.rand(5, 4, 3)
+    array[0, 0, 0] = np.nan
+    frame = pd.DataFrame(np.random.rand(4, 2), index=list('abcd'),
+                         columns=['x', 'y'])
+    labels = pd.Series(['0', '1', 'Unknown'], index=['a', 'b', 'c'])
+
+    with SharedData(array=array, frame=frame, labels=labels) as data:
+        shared.attach(data.handles)
+        np.testing.assert_array_equal(shared.get('array'), array)
+        pd.testing.assert_frame_equal(shared.get('frame'), frame)
+        pd.testing.assert_series_equal(shared.get('labels'), labels)
+
+        with pytest.raises(ValueError):
+            shared.get('array')[0, 0, 0] = 1.0
+        assert data.handles['labels'][0] == 'pickle'
+
+
+def test_integer_columns():
+    """ Tests sharing a frame with integer column labels not starting at 0. """
+    frame = pd.DataFrame(np.random.rand(4, 3), columns=[1, 2, 3])
+
+    with SharedData(frame=frame) as data:
+        shared.attach(data.handles)
+        assert data.handles['frame'][0] == 'frame'
+        pd.testing.assert_frame_equal(shared.get('frame'), frame)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_map(max_workers):
+    """ Tests that workers read shared data, and that close removes it. """
+    array = np.arange(12.0).reshape(3, 4)
+    frame = pd.DataFrame(array)
+    data = SharedData(array=array, frame=frame)
+    names = data.names
+
+    results = data.map(_sum, ['array', 'frame'], max_workers=max_workers)
+    assert results == [np.sum(array)] * 2
+
+    data.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
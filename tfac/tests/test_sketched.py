@@ -0,0 +1,37 @@
+"""
+Test sketched ALS.
+"""
+import numpy as np
+
+from ..chunked import perform_CMTF_chunked
+from ..sketched import leverage, perform_CMTF_sketched
+from ..synthetic import generate_cohort
+
+
+def test_leverage():
+    """ Test that leverage sampling favors rows that determine the fit. """
+    rng = np.random.default_rng(0)
+    A = rng.standard_normal((100, 3))
+    A[0] *= 100.0
+
+    p = leverage(A)
+    np.testing.assert_allclose(np.sum(p), 1.0)
+    assert np.argmax(p) == 0
+    assert np.min(p) >= 0.1 / 100
+
+
+def test_sketched():
+    """ Test that the sketched fit finishes at the exact solver's R2X. """
+    tensor, matrix, _, _ = generate_cohort(
+        3000, n_modules=50, rank=3, noise=0.05, seed=5
+    )
+
+    exact = perform_CMTF_chunked(tensor, matrix, r=3, seed=0)
+    tFac = perform_CMTF_sketched(tensor, matrix, r=3, sketch_size=60, seed=0)
+    sketch = tFac.trace.sketch
+
+    assert sketch[0] == 60
+    assert np.all(sketch[-2:] == 0)
+    assert np.all(np.diff(sketch[sketch > 0]) >= 0)
+    assert tFac.trace.stop_reason == 'converged'
+    np.testing.assert_allclose(tFac.R2X, exact.R2X, atol=1e-4)
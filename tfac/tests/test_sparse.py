@@ -0,0 +1,56 @@
+"""
+Test CMTF over sparse observed entries.
+"""
+import numpy as np
+import tensorly as tl
+
+from ..cmtf import perform_CMTF, calcR2X
+from ..sparse import ObservedTensor
+from ..synthetic import generate_cohort, recovery_scores
+
+
+def test_round_trip():
+    """ Test that dense tensors are stored and restored exactly. """
+    tensor, _, _, _ = generate_cohort(50, entry_missing=0.5, seed=1)
+    observed = ObservedTensor.from_dense(tensor, chunk_size=16)
+
+    assert observed.nnz == np.sum(np.isfinite(tensor))
+    np.testing.assert_array_equal(observed.to_dense(), tensor)
+
+    rows = slice(16, 32)
+    unfolded = np.nan_to_num(tl.unfold(tensor[rows], 0))
+    np.testing.assert_allclose(observed.unfolded(rows).toarray(), unfolded)
+
+
+def test_sparse_R2X():
+    """ Test that R2X over observed entries matches the dense calculation. """
+    tensor, matrix, _, truth = generate_cohort(
+        60, rank=3, entry_missing=0.3, seed=2
+    )
+    truth.weights = np.arange(1.0, 4.0)
+    observed = ObservedTensor.from_dense(tensor)
+
+    for mIn in (matrix, None):
+        np.testing.assert_allclose(
+            calcR2X(truth, observed, mIn),
+            calcR2X(truth, tensor, mIn)
+        )
+
+
+def test_sparse_CMTF():
+    """ Test that fitting observed entries gives the dense out-of-core fit. """
+    tensor, matrix, _, truth = generate_cohort(
+        300, n_modules=50, rank=3, noise=0.01, seed=3
+    )
+    tensor[np.random.default_rng(3).random(tensor.shape) < 0.5] = np.nan
+    observed = ObservedTensor.from_dense(tensor, chunk_size=64)
+
+    np.random.seed(0)
+    tFac, pca = perform_CMTF(observed, matrix, r=3)
+    np.random.seed(0)
+    dense, _ = perform_CMTF(tensor, matrix, r=3, chunk_size=64)
+
+    assert pca is None
+    assert tFac.R2X > 0.99
+    np.testing.assert_allclose(tFac.trace.R2X[:5], dense.trace.R2X[:5])
+    assert recovery_scores(tFac, truth)['FMS'] > 0.95
@@ -0,0 +1,44 @@
+"""
+Test the component subset search.
+"""
+import numpy as np
+import pandas as pd
+from ..subsets import search_subsets
+
+
+def make_components(n_samples=60, n_components=4):
+    """ Components where only the first is informative. """
+    rng = np.random.default_rng(0)
+    labels = pd.Series(rng.integers(0, 2, n_samples))
+    components = pd.DataFrame(
+        rng.normal(size=(n_samples, n_components)),
+        columns=list(range(1, n_components + 1))
+    )
+    components.loc[:, 1] += 3 * labels
+    return components, labels
+
+
+def test_exhaustive():
+    """ Test that every subset is ranked. """
+    components, labels = make_components()
+    results = search_subsets(components, labels, n_jobs=1)
+
+    assert results.shape[0] == 2 ** components.shape[1] - 1
+    assert 1 in results.loc[0, 'Components']
+    assert np.all(np.diff(results.loc[:, 'Accuracy']) <= 0)
+
+
+def test_beam():
+    """ Test that the beam search evaluates fewer subsets. """
+    components, labels = make_components()
+    results = search_subsets(
+        components,
+        labels,
+        svc=False,
+        cs=[1.0],
+        beam_width=1,
+        n_jobs=1
+    )
+
+    assert results.shape[0] < 2 ** components.shape[1] - 1
+    assert 1 in results.loc[0, 'Components']
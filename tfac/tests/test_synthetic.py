@@ -0,0 +1,35 @@
+"""
+Test the synthetic data generator and factor recovery scores.
+"""
+import numpy as np
+
+from ..cmtf import perform_CMTF
+from ..synthetic import generate_cohort, recovery_scores, type_blocks
+
+
+def test_generate_cohort():
+    """ Test that missingness follows each subject's data type. """
+    tensor, matrix, patient_data, truth = generate_cohort(300, rank=3, seed=1)
+
+    assert tensor.shape == (300, 38, 2)
+    assert matrix.shape == (300, 40)
+    assert truth.mFactor.shape == (40, 3)
+    for ii, data_type in enumerate(patient_data['type']):
+        serum, plasma, rna = type_blocks(data_type)
+        assert np.all(np.isfinite(tensor[ii, :, 0])) == serum
+        assert np.all(np.isfinite(tensor[ii, :, 1])) == plasma
+        assert np.all(np.isfinite(matrix[ii])) == rna
+
+
+def test_recovery():
+    """ Test that CMTF recovers the factors of a noiseless cohort. """
+    tensor, matrix, _, truth = generate_cohort(
+        200, rank=2, noise=0.0, seed=2
+    )
+    np.random.seed(0)
+    tFac, _ = perform_CMTF(tensor, matrix, r=2, progress=False)
+    scores = recovery_scores(tFac, truth)
+
+    assert scores['FMS'] > 0.95
+    assert sorted(scores['matching']) == [0, 1]
+    assert recovery_scores(truth, truth)['FMS'] > 0.999